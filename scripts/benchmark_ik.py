@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2016, BRML
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import argparse
+import time
+
+import numpy as np
+import rospy
+from baxter_core_msgs.srv import (
+    SolvePositionIK,
+    SolvePositionIKRequest
+)
+from geometry_msgs.msg import PoseStamped
+from std_msgs.msg import Header
+from tf import transformations
+
+from hardware.kinematics import KinematicChain
+
+
+def sample_targets(chain, n, seed):
+    """Sample random joint configurations and compute the corresponding
+    poses of the gripper.
+
+    :param chain: The KinematicChain of the limb.
+    :param n: The number of configurations to sample.
+    :param seed: The seed of the random number generator.
+    :return: A tuple (configs, targets) of a (n, 7) and a (n, 4, 4) numpy
+        array.
+    """
+    rng = np.random.RandomState(seed)
+    # stay clear of the joint limits
+    margin = 0.1*(chain.upper - chain.lower)
+    configs = chain.lower + margin + \
+        (chain.upper - chain.lower - 2.0*margin)*rng.random_sample((n, len(chain)))
+    return configs, chain.fk(configs)
+
+
+def benchmark_local(chain, configs, targets):
+    """Time forward and inverse kinematics with the kinematic model.
+
+    :param chain: The KinematicChain of the limb.
+    :param configs: A (N, 7) numpy array of joint angles.
+    :param targets: A (N, 4, 4) numpy array of the corresponding poses.
+    :return: A list of tuples (name, success rate, run time per pose in
+        milliseconds).
+    """
+    results = list()
+    start = time.time()
+    chain.fk(configs)
+    results.append(('fk, batch', 1.0,
+                    1e3*(time.time() - start)/len(configs)))
+
+    rng = np.random.RandomState(0)
+    seeds = np.clip(configs + rng.normal(0.0, 0.1, configs.shape),
+                    chain.lower, chain.upper)
+    candidates = [
+        ('ik, batch, unseeded', None),
+        ('ik, batch, seeded', seeds)
+    ]
+    for name, s in candidates:
+        start = time.time()
+        valid, _ = chain.ik(targets=targets, seeds=s, seed=0)
+        results.append((name, valid.mean(),
+                        1e3*(time.time() - start)/len(configs)))
+    start = time.time()
+    valid = [chain.ik(targets=targets[i:i + 1], seeds=seeds[i:i + 1],
+                      seed=0)[0][0]
+             for i in range(len(targets))]
+    results.append(('ik, single, seeded', np.mean(valid),
+                    1e3*(time.time() - start)/len(configs)))
+    return results
+
+
+def benchmark_service(arm, targets):
+    """Time the inverse kinematics service of the robot (or of the
+    simulator standing in for it).
+
+    :param arm: The arm <'left', 'right'>.
+    :param targets: A (N, 4, 4) numpy array of poses.
+    :return: A list of tuples (name, success rate, run time per pose in
+        milliseconds).
+    """
+    node = "ExternalTools/" + arm + "/PositionKinematicsNode/IKService"
+    rospy.wait_for_service(node, 5.0)
+    service = rospy.ServiceProxy(node, SolvePositionIK, persistent=True)
+    poses = list()
+    for target in targets:
+        pose = PoseStamped(header=Header(stamp=rospy.Time.now(),
+                                         frame_id='base'))
+        pose.pose.position.x, pose.pose.position.y, pose.pose.position.z = \
+            target[:3, 3]
+        q = transformations.quaternion_from_matrix(target)
+        pose.pose.orientation.x, pose.pose.orientation.y, \
+            pose.pose.orientation.z, pose.pose.orientation.w = q
+        poses.append(pose)
+
+    results = list()
+    start = time.time()
+    request = SolvePositionIKRequest()
+    request.pose_stamp = poses
+    response = service(request)
+    results.append(('service, batch', np.mean(response.isValid),
+                    1e3*(time.time() - start)/len(poses)))
+    start = time.time()
+    valid = list()
+    for pose in poses:
+        request = SolvePositionIKRequest()
+        request.pose_stamp.append(pose)
+        valid.append(service(request).isValid[0])
+    results.append(('service, single', np.mean(valid),
+                    1e3*(time.time() - start)/len(poses)))
+    service.close()
+    return results
+
+
+def main():
+    """Compare the forward and inverse kinematics of the kinematic model of
+    Baxter's limbs with the inverse kinematics service of the robot or the
+    simulator.
+
+    Usage:
+        rosrun baxter_pick_and_place benchmark_ik.py [-n N] [-a ARM] [--service]
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('-n', '--n_poses', type=int, default=200,
+                        help='The number of random poses to solve for.')
+    parser.add_argument('-a', '--arm', choices=['left', 'right'],
+                        default='left', help='The arm to solve for.')
+    parser.add_argument('--service', action='store_true',
+                        help='Also time the inverse kinematics service '
+                             '(needs a running robot or simulator).')
+    args = parser.parse_args(rospy.myargv()[1:])
+
+    chain = KinematicChain.baxter(args.arm)
+    configs, targets = sample_targets(chain=chain, n=args.n_poses, seed=42)
+    results = benchmark_local(chain=chain, configs=configs, targets=targets)
+    if args.service:
+        rospy.init_node('benchmark_ik', anonymous=True)
+        results += benchmark_service(arm=args.arm, targets=targets)
+    print 'Solving for {} random poses of the {} arm.'.format(args.n_poses,
+                                                              args.arm)
+    for name, rate, t in results:
+        print '  {:22s} {:6.1%} {:8.3f} ms/pose'.format(name, rate, t)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2016, BRML
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import timeit
+
+import numpy as np
+
+import cv_bridge
+
+from hardware import img_to_imgmsg, imgmsg_to_img
+
+
+def legacy_imgmsg_to_img(imgmsg):
+    """The former cv_bridge based conversion, trying one encoding after the
+    other with a new CvBridge instance per attempt.
+    """
+    img = None
+    for enc in ['bgr8', 'mono8', 'passthrough']:
+        try:
+            img = cv_bridge.CvBridge().imgmsg_to_cv2(imgmsg, enc)
+        except cv_bridge.CvBridgeError:
+            pass
+        if img is not None:
+            break
+    return img
+
+
+def legacy_img_to_imgmsg(img):
+    """The former cv_bridge based conversion, trying one encoding after the
+    other with a new CvBridge instance per attempt.
+    """
+    imgmsg = None
+    for enc in ['bgr8', 'mono8', 'passthrough']:
+        try:
+            imgmsg = cv_bridge.CvBridge().cv2_to_imgmsg(img, enc)
+        except cv_bridge.CvBridgeError:
+            pass
+        if imgmsg is not None:
+            break
+    return imgmsg
+
+
+def make_image(encoding, size):
+    """Create a random test image with the given ROS encoding.
+
+    :param encoding: One of <'bgr8', 'mono8', '16UC1', '32FC1'>.
+    :param size: The image size (height, width).
+    :return: The image as numpy array.
+    """
+    h, w = size
+    if encoding == 'bgr8':
+        return np.random.randint(0, 256, (h, w, 3)).astype(np.uint8)
+    elif encoding == 'mono8':
+        return np.random.randint(0, 256, (h, w)).astype(np.uint8)
+    elif encoding == '16UC1':
+        return np.random.randint(500, 4500, (h, w)).astype(np.uint16)
+    elif encoding == '32FC1':
+        return np.random.uniform(0.5, 4.5, (h, w)).astype(np.float32)
+    raise ValueError("No test image for encoding '{}'!".format(encoding))
+
+
+def benchmark(encoding, size, n):
+    """Time the conversion from and to ROS image messages for the new and
+    the cv_bridge based implementation.
+
+    :param encoding: The ROS image encoding to test.
+    :param size: The image size (height, width).
+    :param n: The number of repetitions.
+    :return: A dictionary of mean run times in milliseconds.
+    """
+    img = make_image(encoding=encoding, size=size)
+    msg = cv_bridge.CvBridge().cv2_to_imgmsg(img, encoding)
+    bridge = cv_bridge.CvBridge()
+    desired = 'bgr8' if encoding in ['bgr8', 'mono8'] else 'passthrough'
+    if not np.array_equal(imgmsg_to_img(imgmsg=msg),
+                          bridge.imgmsg_to_cv2(msg, desired)):
+        raise RuntimeError("Conversion results differ for {}!".format(encoding))
+
+    candidates = [
+        ('to img, legacy', lambda: legacy_imgmsg_to_img(msg)),
+        ('to img, cv_bridge', lambda: bridge.imgmsg_to_cv2(msg, desired)),
+        ('to img, new', lambda: imgmsg_to_img(msg)),
+        ('to msg, legacy', lambda: legacy_img_to_imgmsg(img)),
+        ('to msg, cv_bridge', lambda: bridge.cv2_to_imgmsg(img, encoding)),
+        ('to msg, new', lambda: img_to_imgmsg(img))
+    ]
+    return [(name, 1e3*min(timeit.repeat(func, number=n, repeat=3))/n)
+            for name, func in candidates]
+
+
+def main():
+    """Compare the zero-copy image message conversion with the cv_bridge
+    based conversion for the encodings used in the demonstration.
+
+    Usage:
+        rosrun baxter_pick_and_place benchmark_image_conversion.py
+    """
+    size = (800, 1280)
+    n = 50
+    print 'Converting {}x{} images, best of 3 x {} runs.'.format(size[1],
+                                                                 size[0], n)
+    for encoding in ['bgr8', 'mono8', '16UC1', '32FC1']:
+        print encoding
+        for name, t in benchmark(encoding=encoding, size=size, n=n):
+            print '  {:20s} {:8.3f} ms'.format(name, t)
+
+
+if __name__ == '__main__':
+    main()
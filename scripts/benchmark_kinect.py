@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2016, BRML
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import argparse
+import logging
+import multiprocessing
+import numpy as np
+import time
+
+from hardware.elte_kinect import ElteKinectClient, ElteKinectServer
+
+
+def benchmark(address, n, color, depth, skeleton, **kwargs):
+    """Measure latency and throughput of requests to the server.
+
+    :param address: The (host, port) tuple of the server.
+    :param n: The number of requests to send.
+    :param color: Whether to request color images.
+    :param depth: Whether to request depth images.
+    :param skeleton: Whether to request skeleton data.
+    :param kwargs: Keyword arguments passed on to the client.
+    :return: A tuple (latencies in seconds, frames per second, receive and
+        decode statistics per stream).
+    """
+    client = ElteKinectClient(host=address[0], port=address[1],
+                              prefix='benchmark', **kwargs)
+    latencies = np.empty(n)
+    start = time.time()
+    for i in xrange(n):
+        t = time.time()
+        client.request(color=color, depth=depth, skeleton=skeleton)
+        latencies[i] = time.time() - t
+    fps = n/(time.time() - start)
+    client.close()
+    return latencies, fps, client.stats
+
+
+def serve(queue, **kwargs):
+    """Run the stand-in server until the process is terminated.
+
+    :param queue: A queue to put the address of the server into.
+    :param kwargs: Keyword arguments passed on to the server.
+    :return:
+    """
+    server = ElteKinectServer(**kwargs)
+    server.start()
+    queue.put(server.address)
+    while True:
+        time.sleep(1.0)
+
+
+def main():
+    """Benchmark the client for the ELTE Kinect Windows tool against a local
+    stand-in server speaking the same protocol.
+
+    Usage:
+        rosrun baxter_pick_and_place benchmark_kinect.py [-n N] [-r RATE]
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('-n', '--n_requests', type=int, default=100,
+                        help='The number of requests per mode.')
+    parser.add_argument('-r', '--frame_rate', type=float, default=30.0,
+                        help='The frame rate of the emulated sensor (0 for '
+                             'answering requests immediately).')
+    parser.add_argument('--one_shot', action='store_true',
+                        help='Let the server close the connection after '
+                             'each request.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    # run the server in its own process to not compete for the GIL
+    queue = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve, args=(queue,),
+                                     kwargs=dict(frame_rate=args.frame_rate,
+                                                 one_shot=args.one_shot))
+    server.daemon = True
+    server.start()
+    address = queue.get(timeout=10.0)
+    modes = [
+        ('connect per request', dict(persistent=False, pipeline=False)),
+        ('persistent', dict(persistent=True, pipeline=False)),
+        ('persistent, pipelined', dict(persistent=True, pipeline=True))
+    ]
+    streams = [
+        ('color', dict(color=True, depth=False, skeleton=False)),
+        ('depth', dict(color=False, depth=True, skeleton=False)),
+        ('all', dict(color=True, depth=True, skeleton=True))
+    ]
+    print 'Stand-in server on {}:{} emulating {} fps, {} requests ' \
+          'per mode.'.format(address[0], address[1], args.frame_rate,
+                             args.n_requests)
+    try:
+        for stream, flags in streams:
+            print stream
+            for mode, kwargs in modes:
+                kwargs.update(flags)
+                latencies, fps, stats = benchmark(address=address,
+                                                  n=args.n_requests, **kwargs)
+                print '  {:22s} latency {:7.2f} ms (median {:7.2f} ms, ' \
+                      'max {:7.2f} ms), {:6.1f} requests/s'.format(
+                          mode, 1e3*latencies.mean(),
+                          1e3*np.median(latencies), 1e3*latencies.max(), fps)
+                for name in ('color', 'depth', 'skeleton'):
+                    if stats[name]['receive'].count == 0:
+                        continue
+                    t_receive = stats[name]['receive'].total
+                    print '    {:8s} {:7.1f} MB/s'.format(
+                        name, 1e-6*stats[name]['bytes']/t_receive)
+                    print '      receive: {}'.format(stats[name]['receive'])
+                    print '      decode:  {}'.format(stats[name]['decode'])
+    finally:
+        server.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2016, BRML
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import argparse
+import logging
+import os
+import time
+
+import numpy as np
+import rospkg
+
+from hardware.kinematics import KinematicChain
+from hardware.reachability import ReachabilityMap
+from settings import settings
+
+
+def main():
+    """Precompute the map of positions within the robot's task space the
+    limbs can reach with the gripper pointing down, using the kinematic
+    model of the limbs. The map is stored in data/setup/reachability.npz
+    and used by the demonstration for feasibility checks and sampling.
+
+    Usage:
+        rosrun baxter_pick_and_place compute_reachability.py [-r RESOLUTION]
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('-r', '--resolution', type=float, default=0.02,
+                        help='The edge length of a voxel in meters.')
+    parser.add_argument('-o', '--output', default=None,
+                        help='The file name to write the map to.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    filename = args.output
+    if filename is None:
+        ns = rospkg.RosPack().get_path('baxter_pick_and_place')
+        filename = os.path.join(ns, 'data', 'setup', 'reachability.npz')
+
+    arms = ['left', 'right']
+    chains = {a: KinematicChain.baxter(a) for a in arms}
+    # start from the neutral configuration of the limbs
+    neutral = [0.0, -0.55, 0.0, 0.75, 0.0, 1.26, 0.0]
+    start = time.time()
+    rmap = ReachabilityMap.compute(chains=chains,
+                                   limits=settings.task_space_limits_m,
+                                   resolution=args.resolution,
+                                   orientation=[np.pi, 0.0, np.pi],
+                                   seeds={a: neutral for a in arms})
+    print 'Computed {} voxels per arm in {:.1f} s.'.format(
+        int(np.prod(rmap.shape)), time.time() - start)
+    for arm in arms:
+        print '  {:5s} {:6.1%} reachable'.format(arm,
+                                                 rmap.reachable[arm].mean())
+    rmap.save(filename=filename)
+
+
+if __name__ == '__main__':
+    main()
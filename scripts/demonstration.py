@@ -59,7 +59,11 @@ class Demonstration(object):
                                         # TODO replace with object_set[1:],
                                         object_ids=[],
                                         ws_limits=settings.world_space_limits_m)
-        self._robot = Baxter(sim=self._sim)
+        self._robot = Baxter(sim=self._sim,
+                             ik_cache_file=os.path.join(ros_ws, 'data', 'setup',
+                                                        'ik_cache.npz'),
+                             reachability_file=os.path.join(ros_ws, 'data', 'setup',
+                                                            'reachability.npz'))
         self._camera = Kinect(root_dir=ros_ws, host=settings.elte_kinect_win_host)
         self._detection = ObjectDetection(root_dir=ros_ws,
                                           object_ids=object_set)
@@ -94,6 +98,7 @@ class Demonstration(object):
         """Clean up everything that needs cleaning up before ROS is shutdown."""
         self._logger.info('Shut down the demonstration framework.')
         self._robot.clean_up()
+        self._camera.clean_up()
         if self._sim:
             self._environment.clean_up()
 
@@ -101,6 +106,9 @@ class Demonstration(object):
         """Prepare all the components of the demonstration."""
         self._logger.info('Set up the demonstration framework.')
         self._robot.set_up()
+        if settings.kinect_streaming:
+            self._camera.start_streaming(color=True, depth=False,
+                                         skeleton=True)
         if self._sim:
             self._environment.set_up()
         if self._detection is not None:
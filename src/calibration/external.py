@@ -390,15 +390,11 @@ class External(object):
                 centers = centers[:, 0, :]
                 rob_pattern = np.dot(btt, tcp_pattern)
                 cam_pattern = np.dot(btc_inv, rob_pattern)
-                pixels = np.zeros_like(centers)
-                for i in xrange(cam_pattern.shape[1]):
-                    coord = list(cam_pattern[:-1, i])
-                    print i, coord,
-                    pixels[i] = self._kinect.color.projection_camera_to_pixel(
-                        position=coord)
-                    # flip in y direction
-                    pixels[i, 0] = color.shape[1] - pixels[i, 0]
-                    print centers[i], pixels[i]
+                pixels = self._kinect.color.projection_camera_to_pixels(
+                    points=cam_pattern[:-1].T).astype(centers.dtype)
+                # flip in y direction
+                pixels[:, 0] = color.shape[1] - pixels[:, 0]
+                for i in xrange(pixels.shape[0]):
                     cv2.circle(color, tuple(int(x) for x in pixels[i]), 3,
                                [255, 0, 0] if i == 0 else [0, 255, 0], 2)
                 self._pub_vis.publish(img_to_imgmsg(img=color))
@@ -5,3 +5,5 @@
 from gitlogger import git_logger
 
 from log_handling import get_default_handler
+
+from timing import TimingStats
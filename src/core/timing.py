@@ -0,0 +1,100 @@
+# Copyright (c) 2016, BRML
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import numpy as np
+
+
+class TimingStats(object):
+    def __init__(self, edges=None):
+        """Accumulate timing measurements, e.g., of the latency of a service
+        call or the duration of one stage of a processing pipeline, in a
+        running summary and a histogram.
+
+        :param edges: The bin edges of the histogram in seconds. If None, 25
+            logarithmically spaced bins from 10 us to 10 s are used.
+        """
+        if edges is None:
+            edges = np.logspace(-5, 1, 25)
+        self.edges = np.asarray(edges, dtype=np.float64)
+        self.counts = None
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.reset()
+
+    def reset(self):
+        """Discard all measurements.
+
+        :return:
+        """
+        # one additional bin each for values below and above the edges
+        self.counts = np.zeros(len(self.edges) + 1, dtype=np.int64)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, duration):
+        """Add a measurement.
+
+        :param duration: The measured duration in seconds.
+        :return:
+        """
+        self.counts[np.searchsorted(self.edges, duration, side='right')] += 1
+        self.count += 1
+        self.total += duration
+        self.min = duration if self.min is None else min(self.min, duration)
+        self.max = duration if self.max is None else max(self.max, duration)
+
+    @property
+    def mean(self):
+        """The mean duration in seconds or None if nothing was measured."""
+        if self.count == 0:
+            return None
+        return self.total/self.count
+
+    def percentile(self, q):
+        """Estimate a percentile of the measured durations from the histogram.
+
+        :param q: The percentile to compute, in [0, 100].
+        :return: The upper edge of the histogram bin holding the requested
+            percentile (at most the maximum duration) in seconds or None if
+            nothing was measured.
+        """
+        if self.count == 0:
+            return None
+        idx = np.searchsorted(np.cumsum(self.counts), q/100.0*self.count)
+        if idx >= len(self.edges):
+            return self.max
+        return min(self.edges[idx], self.max)
+
+    def __str__(self):
+        if self.count == 0:
+            return 'n=0'
+        return 'n={}, mean={:.2f} ms, min={:.2f} ms, p90<={:.2f} ms, ' \
+               'max={:.2f} ms'.format(self.count, 1e3*self.mean,
+                                      1e3*self.min, 1e3*self.percentile(90),
+                                      1e3*self.max)
@@ -136,39 +136,91 @@ class PickAndPlace(object):
         }
         return self._robot.sample_pose(lim=borders)
 
-    def _move_to_pose_or_dither(self, arm, pose, fix_z=False):
+    def _move_to_pose_or_dither(self, arm, pose, fix_z=False, n_candidates=10):
         """Shortcut to move the robots' specified limb to the given pose. If
         the pose was not reached, modify the pose slightly and try again.
+        The pose and a number of modified poses are checked for reachability
+        in a single inverse kinematics request.
 
         :param arm: The arm <'left', 'right'> to control.
-        :param pose: The pose to move to. One of
-            - a ROS Pose,
-            - a list of length 6 [x, y, z, roll, pitch, yaw] or
-            - a list of length 7 [x, y, z, qx, qy, qz, qw].
+        :param pose: The pose to move to. A list of length 6
+            [x, y, z, roll, pitch, yaw].
         :param fix_z: Whether to keep the z coordinate fixed.
+        :param n_candidates: The number of poses to check per request.
         :return: The achieved configuration, a dictionary of joint name keys
             to joint angle values.
         """
         config = None
+        candidates = [pose]
         while config is None and not rospy.is_shutdown():
-            try:
-                config = self._robot.ik(arm=arm, pose=pose)
-            except ValueError:
-                self._logger.debug('Computing IK for pose {} with {} arm '
-                                   'failed!'.format(pose, arm))
-                pose = self._dither_pose(pose=pose, fix_z=fix_z)
+            while len(candidates) < n_candidates:
+                candidates.append(self._dither_pose(pose=candidates[-1],
+                                                    fix_z=fix_z))
+            valid, configs = self._robot.ik_batch(arm=arm, poses=candidates)
+            if valid.any():
+                config = configs[np.argmax(valid)]
+            else:
+                self._logger.debug('Computing IK for pose {} and {} modified '
+                                   'poses with {} arm failed!'.format(
+                                       pose, n_candidates - 1, arm))
+                candidates = [candidates[-1]]
         self._robot.move_to_config(config=config)
         return config
 
     def _calibrate_table_height(self):
         """Calibrate the height of the table in the robot's task coordinates.
+        If enabled, the table height is estimated by fitting a plane to a
+        Kinect point cloud, which takes well under a second. Otherwise, or
+        if the estimate is not confident or is to be verified, the table
+        height is measured with the robot's limb (see _measure_table_height).
+        The Kinect estimate is only used if the camera-to-robot
+        transformation stems from an external calibration.
+
+        :return: The estimated table height in meters.
+        """
+        height = None
+        if settings.table_height_from_kinect and \
+                not self._camera.trafo_calibrated:
+            self._logger.warning("No external calibration loaded. Do not "
+                                 "estimate table height from Kinect data.")
+        elif settings.table_height_from_kinect:
+            self._logger.info('Estimate table height from Kinect depth data.')
+            try:
+                height, confidence = self._camera.estimate_table_height(
+                    limits=settings.task_space_limits_m)
+            except (ValueError, RuntimeError):
+                confidence = 0.0
+            if confidence < settings.table_height_min_confidence:
+                self._logger.warning("Kinect table height estimate is not "
+                                     "reliable ({:.0f}% inliers).".format(
+                                         100.0*confidence))
+                height = None
+            else:
+                self._logger.info("Estimated table height to be {:.3f} m "
+                                  "({:.0f}% inliers).".format(
+                                      height, 100.0*confidence))
+                if not settings.table_height_verification:
+                    return height
+        measured = self._measure_table_height()
+        if height is not None:
+            diff = height - measured
+            self._logger.info("Kinect table height estimate differs by {:.3f} "
+                              "m from the measured table height.".format(diff))
+            if abs(diff) > settings.table_height_tolerance:
+                self._logger.warning("Using measured table height.")
+                return measured
+            return height
+        return measured
+
+    def _measure_table_height(self):
+        """Measure the height of the table in the robot's task coordinates.
         After ensuring that the table has been cleared of objects the robot
         moves its limb to a number of randomly sampled poses in the task
         space. At each pose it measures the distance to the table top using
         an infrared sensor. The estimate of the table height is computed from
         these distance measurements.
 
-        :return: The estimated table height in meters.
+        :return: The measured table height in meters.
         """
         setup_file = os.path.join(self._setup_dir, 'table_height.npz')
         try:
@@ -182,18 +234,17 @@ class PickAndPlace(object):
             self._move_to_pose_or_raise(arm=arm, pose=settings.calibration_pose)
             self._wait_for_clear_table(arm=arm)
             heights = list()
-            for n in range(n_samples):
+            # sample reachable poses, checking a batch of poses per request
+            configs = list()
+            while len(configs) < n_samples and not rospy.is_shutdown():
+                random_poses = [self._robot.sample_task_space_pose(clip_z=True,
+                                                                   arm=arm)
+                                for _ in range(n_samples)]
+                valid, cfgs = self._robot.ik_batch(arm=arm, poses=random_poses)
+                configs += [c for c, v in zip(cfgs, valid) if v]
+            for config in configs[:n_samples]:
                 if rospy.is_shutdown():
                     break
-                config = None
-                while config is None:
-                    if rospy.is_shutdown():
-                        break
-                    random_pose = self._robot.sample_task_space_pose(clip_z=True)
-                    try:
-                        config = self._robot.ik(arm=arm, pose=random_pose)
-                    except ValueError:
-                        pass
                 self._robot.move_to_config(config=config)
                 self.publish_vis(image=self._robot.cameras[arm].collect_image())
                 distances = list()
@@ -280,10 +331,8 @@ class PickAndPlace(object):
                                color=(0, 255, 0), thickness=1)
                 self.publish_vis(image=canvas)
 
-                for j, center in enumerate(centers):
-                    if rospy.is_shutdown():
-                        break
-                    positions[j, :, i] = self._robot.estimate_object_position(arm=arm, center=center)
+                positions[:, :, i] = self._robot.estimate_object_positions(arm=arm,
+                                                                           centers=centers)
 
                 self._robot.move_to_neutral(arm=arm)
             data = {
@@ -326,6 +375,21 @@ class PickAndPlace(object):
         :return:
         """
         self._logger.info("Perform / read calibration of demonstration setup.")
+        # affine transformation from external camera to Baxter coordinates
+        # Needed for estimating the table height from Kinect data.
+        try:
+            self._camera.trafo = self._load_external_calibration()
+            self._camera.trafo_calibrated = True
+        except IOError:
+            self._logger.warning("Using approximate camera-to-robot "
+                                 "transformation.")
+            self._camera.trafo = np.array([
+                [0, 0, -1, 2.5],
+                [-1, 0, 0, 0],
+                [0, 1, 0, 0.35],
+                [0, 0, 0, 1]
+            ])
+
         # height of the table in robot coordinates
         self._robot.z_table = self._calibrate_table_height()
 
@@ -341,15 +405,6 @@ class PickAndPlace(object):
         self._table_poses = [list(pos) + [np.pi, 0.0, np.pi]
                              for pos in cfg['positions']]
 
-        # affine transformation from external camera to Baxter coordinates
-        # self._camera.trafo = self._load_external_calibration()
-        self._camera.trafo = np.array([
-            [0, 0, -1, 2.5],
-            [-1, 0, 0, 0],
-            [0, 1, 0, 0.35],
-            [0, 0, 0, 1]
-        ])
-
     def _get_approach_pose(self, pose):
         """Compute a pose safe for approaching the given pose by adding some
         safety offset.
@@ -362,6 +417,8 @@ class PickAndPlace(object):
     @staticmethod
     def _is_in_task_space(pose):
         """Check whether a given pose lies within the robot's task space.
+        Note: Whether a limb can reach the pose is decided by solving the
+        inverse kinematics for the commanded pose.
 
         :param pose: A position or pose [x, y, z, ...] (list of len >= 3).
         :return: Boolean flag.
@@ -376,6 +433,76 @@ class PickAndPlace(object):
             return True
         return False
 
+    def _wait_for_hand(self, request):
+        """Wait for a stable hand position estimate within the robot's task
+        space. The estimate is filtered over time and extrapolated to when
+        the robot is expected to arrive, such that the robot can start
+        moving before the hand has come to a complete rest.
+
+        :param request: The request to the human if the hand was not found
+            or is not within the task space.
+        :return: The (predicted) hand position, a list [x, y, z] of len 3.
+        """
+        pose = None
+        while not rospy.is_shutdown():
+            estimate = self._camera.predict_hand_position(
+                hand=settings.human_hand,
+                horizon=settings.hand_prediction_horizon,
+                max_age=settings.kinect_max_age)
+            if estimate is None:
+                self._logger.warning("No hand position estimate was found!")
+            elif (not estimate[2] or
+                  np.linalg.norm(estimate[1]) > settings.hand_max_speed):
+                # wait for the velocity estimate to converge and the hand
+                # to settle
+                rospy.sleep(0.1)
+                continue
+            elif not self._is_in_task_space(pose=estimate[0]):
+                self._logger.warning("Hand position estimate is not "
+                                     "within task space!")
+            else:
+                pose = estimate[0]
+                break
+            self._logger.info(request)
+            rospy.sleep(2.0)
+        return pose
+
+    def _locate_object(self, object_id):
+        """Locate an object on the table from Kinect depth data. Of all
+        objects found on the table, the one whose longer dimension in the
+        x-y plane best matches the size of the requested object is selected.
+        Objects are only located if the camera-to-robot transformation stems
+        from an external calibration.
+
+        :param object_id: The identifier of the object to locate.
+        :return: The object position, a list [x, y, z] of len 3, where z is
+            the height of the search pose, or None if no matching object was
+            found.
+        """
+        if not self._camera.trafo_calibrated:
+            self._logger.warning("No external calibration loaded. Do not "
+                                 "locate objects from Kinect data.")
+            return None
+        try:
+            objects = self._camera.locate_objects(
+                limits=settings.task_space_limits_m)
+        except (ValueError, RuntimeError):
+            return None
+        size = settings.object_size_meters[object_id]
+        best = None
+        for obj in objects:
+            error = abs(max(obj['rroi'][1]) - size)/size
+            if error <= settings.object_size_tolerance and \
+                    (best is None or error < best[0]):
+                best = error, obj
+        if best is None:
+            return None
+        x, y, _ = best[1]['centroid']
+        self._logger.debug("Located the {} at [{: .3f} {: .3f}] with size "
+                           "{:.3f} m.".format(object_id, x, y,
+                                              max(best[1]['rroi'][1])))
+        return [x, y, settings.search_pose[2]]
+
     def perform(self):
         """Perform the pick-and-place demonstration.
 
@@ -394,20 +521,9 @@ class PickAndPlace(object):
                               'pose.'.format(obj_id))
             if obj_id == 'hand':
                 arm = None
-                while not rospy.is_shutdown():
-                    obj_pose = self._camera.estimate_hand_position(
-                        hand=settings.human_hand)
-                    if obj_pose is None:
-                        self._logger.warning("No hand position estimate was found!")
-                    elif not self._is_in_task_space(pose=obj_pose):
-                        self._logger.warning("Hand position estimate is not "
-                                             "within task space!")
-                        obj_pose = None
-                    else:
-                        break
-                    self._logger.info("Please relocate your {} hand holding "
-                                      "the object.".format(settings.human_hand))
-                    rospy.sleep(2.0)
+                obj_pose = self._wait_for_hand(
+                    request="Please relocate your {} hand holding the "
+                            "object.".format(settings.human_hand))
                 obj_pose += [np.pi, 0.0, np.pi]
             else:
                 arm = self._robot.select_gripper_for_object(object_id=obj_id)
@@ -423,6 +539,8 @@ class PickAndPlace(object):
                 #                                                  bbox=det['box'],
                 #                                                  img_depth=img_depth)
                 obj_pose = None
+                if settings.object_localization_from_kinect:
+                    obj_pose = self._locate_object(object_id=obj_id)
                 if obj_pose is None:
                     self._logger.warning("I did not find the {} using the "
                                          "Kinect!".format(obj_id))
@@ -455,9 +573,9 @@ class PickAndPlace(object):
                 table_img = self._robot.cameras[arm].collect_image()
                 idxs = range(len(self._table_patches))
                 random.shuffle(idxs)
-                tgt_pose = None
+                candidates = list()
                 for idx in idxs:
-                    if rospy.is_shutdown() or tgt_pose is not None:
+                    if rospy.is_shutdown():
                         break
                     (xul, yul), (xlr, ylr) = self._table_patches[idx]
                     table_patch = table_img[yul:ylr, xul: xlr]
@@ -474,13 +592,14 @@ class PickAndPlace(object):
                     self._logger.debug("Patch {} changed by {:.2f}% {} {:.2f}%.".format(
                         idx, change, '<' if accepted else '>', settings.color_change_threshold))
                     if diff.mean()*100.0 < settings.color_change_threshold:
-                        pose = self._table_poses[idx]
+                        pose = list(self._table_poses[idx])
                         pose[2] += 0.01
-                        try:
-                            _ = self._robot.ik(arm=arm, pose=pose)
-                            tgt_pose = pose
-                        except ValueError:
-                            pass
+                        candidates.append(pose)
+                # check all empty spots for reachability in one request
+                tgt_pose = None
+                valid, _ = self._robot.ik_batch(arm=arm, poses=candidates)
+                if valid.any():
+                    tgt_pose = candidates[np.argmax(valid)]
                 if tgt_pose is None:
                     self._logger.warning("Found no place to put the object down! "
                                          "I abort this task. Please start over.")
@@ -517,28 +636,31 @@ class PickAndPlace(object):
                 appr_pose = self._get_approach_pose(pose=tgt_pose)
                 appr_cfg = self._move_to_pose_or_dither(arm=arm, pose=appr_pose)
                 self._move_to_pose_or_dither(arm=arm, pose=tgt_pose, fix_z=True)
-                self._robot.release(arm)
+                # retreat as soon as the object is let go of, while the
+                # gripper keeps opening. Light objects do not register as
+                # being held, so wait for the gripper to open in that case.
+                holding = self._robot.is_gripping(arm)
+                self._robot.release(arm, block=not holding)
+                if holding and \
+                        not self._robot.wait_for_force_drop(arm, timeout=1.0):
+                    self._logger.warning("Gripper force did not drop. Wait "
+                                         "for the gripper to open.")
+                    self._robot.release(arm)
                 self._robot.move_to_config(config=appr_cfg)
             else:
-                while not rospy.is_shutdown():
-                    tgt_pose = self._camera.estimate_hand_position(
-                        hand=settings.human_hand)
-                    if tgt_pose is None:
-                        self._logger.warning("No hand position estimate was found!")
-                    elif not self._is_in_task_space(pose=tgt_pose):
-                        self._logger.warning("Hand position estimate is not "
-                                             "within task space!")
-                        tgt_pose = None
-                    else:
-                        break
-                    self._logger.info("Please relocate your hand.")
-                    rospy.sleep(2.0)
+                tgt_pose = self._wait_for_hand(request="Please relocate your "
+                                                       "hand.")
                 tgt_pose += [np.pi, 0.0, np.pi]
                 self._move_to_pose_or_dither(arm=arm, pose=tgt_pose, fix_z=True)
                 self._logger.info('Please take the object from me.')
-                while self._robot.is_gripping(arm):
-                    rospy.sleep(0.5)
-                self._robot.release(arm)
+                if self._robot.wait_for_object_removal(
+                        arm, timeout=settings.handover_timeout):
+                    self._robot.release(arm, block=False)
+                else:
+                    self._logger.warning("Object was not taken within {} s. "
+                                         "I open the gripper.".format(
+                                             settings.handover_timeout))
+                    self._robot.release(arm)
             self._move_to_pose_or_raise(arm=arm, pose=settings.top_pose)
             self._robot.move_to_neutral(arm=arm)
             self._logger.info('I finished my task.')
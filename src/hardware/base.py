@@ -23,10 +23,15 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 
+import collections
 import logging
 import numpy as np
+import sys
+import threading
+import time
+import zipfile
 
-import cv_bridge
+import cv2
 
 import rospy
 from sensor_msgs.msg import (
@@ -35,14 +40,24 @@ from sensor_msgs.msg import (
 )
 
 
+# Undistortion maps shared between all cameras with identical parameters,
+# keyed on (camera matrix, image size, distortion coefficients).
+_rectify_maps = dict()
+
+
 class Camera(object):
-    def __init__(self, topic, prefix, cam_pars=None):
+    def __init__(self, topic, prefix, cam_pars=None, buffer_size=4,
+                 maps_file=None):
         """Base class for a ROS camera.
         A camera should have at least
           - a method to read images from a ROS topic,
           - a method to project pixel coordinates to camera coordinates, and
           - a method to project camera coordinates to pixel coordinates.
 
+        Images are received by a single long-lived subscriber that is set up
+        on first use and keeps the most recent frames (together with their
+        header time stamps) in a small ring buffer.
+
         :param topic: The ROS image topic to read camera images from.
         :param prefix: The prefix for the logger name to use.
         :param cam_pars: An optional dictionary containing camera parameters.
@@ -51,9 +66,17 @@ class Camera(object):
                 - a 3x3 camera matrix,
                 - the image size (height, width) and
                 - the camera distortion coefficients.
+        :param buffer_size: The number of most recent frames to keep.
+        :param maps_file: An optional file name to persist the undistortion
+            maps in, such that they need not be recomputed on start up.
         """
         self._topic = topic
 
+        self._frames = collections.deque(maxlen=buffer_size)
+        self._frames_cond = threading.Condition(threading.Lock())
+        self._subscriber = None
+        self._maps_file = maps_file
+
         self._logger = logging.getLogger('{}.cam'.format(prefix))
 
         self.camera_matrix = None
@@ -90,21 +113,60 @@ class Camera(object):
         except rospy.ROSException:
             raise RuntimeError("Unable to read camera info from ROS master!")
 
-    def collect_image(self):
-        """Read the most recent image message from the ROS topic and convert
-        it into a numpy array.
+    def _subscribe(self):
+        """Set up the persistent subscriber filling the frame buffer, if it
+        is not running yet.
 
-        :return: An image (a (height, width, n_channels) numpy array).
+        :return:
+        """
+        with self._frames_cond:
+            if self._subscriber is None:
+                self._logger.debug("Subscribe to {}.".format(self._topic))
+                self._subscriber = rospy.Subscriber(self._topic, Image,
+                                                    callback=self._callback,
+                                                    queue_size=1,
+                                                    buff_size=2**24)
+
+    def unsubscribe(self):
+        """Shut down the persistent subscriber and clear the frame buffer.
+
+        :return:
+        """
+        with self._frames_cond:
+            if self._subscriber is not None:
+                self._subscriber.unregister()
+                self._subscriber = None
+            self._frames.clear()
+
+    def _callback(self, msg):
+        """Decode an incoming image message and append it to the frame
+        buffer together with its header time stamp.
+
+        :param msg: A ROS image message.
+        :return:
         """
         try:
-            msg = rospy.wait_for_message(topic=self._topic,
-                                         topic_type=Image,
-                                         timeout=0.5)
-            img = imgmsg_to_img(imgmsg=msg)
-        except rospy.ROSException:
-            msg = "ROS error while reading image from {}.".format(self._topic)
-            self._logger.error(msg)
-            raise RuntimeError(msg)
+            img = self._decode(msg=msg)
+        except ValueError as e:
+            self._logger.warning("{}: {}".format(self._topic, e))
+            return
+        stamp = msg.header.stamp
+        if stamp.is_zero():
+            # some drivers do not stamp their images
+            stamp = rospy.Time.now()
+        # buffered frames are shared between readers
+        img.flags.writeable = False
+        with self._frames_cond:
+            self._frames.append((stamp, img))
+            self._frames_cond.notify_all()
+
+    def _decode(self, msg):
+        """Convert an image message into a numpy array.
+
+        :param msg: A ROS image message.
+        :return: An image (a (height, width, n_channels) numpy array).
+        """
+        img = imgmsg_to_img(imgmsg=msg)
         if img.dtype == np.float32:
             # In simulation, depth map is a float32 image
             mask = np.isnan(img)
@@ -115,7 +177,8 @@ class Camera(object):
                 self._logger.debug("{}: There was at least one NaN in the depth "
                                    "image. I replaced all occurrences with "
                                    "0.0 m.".format(self._topic))
-                img.flags.writeable = True
+                # the decoded image is a read-only view onto the message
+                img = img.copy()
                 img[mask] = 0.0
                 # We now map the float values in meters to uint16 values in mm
                 # as provided by the libfreenect2 library and Kinect SDK.
@@ -123,6 +186,208 @@ class Camera(object):
                 img = img.astype(np.uint16, copy=False)
         return img
 
+    def latest(self):
+        """Return the most recent frame in the buffer without waiting.
+        Note: The returned image is shared with other readers and therefore
+        read-only.
+
+        :return: A tuple (stamp, image) or None if no frame was received yet.
+        """
+        self._subscribe()
+        with self._frames_cond:
+            if len(self._frames) == 0:
+                return None
+            return self._frames[-1]
+
+    def next_after(self, stamp):
+        """Return the oldest buffered frame that is newer than the given time
+        stamp without waiting.
+        Note: The returned image is shared with other readers and therefore
+        read-only.
+
+        :param stamp: A rospy.Time time stamp.
+        :return: A tuple (stamp, image) or None if no such frame is buffered.
+        """
+        self._subscribe()
+        with self._frames_cond:
+            return self._next_after(stamp=stamp)
+
+    def _next_after(self, stamp):
+        """Return the oldest buffered frame newer than stamp. The caller
+        needs to hold the buffer lock.
+        """
+        for frame in self._frames:
+            if stamp is None or frame[0] > stamp:
+                return frame
+        return None
+
+    def wait_newer_than(self, stamp, timeout):
+        """Wait for a frame that is newer than the given time stamp.
+        Note: The returned image is shared with other readers and therefore
+        read-only.
+
+        :param stamp: A rospy.Time time stamp. If None, any frame is accepted.
+        :param timeout: The maximum time to wait in seconds.
+        :return: A tuple (stamp, image) or None if no such frame was received
+            within the given time.
+        """
+        self._subscribe()
+        deadline = time.time() + timeout
+        with self._frames_cond:
+            frame = self._next_after(stamp=stamp)
+            while frame is None and not rospy.is_shutdown():
+                remaining = deadline - time.time()
+                if remaining <= 0.0:
+                    break
+                self._frames_cond.wait(remaining)
+                frame = self._next_after(stamp=stamp)
+        return frame
+
+    def collect_image(self, fresh=True):
+        """Read the most recent image from the ROS topic as a numpy array.
+
+        :param fresh: Whether to wait for the next frame to arrive (True) or
+            to return the most recent buffered frame, if any (False).
+        :return: An image (a (height, width, n_channels) numpy array).
+        :raise RuntimeError: If no image was received within 0.5 s.
+        """
+        return self.collect_frame(fresh=fresh)[1]
+
+    def collect_frame(self, fresh=True):
+        """Read the most recent image from the ROS topic together with its
+        time stamp, e.g., to look up the camera pose at the time the image
+        was taken.
+
+        :param fresh: Whether to wait for the next frame to arrive (True) or
+            to return the most recent buffered frame, if any (False).
+        :return: A tuple (stamp, image) of a rospy.Time time stamp and an
+            image (a (height, width, n_channels) numpy array).
+        :raise RuntimeError: If no image was received within 0.5 s.
+        """
+        frame = None
+        if not fresh:
+            frame = self.latest()
+        if frame is None:
+            newest = self.latest()
+            frame = self.wait_newer_than(
+                stamp=newest[0] if newest is not None else None, timeout=0.5)
+        if frame is None:
+            msg = "ROS error while reading image from {}.".format(self._topic)
+            self._logger.error(msg)
+            raise RuntimeError(msg)
+        # callers draw onto the returned image, so hand out a private copy
+        return frame[0], frame[1].copy()
+
+    def _has_distortion(self):
+        """Whether the camera has a non-trivial distortion model."""
+        return (self.distortion_coeff is not None and
+                np.any(np.asarray(self.distortion_coeff) != 0.0))
+
+    def _dist_coeff(self):
+        """The distortion coefficients as a numpy array of length >= 5."""
+        dist = np.zeros(5, dtype=np.float64)
+        if self.distortion_coeff is not None:
+            coeff = np.asarray(self.distortion_coeff, dtype=np.float64).flatten()
+            if coeff.size > 5:
+                dist = coeff
+            else:
+                dist[:coeff.size] = coeff
+        return dist
+
+    def _load_maps(self, key):
+        """Load previously persisted undistortion maps if they have been
+        computed for the current camera parameters.
+
+        :param key: The camera parameters the maps need to match.
+        :return: A tuple (map_x, map_y) or None.
+        """
+        try:
+            with np.load(self._maps_file) as data:
+                if (data['cam_mat'].tostring() == key[0] and
+                        tuple(data['size']) == key[1] and
+                        data['dist_coeff'].tostring() == key[2]):
+                    self._logger.debug("Read undistortion maps from "
+                                       "{}.".format(self._maps_file))
+                    return data['map_x'], data['map_y']
+        except IOError:
+            pass
+        except (KeyError, ValueError, zipfile.BadZipfile) as e:
+            self._logger.warning("Failed to read undistortion maps from {} "
+                                 "({}). Compute them anew.".format(
+                                     self._maps_file, e))
+        return None
+
+    def rectify_maps(self):
+        """Return the lookup tables mapping each pixel of the rectified
+        image onto its (sub-pixel) position in the raw image.
+        The maps are computed once per set of camera parameters and shared
+        between all cameras with identical parameters.
+
+        :return: A dictionary containing
+            - the float maps of x and y coordinates (keys 'map_x', 'map_y',
+              each a (height, width) float32 numpy array) and
+            - the corresponding fixed-point maps for fast remapping (keys
+              'map1', 'map2').
+        """
+        cam_mat = np.asarray(self.camera_matrix, dtype=np.float64)
+        dist = self._dist_coeff()
+        key = (cam_mat.tostring(), tuple(int(x) for x in self.image_size),
+               dist.tostring())
+        if key not in _rectify_maps:
+            maps = None
+            if self._maps_file is not None:
+                maps = self._load_maps(key=key)
+            if maps is None:
+                h, w = key[1]
+                self._logger.debug("Compute undistortion maps for {}x{} "
+                                   "images.".format(w, h))
+                maps = cv2.initUndistortRectifyMap(cam_mat, dist, np.eye(3),
+                                                   cam_mat, (w, h),
+                                                   cv2.CV_32FC1)
+                if self._maps_file is not None:
+                    np.savez(self._maps_file, cam_mat=cam_mat,
+                             size=np.asarray(key[1]), dist_coeff=dist,
+                             map_x=maps[0], map_y=maps[1])
+            map1, map2 = cv2.convertMaps(maps[0], maps[1], cv2.CV_16SC2)
+            _rectify_maps[key] = {
+                'map_x': maps[0],
+                'map_y': maps[1],
+                'map1': map1,
+                'map2': map2
+            }
+        return _rectify_maps[key]
+
+    def _distort_pixels(self, pixels):
+        """Map pixel coordinates in the rectified image onto the raw
+        (distorted) image by looking them up in the undistortion maps.
+        Pixels outside of the image are distorted analytically.
+
+        :param pixels: A (N, 2) array of (px, py) in the rectified image.
+        :return: A (N, 2) numpy array of (px, py) in the raw image.
+        """
+        maps = self.rectify_maps()
+        h, w = maps['map_x'].shape
+        raw = np.empty_like(pixels)
+        inside = ((pixels[:, 0] >= 0) & (pixels[:, 0] <= w - 1) &
+                  (pixels[:, 1] >= 0) & (pixels[:, 1] <= h - 1))
+        if inside.any():
+            u = pixels[inside, 0].astype(np.float32).reshape((1, -1))
+            v = pixels[inside, 1].astype(np.float32).reshape((1, -1))
+            for i, m in enumerate([maps['map_x'], maps['map_y']]):
+                raw[inside, i] = cv2.remap(m, u, v,
+                                           interpolation=cv2.INTER_LINEAR).flatten()
+        if not inside.all():
+            # normalized image coordinates on the plane z = 1
+            pts = np.ones((np.count_nonzero(~inside), 3))
+            pts[:, 0] = (pixels[~inside, 0] - self.camera_matrix[0, 2])/self.camera_matrix[0, 0]
+            pts[:, 1] = (pixels[~inside, 1] - self.camera_matrix[1, 2])/self.camera_matrix[1, 1]
+            projected, _ = cv2.projectPoints(pts.reshape((-1, 1, 3)),
+                                             np.zeros(3), np.zeros(3),
+                                             self.camera_matrix,
+                                             self._dist_coeff())
+            raw[~inside] = projected.reshape((-1, 2))
+        return raw
+
     def projection_pixel_to_camera(self, pixel, z):
         """Project a 2d point (px, py) in pixel coordinates into 3D camera
         coordinates.
@@ -136,20 +401,46 @@ class Camera(object):
         :return: The corresponding 3D camera coordinates [x, y, z].
         """
         if isinstance(pixel, (tuple, list)) and len(pixel) == 2:
-            # For known z coordinate we can rearrange
-            #   (u)   [fx 0  cx](x)
-            #   (v) = [0  fy cy](y)
-            #   (w)   [0  0  1 ](z)
-            # to compute
-            #   w = z,
-            #   x = (u - cx*z)/fx,  u = px*w, and
-            #   y = (v - cy*z)/fy,  v = py*w.
-            x = z * (pixel[0] - self.camera_matrix[0, 2]) / self.camera_matrix[0, 0]
-            y = z * (pixel[1] - self.camera_matrix[1, 2]) / self.camera_matrix[1, 1]
-            # flip y axis
-            return [x, -y, z]
+            return list(self.projection_pixels_to_camera(pixels=[pixel],
+                                                         z=z)[0])
         raise ValueError("'pixel' should be a tuple of length 2!")
 
+    def projection_pixels_to_camera(self, pixels, z, distortion=False):
+        """Project a number of 2d points in pixel coordinates into 3D camera
+        coordinates. Vectorized version of projection_pixel_to_camera.
+
+        :param pixels: The 2D positions as a (N, 2) array of (px, py).
+        :param z: The known height of the pixels in camera coordinates, a
+            scalar or a (N,) array.
+        :param distortion: Whether the pixels stem from the raw (distorted)
+            image and need to be undistorted before projecting them.
+        :return: The corresponding 3D camera coordinates as a (N, 3) numpy
+            array of [x, y, z].
+        """
+        pixels = np.asarray(pixels, dtype=np.float64)
+        if pixels.ndim != 2 or pixels.shape[1] != 2:
+            raise ValueError("'pixels' should be a (N, 2) array, got "
+                             "{}!".format(pixels.shape))
+        if distortion and self._has_distortion():
+            pixels = cv2.undistortPoints(
+                pixels.reshape((-1, 1, 2)), self.camera_matrix,
+                self._dist_coeff(), P=self.camera_matrix).reshape((-1, 2))
+        # For known z coordinate we can rearrange
+        #   (u)   [fx 0  cx](x)
+        #   (v) = [0  fy cy](y)
+        #   (w)   [0  0  1 ](z)
+        # to compute
+        #   w = z,
+        #   x = (u - cx*z)/fx,  u = px*w, and
+        #   y = (v - cy*z)/fy,  v = py*w.
+        points = np.empty((pixels.shape[0], 3), dtype=np.float64)
+        points[:, 2] = z
+        points[:, 0] = points[:, 2]*(pixels[:, 0] - self.camera_matrix[0, 2])/self.camera_matrix[0, 0]
+        points[:, 1] = points[:, 2]*(pixels[:, 1] - self.camera_matrix[1, 2])/self.camera_matrix[1, 1]
+        # flip y axis
+        points[:, 1] *= -1.0
+        return points
+
     def projection_camera_to_pixel(self, position):
         """Project a 3d point [x, y, z] in camera coordinates onto the
         rectified image. For additional information see
@@ -159,32 +450,104 @@ class Camera(object):
         :return: The corresponding pixel coordinates (px, py).
         """
         if isinstance(position, list) and len(position) == 3:
-            u, v, w = np.dot(self.camera_matrix, np.asarray(position))
-            px = float(u)/w
-            py = float(v)/w
-            # flip image in y direction
-            return px, self.image_size[0] - py
+            px, py = self.projection_camera_to_pixels(points=[position])[0]
+            return px, py
         raise ValueError("'position' should be a list of length 3!")
 
+    def projection_camera_to_pixels(self, points, distortion=False):
+        """Project a number of 3d points in camera coordinates onto the
+        image. Vectorized version of projection_camera_to_pixel.
+
+        :param points: The 3D positions as a (N, 3) array of [x, y, z].
+        :param distortion: Whether to project onto the raw (distorted) image
+            by applying the camera's distortion model (True) or onto the
+            rectified image (False).
+        :return: The corresponding pixel coordinates as a (N, 2) numpy array
+            of (px, py).
+        """
+        points = np.asarray(points, dtype=np.float64)
+        if points.ndim != 2 or points.shape[1] != 3:
+            raise ValueError("'points' should be a (N, 3) array, got "
+                             "{}!".format(points.shape))
+        uvw = np.dot(points, self.camera_matrix.T)
+        pixels = uvw[:, :2]/uvw[:, 2:]
+        # flip image in y direction
+        pixels[:, 1] = self.image_size[0] - pixels[:, 1]
+        if distortion and self._has_distortion():
+            # The flip mirrors about the image center instead of the
+            # principal point. Shift the pixels into the OpenCV image frame
+            # the distortion model refers to, distort them and shift back.
+            offset = self.image_size[0] - 2.0*self.camera_matrix[1, 2]
+            pixels[:, 1] -= offset
+            pixels = self._distort_pixels(pixels=pixels)
+            pixels[:, 1] += offset
+        return pixels
+
+
+# Map ROS image encodings onto (numpy dtype, number of channels).
+# See http://docs.ros.org/indigo/api/sensor_msgs/html/image__encodings_8h.html.
+_encodings = {
+    'bgr8': (np.uint8, 3),
+    'rgb8': (np.uint8, 3),
+    'bgra8': (np.uint8, 4),
+    'rgba8': (np.uint8, 4),
+    'mono8': (np.uint8, 1),
+    'mono16': (np.uint16, 1),
+    '8UC1': (np.uint8, 1),
+    '8UC3': (np.uint8, 3),
+    '8UC4': (np.uint8, 4),
+    '16UC1': (np.uint16, 1),
+    '16SC1': (np.int16, 1),
+    '32SC1': (np.int32, 1),
+    '32FC1': (np.float32, 1),
+    '64FC1': (np.float64, 1)
+}
+
+# Zero-copy channel selections mapping color encodings onto BGR.
+_bgr_views = {
+    'bgr8': np.s_[:, :, :],
+    'rgb8': np.s_[:, :, ::-1],
+    'bgra8': np.s_[:, :, :3],
+    'rgba8': np.s_[:, :, 2::-1]
+}
+
 
 def imgmsg_to_img(imgmsg):
     """Convert a ROS image message to a numpy array holding the image.
+    The array is a read-only view onto the message data, no pixel data is
+    copied. Color images are returned in BGR channel order, gray-scale 8 bit
+    images are converted to BGR, all other encodings (e.g., depth maps) are
+    passed through.
 
     :param imgmsg: A ROS image message.
     :return: The BGR image as a (height, width, n_channels) numpy array.
+    :raise ValueError: If the image encoding is not supported.
     """
-    img = None
-    for enc in ['bgr8', 'mono8', 'passthrough']:
-        try:
-            img = cv_bridge.CvBridge().imgmsg_to_cv2(imgmsg, enc)
-        except cv_bridge.CvBridgeError:
-            pass
-        except AttributeError as e:
-            raise e
-        if img is not None:
-            break
-    if img is None:
-        raise ValueError("Cannot convert image message to numpy array!")
+    enc = imgmsg.encoding
+    if enc not in _encodings:
+        raise ValueError("Cannot convert image message with encoding "
+                         "'{}' to numpy array!".format(enc))
+    dtype, channels = _encodings[enc]
+    dtype = np.dtype(dtype)
+    if dtype.itemsize > 1:
+        dtype = dtype.newbyteorder('>' if imgmsg.is_bigendian else '<')
+    h, w = imgmsg.height, imgmsg.width
+    data = imgmsg.data
+    if isinstance(data, (list, tuple)):
+        data = np.asarray(data, dtype=np.uint8)
+    buf = np.frombuffer(data, dtype=np.uint8)
+    if buf.size < h*imgmsg.step:
+        raise ValueError("Image message holds {} bytes, expected {}!".format(
+            buf.size, h*imgmsg.step))
+    img = np.ndarray(shape=(h, w, channels), dtype=dtype, buffer=buf,
+                     strides=(imgmsg.step, channels*dtype.itemsize,
+                              dtype.itemsize))
+    if enc in _bgr_views:
+        return img[_bgr_views[enc]]
+    if enc == 'mono8':
+        return cv2.cvtColor(img[:, :, 0], cv2.COLOR_GRAY2BGR)
+    if channels == 1:
+        return img[:, :, 0]
     return img
 
 
@@ -193,16 +556,27 @@ def img_to_imgmsg(img):
 
     :param img: A BGR image as a (height, width, n_channels) numpy array.
     :return: The corresponding ROS image message.
+    :raise ValueError: If the array cannot be represented as image message.
     """
-    imgmsg = None
-    for enc in ['bgr8', 'mono8', 'passthrough']:
-        try:
-            imgmsg = cv_bridge.CvBridge().cv2_to_imgmsg(img, enc)
-        except cv_bridge.CvBridgeError:
-            pass
-        if imgmsg is not None:
-            break
-    if imgmsg is None:
+    channels = 1 if img.ndim == 2 else img.shape[2]
+    if img.ndim not in (2, 3) or channels not in (1, 3, 4):
         raise ValueError("Cannot convert {} {} array to image message!".format(
             img.shape, img.dtype))
+    if img.dtype == np.uint8:
+        enc = {1: 'mono8', 3: 'bgr8', 4: 'bgra8'}[channels]
+    else:
+        kind = {'u': 'U', 'i': 'S', 'f': 'F'}.get(img.dtype.kind)
+        if kind is None:
+            raise ValueError("Cannot convert {} {} array to image "
+                             "message!".format(img.shape, img.dtype))
+        enc = '{}{}C{}'.format(8*img.dtype.itemsize, kind, channels)
+    img = np.ascontiguousarray(img)
+    imgmsg = Image()
+    imgmsg.height, imgmsg.width = img.shape[:2]
+    imgmsg.encoding = enc
+    imgmsg.is_bigendian = int(img.dtype.byteorder == '>' or
+                              (img.dtype.byteorder == '=' and
+                               sys.byteorder == 'big'))
+    imgmsg.step = img.strides[0]
+    imgmsg.data = img.tostring()
     return imgmsg
@@ -23,11 +23,16 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 
+import copy
 import logging
+import threading
+import time
+import zipfile
 
 import baxter_interface
 import numpy as np
 import rospy
+from baxter_core_msgs.msg import EndpointState
 from baxter_core_msgs.srv import (
     SolvePositionIK,
     SolvePositionIKRequest
@@ -36,9 +41,19 @@ from geometry_msgs.msg import (
     Pose,
     PoseStamped
 )
+from sensor_msgs.msg import JointState
 
 from base import Camera
-from motion_planning import SimplePlanner
+from control import VelocityController
+from gripper_monitor import GripperMonitor
+from core import TimingStats
+from ik_cache import IKCache
+from kinematics import KinematicChain, poses_to_hom
+from motion import MotionHandle, wait_all
+from reachability import ReachabilityMap
+from state_history import PoseHistory, StateHistory, to_sec
+from transforms import TransformGraph
+from motion_planning import SimplePlanner, TrajectoryPlanner
 from motion_planning.base import MotionPlanner
 from settings import settings
 from utils import list_to_pose_msg, pose_dict_to_list
@@ -46,11 +61,15 @@ from utils import pose_dict_to_hom, hom_to_list
 
 
 class Baxter(object):
-    def __init__(self, sim=False):
+    def __init__(self, sim=False, ik_cache_file=None, reachability_file=None):
         """Hardware abstraction of the Baxter robot using the BaxterSDK
         interface.
 
         :param sim: Whether in Gazebo (True) or on real Baxter (False).
+        :param ik_cache_file: An optional file name to persist the cache of
+            inverse kinematics solutions in.
+        :param reachability_file: An optional file name of a precomputed
+            ReachabilityMap (see scripts/compute_reachability.py).
         """
         name = 'main.baxter'
         self._logger = logging.getLogger(name)
@@ -62,6 +81,13 @@ class Baxter(object):
         self._grippers_pars = self._grippers['left'].valid_parameters()
         self._grippers_pars['moving_force'] = 40.0
         self._grippers_pars['holding_force'] = 30.0
+        # If the measured force exceeds half the holding force, we interpret
+        # this as that an object is held.
+        self.gripper_monitors = {
+            a: GripperMonitor(arm=a,
+                              force_threshold=0.5*self._grippers_pars['holding_force'])
+            for a in self._arms
+        }
         self._sensors = {a: baxter_interface.analog_io.AnalogIO('%s_hand_range' % a)
                          for a in self._arms}
         # Cameras on the Baxter robot are tricky. Due to limited bandwidth
@@ -82,7 +108,69 @@ class Baxter(object):
         self.cameras = {a: Camera(topic='/cameras/{}_hand_camera/image'.format(a),
                                   prefix=name)
                         for a in self._arms}
-        self._planner = SimplePlanner()
+        self._velocity_controllers = {
+            a: VelocityController(limb=self._limbs[a], rate=settings.control_rate)
+            for a in self._arms
+        }
+        # tracking error of the most recent velocity controlled motion
+        self.control_telemetry = dict()
+        # the most recent motion of each limb
+        self._motions = dict()
+        self._motions_lock = threading.Lock()
+
+        # persistent inverse kinematics service proxies, set up on first use
+        self._ik_services = dict()
+        self._ik_locks = {a: threading.Lock() for a in self._arms}
+        # latency of inverse kinematics service calls
+        self.ik_stats = {a: TimingStats() for a in self._arms}
+        # kinematic models of the limbs for local inverse kinematics
+        self.kinematics = {a: KinematicChain.baxter(a) for a in self._arms}
+        # cache of inverse kinematics solutions
+        self.ik_cache = IKCache()
+        self._ik_cache_file = ik_cache_file
+        if ik_cache_file is not None:
+            try:
+                self.ik_cache.load(filename=ik_cache_file)
+            except IOError:
+                pass
+            except (ValueError, KeyError, zipfile.BadZipfile) as e:
+                self._logger.warning("Failed to read IK cache file {} ({}). "
+                                     "Start with an empty cache.".format(
+                                         ik_cache_file, e))
+                self.ik_cache = IKCache()
+        # precomputed map of reachable positions in the task space
+        self.reachability = None
+        if reachability_file is not None:
+            try:
+                self.reachability = ReachabilityMap.load(filename=reachability_file)
+            except IOError:
+                self._logger.warning("No reachability map found in {}. "
+                                     "Run compute_reachability.py to create "
+                                     "one.".format(reachability_file))
+
+        # recent endpoint poses and joint angles, to look up the state of a
+        # limb at the time a camera image was taken
+        self.pose_history = {a: PoseHistory(size=300) for a in self._arms}
+        self.joint_history = {a: StateHistory(size=300) for a in self._arms}
+        self._joint_names = {a: self._limbs[a].joint_names() for a in self._arms}
+        self._state_subscribers = [
+            rospy.Subscriber('/robot/limb/{}/endpoint_state'.format(a),
+                             EndpointState, self._endpoint_callback,
+                             callback_args=a, queue_size=10, tcp_nodelay=True)
+            for a in self._arms
+        ]
+        self._state_subscribers.append(
+            rospy.Subscriber('/robot/joint_states', JointState,
+                             self._joint_state_callback, queue_size=10,
+                             tcp_nodelay=True))
+
+        # coordinate frames of the grippers and the sensors mounted on them
+        self.transforms = TransformGraph()
+        for arm in self._arms:
+            self.transforms.set_dynamic(
+                parent='base', child='{}_gripper'.format(arm),
+                lookup=lambda stamp, a=arm: self._hom_gripper_at(arm=a,
+                                                                 stamp=stamp))
 
         self._rs = None
         self._init_state = None
@@ -121,6 +209,24 @@ class Baxter(object):
         """
         return [0.032, -0.020245, -0.1289]
 
+    def _set_sensor_transforms(self):
+        """Add the static transformations of the hand cameras and range
+        sensors relative to the grippers to the transform graph.
+        """
+        hom_cam_in_grip = np.eye(4)
+        hom_cam_in_grip[:-1, :-1] = np.array([[0, 1, 0], [-1, 0, 0], [0, 0, 1]])
+        hom_cam_in_grip[:-1, -1] = self.cam_offset
+        # only the offset of the range sensor is known
+        hom_range_in_grip = np.eye(4)
+        hom_range_in_grip[:-1, -1] = self.range_offset
+        for arm in self._arms:
+            self.transforms.set_static(parent='{}_gripper'.format(arm),
+                                       child='{}_hand_camera'.format(arm),
+                                       hom=hom_cam_in_grip)
+            self.transforms.set_static(parent='{}_gripper'.format(arm),
+                                       child='{}_hand_range'.format(arm),
+                                       hom=hom_range_in_grip)
+
     def set_up(self, gripper=True):
         """Enable the robot, move both limbs to neutral configuration and
         calibrate both grippers.
@@ -138,13 +244,20 @@ class Baxter(object):
         self.cam_offset = self._get_cam_offset()
         self._logger.info("Getting range offset.")
         self.range_offset = self._get_range_offset()
+        self._set_sensor_transforms()
 
         self._logger.info("Moving limbs to neutral configuration and calibrate grippers.")
-        for arm in self._arms:
-            self._limbs[arm].move_to_neutral()
+
+        def prepare(a):
+            self._limbs[a].move_to_neutral()
             if gripper:
-                self._grippers[arm].set_parameters(parameters=self._grippers_pars)
-                self._grippers[arm].calibrate()
+                self._grippers[a].set_parameters(parameters=self._grippers_pars)
+                self._grippers[a].calibrate()
+
+        # both limbs are prepared simultaneously
+        handles = [self._start_motion(a, prepare, a) for a in self._arms]
+        self._wait_for_motions(handles)
+        for arm in self._arms:
             # Measured meters per pixel @ 1 m distance
             self.cameras[arm].meters_per_pixel = 0.0025
 
@@ -160,7 +273,18 @@ class Baxter(object):
             if gripper:
                 self._grippers[arm].set_parameters(defaults=True)
                 self._grippers[arm].open()
-            self._limbs[arm].move_to_neutral()
+        self.move_to_neutral()
+        for subscriber in self._state_subscribers:
+            subscriber.unregister()
+        for monitor in self.gripper_monitors.values():
+            monitor.unregister()
+        for arm in self._arms:
+            self._logger.debug("IK service latency ({}): {}".format(
+                arm, self.ik_stats[arm]))
+            self._close_ik_service(arm=arm)
+        self._logger.debug("IK cache: {}".format(self.ik_cache.statistics()))
+        if self._ik_cache_file is not None:
+            self.ik_cache.save(filename=self._ik_cache_file)
         if not self._init_state:
             self._logger.info("Disabling robot")
             self._rs.disable()
@@ -189,13 +313,115 @@ class Baxter(object):
         pose_msg.header.stamp = rospy.Time.now()
         return pose_msg
 
-    def endpoint_pose(self, arm):
+    @staticmethod
+    def _stamp_or_now(header):
+        stamp = header.stamp
+        if stamp.is_zero():
+            stamp = rospy.Time.now()
+        return stamp
+
+    def _endpoint_callback(self, msg, arm):
+        """Append an endpoint state message to the pose history of a limb."""
+        p, o = msg.pose.position, msg.pose.orientation
+        self.pose_history[arm].add(stamp=self._stamp_or_now(msg.header),
+                                   value=[p.x, p.y, p.z, o.x, o.y, o.z, o.w])
+
+    def _joint_state_callback(self, msg):
+        """Append a joint state message to the joint histories of the limbs
+        whose joints it contains.
+        """
+        positions = dict(zip(msg.name, msg.position))
+        stamp = None
+        for arm in self._arms:
+            names = self._joint_names[arm]
+            if all(name in positions for name in names):
+                if stamp is None:
+                    stamp = self._stamp_or_now(msg.header)
+                self.joint_history[arm].add(
+                    stamp=stamp, value=[positions[name] for name in names])
+
+    def _hom_gripper_at(self, arm, stamp):
+        """Look up the gripper pose of a limb at a given time stamp.
+
+        :param arm: The arm <'left', 'right'>.
+        :param stamp: The time stamp (rospy.Time or seconds) or None for the
+            current pose.
+        :return: The homogeneous transformation matrix (a 4x4 numpy array).
+        """
+        if stamp is not None:
+            pose = self.pose_history[arm].pose_at(stamp=stamp)
+            if pose is not None:
+                return poses_to_hom([pose])[0]
+            self._logger.debug("No {} endpoint state recorded at the requested "
+                               "time. Use the current pose.".format(arm))
+        return pose_dict_to_hom(pose=self._limbs[arm].endpoint_pose())
+
+    def _state_stamp(self, arm, stamp):
+        """Resolve the time stamp to look up the state of a limb at. The
+        current state is the most recent recorded state, such that repeated
+        lookups of the current state are cached by the transform graph.
+        Time stamps not covered by the state history resolve to None, such
+        that the current pose of the limb is used instead and not cached
+        for that time stamp.
+
+        :param arm: The arm <'left', 'right'>.
+        :param stamp: The time stamp (rospy.Time or seconds) or None for the
+            current state.
+        :return: The time stamp in seconds or None if the state at that time
+            was not recorded.
+        """
+        latest = self.pose_history[arm].latest()
+        if latest is None:
+            return None
+        if stamp is None or to_sec(stamp) > latest[0]:
+            return latest[0]
+        if not self.pose_history[arm].covers(stamp=stamp):
+            self._logger.debug("No {} endpoint state recorded at the requested "
+                               "time. Use the current pose.".format(arm))
+            return None
+        return to_sec(stamp)
+
+    def snapshot(self, arm):
+        """Return the most recently received state of a limb without
+        querying the limb.
+
+        :param arm: The arm <'left', 'right'>.
+        :return: A tuple (stamp, pose, config) of the time stamp in seconds
+            of the most recent endpoint state, the pose as a numpy array
+            [x, y, z, qx, qy, qz, qw] and a dictionary of joint name keys to
+            the most recent joint angles, or None if nothing was received yet.
+        """
+        pose = self.pose_history[arm].latest()
+        joints = self.joint_history[arm].latest()
+        if pose is None or joints is None:
+            return None
+        return pose[0], pose[1], dict(zip(self._joint_names[arm], joints[1]))
+
+    def joint_angles_at(self, arm, stamp):
+        """Look up the joint angles of a limb at a given time stamp.
+
+        :param arm: The arm <'left', 'right'>.
+        :param stamp: The time stamp (rospy.Time or seconds).
+        :return: A dictionary of joint name keys to joint angles or None if
+            the time stamp is not covered by the joint history.
+        """
+        angles = self.joint_history[arm].value_at(stamp=stamp)
+        if angles is None:
+            return None
+        return dict(zip(self._joint_names[arm], angles))
+
+    def endpoint_pose(self, arm, stamp=None):
         """Return the current Cartesian pose of the end effector of the given
         limb.
 
         :param arm: The arm <'left', 'right'> to control.
+        :param stamp: An optional time stamp (rospy.Time or seconds) to
+            return the recorded pose at instead of the current pose.
         :return: The pose as a list [x, y, z, roll, pitch, yaw].
         """
+        if stamp is not None:
+            return hom_to_list(matrix=self.hom_gripper_to_robot(arm=arm,
+                                                                stamp=stamp))
         return pose_dict_to_list(self._limbs[arm].endpoint_pose())
 
     @staticmethod
@@ -209,16 +435,26 @@ class Baxter(object):
             (lim['yaw_max'] - lim['yaw_min'])*np.random.random_sample() + lim['yaw_min']
         ]
 
-    def sample_task_space_pose(self, clip_z=False):
+    def sample_task_space_pose(self, clip_z=False, arm=None):
         """Sample a random pose from within the robot's task space.
         Note: The orientation is held fixed!
 
         :param clip_z: Whether to clip the maximum z coordinate.
             Used for calibrating the table height, due to strange behavior of
             the distance sensor.
+        :param arm: The arm <'left', 'right'> the pose is sampled for. If a
+            reachability map is available, only positions reachable by this
+            limb (by either limb if None) are sampled.
         :return: The random pose as a list [x, y, z, roll, pitch, yaw].
         """
-        borders = settings.task_space_limits_m
+        orientation = [np.pi, 0.0, np.pi]
+        if self.reachability is not None and \
+                self.reachability.covers(poses_to_hom([[0.0]*3 + orientation])[:, :3, :3])[0]:
+            # sample only positions reachable by the limb(s)
+            pos = self.reachability.sample(arm=arm,
+                                           z_max=0.0 if clip_z else None)
+            return pos + orientation
+        borders = copy.copy(settings.task_space_limits_m)
         if clip_z:
             borders['z_max'] = 0.0
         borders['roll_max'] = borders['roll_min'] = np.pi
@@ -226,6 +462,94 @@ class Baxter(object):
         borders['yaw_max'] = borders['yaw_min'] = np.pi
         return self.sample_pose(lim=borders)
 
+    def _ik_service(self, arm):
+        """Return the persistent inverse kinematics service proxy of a limb,
+        setting it up if necessary. The caller needs to hold the limb's IK
+        lock.
+
+        :param arm: The arm <'left', 'right'> to control.
+        :return: A rospy.ServiceProxy instance.
+        :raise rospy.ROSException: If the service is not available.
+        """
+        if arm not in self._ik_services:
+            node = "ExternalTools/" + arm + "/PositionKinematicsNode/IKService"
+            rospy.wait_for_service(node, 5.0)
+            self._ik_services[arm] = rospy.ServiceProxy(node, SolvePositionIK,
+                                                        persistent=True)
+        return self._ik_services[arm]
+
+    def _close_ik_service(self, arm):
+        """Close the persistent inverse kinematics service proxy of a limb.
+
+        :param arm: The arm <'left', 'right'> to control.
+        :return:
+        """
+        with self._ik_locks[arm]:
+            service = self._ik_services.pop(arm, None)
+            if service is not None:
+                service.close()
+
+    def _call_ik_service(self, arm, request):
+        """Call the inverse kinematics service of a limb over its persistent
+        connection. If the connection was lost, reconnect and repeat the
+        request once.
+
+        :param arm: The arm <'left', 'right'> to control.
+        :param request: A SolvePositionIKRequest instance.
+        :return: The SolvePositionIKResponse.
+        :raise rospy.ServiceException, rospy.ROSException: If the request
+            failed.
+        """
+        with self._ik_locks[arm]:
+            for attempt in range(2):
+                try:
+                    start = time.time()
+                    response = self._ik_service(arm=arm)(request)
+                    self.ik_stats[arm].add(time.time() - start)
+                    return response
+                except (rospy.ServiceException, rospy.ROSException), error_message:
+                    service = self._ik_services.pop(arm, None)
+                    if service is not None:
+                        service.close()
+                    if attempt > 0 or service is None:
+                        self._logger.error("Service request failed: %r" %
+                                           (error_message,))
+                        raise
+                    self._logger.debug("IK service connection lost. Reconnect.")
+
+    @staticmethod
+    def _pose_to_list(pose):
+        """Convert a pose into a list.
+
+        :param pose: A ROS Pose or a list of length 6 or 7.
+        :return: The pose as a list of length 6 or 7.
+        """
+        if isinstance(pose, Pose):
+            return [pose.position.x, pose.position.y, pose.position.z,
+                    pose.orientation.x, pose.orientation.y,
+                    pose.orientation.z, pose.orientation.w]
+        return list(pose)
+
+    def _local_ik(self, arm, targets, seeds):
+        """Solve inverse kinematics for one limb at a number of poses with
+        the kinematic model of the limb.
+
+        :param arm: The arm <'left', 'right'> to control.
+        :param targets: A (N, 4, 4) numpy array of homogeneous
+            transformation matrices.
+        :param seeds: A list of dictionaries of joint name keys to joint
+            angles, one per target, to start the solver from.
+        :return: A tuple (valid, configs) of a boolean numpy array and a
+            list of dictionaries of joint name keys to joint angles or None.
+        """
+        chain = self.kinematics[arm]
+        seeds = np.array([[seed[name] for name in chain.joint_names]
+                          for seed in seeds])
+        valid, solutions = chain.ik(targets=targets, seeds=seeds)
+        configs = [dict(zip(chain.joint_names, solution)) if v else None
+                   for v, solution in zip(valid, solutions)]
+        return valid, configs
+
     def ik(self, arm, pose=None):
         """Solve inverse kinematics for one limb at given pose.
 
@@ -240,22 +564,9 @@ class Baxter(object):
         if pose is None:
             return self._limbs[arm].joint_angles()
 
-        pq = self._stamp_pose(pose, target_frame="base")
-        node = "ExternalTools/" + arm + "/PositionKinematicsNode/IKService"
-        ik_service = rospy.ServiceProxy(node, SolvePositionIK)
-        ik_request = SolvePositionIKRequest()
-        ik_request.pose_stamp.append(pq)
-        try:
-            rospy.wait_for_service(node, 5.0)
-            ik_response = ik_service(ik_request)
-        except (rospy.ServiceException, rospy.ROSException), error_message:
-            self._logger.error("Service request failed: %r" % (error_message,))
-            raise
-
-        if ik_response.isValid[0]:
-            # convert response to joint position control dictionary
-            return dict(zip(ik_response.joints[0].name,
-                            ik_response.joints[0].position))
+        valid, configs = self.ik_batch(arm=arm, poses=[pose])
+        if valid[0]:
+            return configs[0]
         else:
             pose_str = np.array_str(np.array(pose), precision=3,
                                     suppress_small=True)
@@ -264,80 +575,375 @@ class Baxter(object):
             self._logger.debug(s)
             raise ValueError(s)
 
-    def ik_either_limb(self, pose):
+    def ik_batch(self, arm, poses, seeds=None):
+        """Solve inverse kinematics for one limb at a number of poses in a
+        single service request. Solutions are looked up in and added to the
+        cache of inverse kinematics solutions. Poses out of reach of the limb
+        are rejected without calling the service. If settings.ik_backend is
+        'local', the poses are solved with the kinematic model of the limb
+        first and only the remaining ones are sent to the service.
+
+        :param arm: The arm <'left', 'right'> to control.
+        :param poses: A list of poses, each one of
+            - a ROS Pose,
+            - a list of length 6 [x, y, z, roll, pitch, yaw] or
+            - a list of length 7 [x, y, z, qx, qy, qz, qw].
+        :param seeds: An optional list of dictionaries of joint name keys to
+            joint angles, one per pose, to seed the solver with. If None,
+            poses close to previously solved poses are seeded with the cached
+            solutions.
+        :return: A tuple (valid, configs) of a boolean numpy array indicating
+            for which poses a valid configuration was found and a list
+            holding for each pose a dictionary of joint name keys to joint
+            angles or None.
+        """
+        valid = np.zeros(len(poses), dtype=bool)
+        configs = [None]*len(poses)
+        misses = list()
+        for idx, pose in enumerate(poses):
+            configs[idx] = self.ik_cache.get(arm=arm, pose=pose)
+            if configs[idx] is None:
+                misses.append(idx)
+            else:
+                valid[idx] = True
+        if len(misses) == 0:
+            return valid, configs
+
+        targets = poses_to_hom([self._pose_to_list(poses[idx])
+                                for idx in misses])
+        reachable = np.logical_not(
+            self.kinematics[arm].out_of_reach(targets[:, :3, 3]))
+        misses = [idx for idx, r in zip(misses, reachable) if r]
+        targets = targets[reachable]
+        if len(misses) == 0:
+            return valid, configs
+
+        if seeds is None:
+            # seed the solver with the closest cached solutions, if any
+            seeds = [None]*len(poses)
+            for idx in misses:
+                seeds[idx] = self.ik_cache.nearest(arm=arm, pose=poses[idx])
+            if all(seeds[idx] is None for idx in misses):
+                seeds = None
+            else:
+                current = self._limbs[arm].joint_angles()
+                seeds = [current if seed is None else seed for seed in seeds]
+        elif len(seeds) != len(poses):
+            raise ValueError("Expected {} seeds, got {}!".format(
+                len(poses), len(seeds)))
+        if settings.ik_backend == 'local':
+            if seeds is None:
+                current = self._limbs[arm].joint_angles()
+                local_seeds = [current]*len(misses)
+            else:
+                local_seeds = [seeds[idx] for idx in misses]
+            local_valid, local_configs = self._local_ik(arm=arm,
+                                                        targets=targets,
+                                                        seeds=local_seeds)
+            for idx, v, config in zip(misses, local_valid, local_configs):
+                if v:
+                    valid[idx] = True
+                    configs[idx] = config
+                    self.ik_cache.put(arm=arm, pose=poses[idx], config=config)
+            misses = [idx for idx, v in zip(misses, local_valid) if not v]
+            if len(misses) == 0:
+                return valid, configs
+        ik_request = SolvePositionIKRequest()
+        for idx in misses:
+            ik_request.pose_stamp.append(self._stamp_pose(poses[idx],
+                                                          target_frame="base"))
+        if seeds is not None:
+            for idx in misses:
+                joints = JointState()
+                joints.name = list(seeds[idx].keys())
+                joints.position = [seeds[idx][name] for name in joints.name]
+                ik_request.seed_angles.append(joints)
+            ik_request.seed_mode = SolvePositionIKRequest.SEED_USER
+        ik_response = self._call_ik_service(arm=arm, request=ik_request)
+
+        for idx, joints, v in zip(misses, ik_response.joints,
+                                  ik_response.isValid):
+            if v:
+                # convert response to joint position control dictionary
+                valid[idx] = True
+                configs[idx] = dict(zip(joints.name, joints.position))
+                self.ik_cache.put(arm=arm, pose=poses[idx],
+                                  config=configs[idx])
+        return valid, configs
+
+    def _joint_distance(self, arm, config):
+        """Joint space distance of a configuration from the current
+        configuration of a limb.
+
+        :param arm: The arm <'left', 'right'>.
+        :param config: A dictionary of joint name keys to joint angles.
+        :return: The Euclidean distance in radians.
+        """
+        current = self._limbs[arm].joint_angles()
+        return np.sqrt(sum((config[name] - current[name])**2
+                           for name in config if name in current))
+
+    def ik_either_limb(self, pose, policy=None):
         """Attempt to solve the inverse kinematics for a given pose with
-        either arm. If no solution is found, raise an exception
+        either arm. The inverse kinematics of both arms are solved
+        concurrently and, if both arms can reach the pose, one of them is
+        selected according to the given policy. If a reachability map is
+        available, the limbs it deems unable to reach the pose are only
+        tried if no solution is found for the others. If no solution is
+        found, raise an exception.
 
         :param pose: The pose to stamp. One of
-            - None, in which case the current set of joint angles is returned,
             - a ROS Pose,
             - a list of length 6 [x, y, z, roll, pitch, yaw] or
             - a list of length 7 [x, y, z, qx, qy, qz, qw].
+        :param policy: The policy to select an arm with. One of
+            - 'distance': the arm whose solution is closest to its current
+              configuration in joint space,
+            - 'free': an arm not holding an object, ties are broken by
+              joint space distance.
+            If None, settings.ik_arm_selection is used.
         :return: tuple of string and dict:
             - the arm <'left', 'right'> the solution was found for
             - a dictionary of joint name keys to joint angles.
         :raise ValueError: if no valid configuration was found for either arm.
         """
-        arm = 'left'
-        try:
-            cfg = self.ik(arm, pose)
-        except ValueError:
-            # no valid configuration found for left arm
-            arm = 'right'
+        if policy is None:
+            policy = settings.ik_arm_selection
+        if policy not in ['distance', 'free']:
+            raise ValueError("Unknown arm selection policy '{}'!".format(policy))
+        arms = list(self._arms)
+        unlikely = list()
+        if self.reachability is not None:
+            target = poses_to_hom([self._pose_to_list(pose)])
+            if self.reachability.covers(target[:, :3, :3])[0]:
+                # the map is approximate, only try the limbs it deems unable
+                # to reach the position if neither of the others succeeds
+                unlikely = [a for a in arms
+                            if not self.reachability.is_reachable(
+                                target[:, :3, 3], arm=a)[0]]
+                arms = [a for a in arms if a not in unlikely]
+
+        configs = dict()
+
+        def solve(a):
             try:
-                cfg = self.ik(arm, pose)
-            except ValueError:
-                # no valid configuration found for right arm
-                s = "No valid configuration found for pose {} with either arm!".format(pose)
-                self._logger.warning(s)
-                raise ValueError(s)
-        return arm, cfg
-
-    def control(self, trajectory):
+                valid, cfgs = self.ik_batch(arm=a, poses=[pose])
+                if valid[0]:
+                    configs[a] = cfgs[0]
+            except (rospy.ServiceException, rospy.ROSException):
+                # already logged by the service call
+                pass
+
+        for group in [arms, unlikely]:
+            threads = [threading.Thread(target=solve, args=(a,))
+                       for a in group]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            if len(configs) > 0:
+                break
+
+        if len(configs) == 0:
+            s = "No valid configuration found for pose {} with either arm!".format(pose)
+            self._logger.warning(s)
+            raise ValueError(s)
+
+        def cost(a):
+            distance = self._joint_distance(arm=a, config=configs[a])
+            if policy == 'free':
+                return self.is_gripping(arm=a), distance
+            return distance
+
+        arm = min(configs, key=cost)
+        self._logger.debug("Selected {} limb out of {} by {}.".format(
+            arm, sorted(configs), policy))
+        return arm, configs[arm]
+
+    def _start_motion(self, arm, target, *args, **kwargs):
+        """Execute a motion of one limb in a background thread. If the limb
+        is still executing a previous motion, wait for it to finish first.
+
+        :param arm: The arm <'left', 'right'> to control.
+        :param target: The callable executing the motion.
+        :param args: Positional arguments passed on to the callable.
+        :param kwargs: Keyword arguments passed on to the callable.
+        :return: A MotionHandle instance.
+        """
+        with self._motions_lock:
+            previous = self._motions.get(arm)
+            handle = MotionHandle(arm=arm, target=self._run_motion,
+                                  args=(previous, target) + args,
+                                  kwargs=kwargs)
+            self._motions[arm] = handle
+        return handle.start()
+
+    @staticmethod
+    def _run_motion(previous, target, *args, **kwargs):
+        if previous is not None:
+            previous.wait()
+        return target(*args, **kwargs)
+
+    def _wait_for_motions(self, handles, timeout=None):
+        """Wait for motions to finish, log their execution times and
+        re-raise the first exception raised by any of them.
+
+        :param handles: A list of MotionHandle instances.
+        :param timeout: The maximum time to wait in seconds or None to wait
+            indefinitely.
+        :return:
+        :raise RuntimeError: If the motions did not finish in time.
+        """
+        if not wait_all(handles, timeout=timeout):
+            raise RuntimeError("Motions did not finish within {} s!".format(timeout))
+        for handle in handles:
+            self._logger.debug("{} limb finished motion in {:.2f} s.".format(
+                handle.arm.capitalize(), handle.duration))
+        for handle in handles:
+            handle.result()
+
+    def wait_for_motion(self, arm=None, timeout=None):
+        """Wait for the current motion of one or both limbs to finish.
+
+        :param arm: The arm <'left', 'right'>. If None, wait for both limbs.
+        :param timeout: The maximum time to wait in seconds or None to wait
+            indefinitely.
+        :return: Whether the motions have finished.
+        """
+        arms = self._arms if arm is None else [arm]
+        with self._motions_lock:
+            handles = [self._motions[a] for a in arms if a in self._motions]
+        return wait_all(handles, timeout=timeout)
+
+    def _execute(self, steps):
+        """Execute a list of position control steps."""
+        for q in steps:
+            arm = q.keys()[0].split('_')[0]
+            self._limbs[arm].move_to_joint_positions(q)
+
+    def _execute_velocity(self, arm, trajectory):
+        """Execute a velocity trajectory and keep its tracking error."""
+        telemetry = self._velocity_controllers[arm].execute(trajectory=trajectory)
+        self.control_telemetry[arm] = telemetry
+        self._logger.debug("Velocity control ({}): {}".format(arm, telemetry))
+
+    def control(self, trajectory, block=True):
         """Control one limb using position, velocity or torque control.
 
         :param trajectory: A generator MotionPlanner instance.
-        :return:
+        :param block: Whether to wait for the motion to finish (default) or
+            to execute it in the background.
+        :return: If block is False, a MotionHandle instance.
         """
         if not isinstance(trajectory, MotionPlanner):
             raise TypeError("'trajectory' must be a MotionPlanner instance!")
         if trajectory.controller_type == 'position':
-            for q in trajectory:
-                arm = q.keys()[0].split('_')[0]
-                self._limbs[arm].move_to_joint_positions(q)
+            steps = list(trajectory)
+            if len(steps) == 0:
+                return None
+            arm = steps[0].keys()[0].split('_')[0]
+            handle = self._start_motion(arm, self._execute, steps)
         elif trajectory.controller_type == 'velocity':
-            raise NotImplementedError("Need to implement velocity control!")
-            # for v in trajectory:
-            #     self._limbs[arm].set_joint_velocities(v)
+            arm = trajectory.start.keys()[0].split('_')[0]
+            handle = self._start_motion(arm, self._execute_velocity, arm,
+                                        trajectory)
         elif trajectory.controller_type == 'torque':
             raise NotImplementedError("Need to implement torque control!")
             # for t in trajectory:
             #     self._limbs[arm].set_joint_torques(t)
         else:
             raise KeyError("No such control mode: '{}'!".format(trajectory.controller_type))
+        if not block:
+            return handle
+        handle.result()
 
-    def plan(self, target):
+    def plan(self, target, waypoints=None):
         """Plan a trajectory from the current to the target configuration.
+        Trajectories through waypoints and trajectories in velocity control
+        mode (see settings.control_mode) are executed with velocity control.
+        Note: The trajectory starts at the current configuration of the limb.
+        To queue a motion after a running one, use move_to_config or
+        move_along, which plan once the previous motion has finished.
 
         :param target: Dictionary of joint name keys to target joint angles.
+        :param waypoints: An optional list of dictionaries of joint name keys
+            to intermediate joint angles.
         :return: A MotionPlanner trajectory generator.
         """
         arm = target.keys()[0].split('_')[0]
         start = self._limbs[arm].joint_angles()
-        self._planner.plan(start=start, end=target)
-        return self._planner
+        if waypoints is None and settings.control_mode == 'position':
+            planner = SimplePlanner()
+            planner.plan(start=start, end=target)
+            return planner
+        planner = TrajectoryPlanner(rate=settings.control_rate,
+                                    max_velocity=settings.control_max_velocity,
+                                    max_acceleration=settings.control_max_acceleration)
+        planner.plan(start=start, end=target, waypoints=waypoints)
+        return planner
+
+    def _plan_and_execute(self, target, waypoints):
+        """Plan a trajectory from the current to the target configuration
+        and execute it. Run in the motion thread of the limb, such that the
+        trajectory starts from where the previous motion of the limb ended.
 
-    def move_to_config(self, config):
+        :param target: Dictionary of joint name keys to target joint angles.
+        :param waypoints: An optional list of dictionaries of joint name keys
+            to intermediate joint angles.
+        :return:
+        """
+        trajectory = self.plan(target=target, waypoints=waypoints)
+        if trajectory.controller_type == 'position':
+            self._execute(steps=list(trajectory))
+        else:
+            arm = target.keys()[0].split('_')[0]
+            self._execute_velocity(arm=arm, trajectory=trajectory)
+
+    def _move(self, target, waypoints=None, block=True):
+        """Queue planning and executing a trajectory to the target
+        configuration after the current motion of the limb.
+
+        :param target: Dictionary of joint name keys to target joint angles.
+        :param waypoints: An optional list of dictionaries of joint name keys
+            to intermediate joint angles.
+        :param block: Whether to wait for the motion to finish (default) or
+            to execute it in the background.
+        :return: If block is False, a MotionHandle instance.
+        """
+        arm = target.keys()[0].split('_')[0]
+        handle = self._start_motion(arm, self._plan_and_execute, target,
+                                    waypoints)
+        if not block:
+            return handle
+        handle.result()
+
+    def move_to_config(self, config, block=True):
         """Shortcut for planning a trajectory to the target configuration
-        and executing the trajectory.
+        and executing the trajectory. The trajectory is planned once the
+        previous motion of the limb has finished.
 
         :param config: Dictionary of joint name keys to target joint angles.
-        :return:
+        :param block: Whether to wait for the motion to finish (default) or
+            to execute it in the background.
+        :return: If block is False, a MotionHandle instance.
         """
-        trajectory = self.plan(target=config)
-        self.control(trajectory=trajectory)
+        return self._move(target=config, block=block)
+
+    def move_along(self, configs, block=True):
+        """Shortcut for planning a trajectory through a number of
+        configurations of one limb and executing it with velocity control,
+        without stopping at the intermediate configurations.
 
-    def move_to_pose(self, arm, pose):
+        :param configs: A list of dictionaries of joint name keys to joint
+            angles, the last one being the target configuration.
+        :param block: Whether to wait for the motion to finish (default) or
+            to execute it in the background.
+        :return: If block is False, a MotionHandle instance.
+        """
+        return self._move(target=configs[-1], waypoints=configs[:-1],
+                          block=block)
+
+    def move_to_pose(self, arm, pose, block=True):
         """Shortcut for planning a trajectory to the target pose
         and executing the trajectory. Compute the corresponding target
         configuration using the inverse kinematics solver before planning and
@@ -349,28 +955,38 @@ class Baxter(object):
             - a ROS Pose,
             - a list of length 6 [x, y, z, roll, pitch, yaw] or
             - a list of length 7 [x, y, z, qx, qy, qz, qw].
-        :return:
+        :param block: Whether to wait for the motion to finish (default) or
+            to execute it in the background.
+        :return: If block is False, a MotionHandle instance.
         """
         try:
             config = self.ik(arm=arm, pose=pose)
         except ValueError as e:
             raise e
-        self.move_to_config(config=config)
+        return self.move_to_config(config=config, block=block)
 
-    def move_to_neutral(self, arm=None):
+    def move_to_neutral(self, arm=None, block=True):
         """Move the lift, right or both limbs to their neutral configuration.
+        Both limbs are moved simultaneously.
 
         :param arm: The arm <'left', 'right'> to control. If None, move both
             arms.
-        :return:
+        :param block: Whether to wait for the motions to finish (default) or
+            to execute them in the background.
+        :return: If block is False, a list of MotionHandle instances.
         """
         if arm is None:
-            for arm in self._arms:
-                self._limbs[arm].move_to_neutral()
+            arms = self._arms
         elif arm in self._arms:
-            self._limbs[arm].move_to_neutral()
+            arms = [arm]
         else:
             raise KeyError("No '{}' limb!".format(arm))
+        handles = [self._start_motion(a, self._limbs[a].move_to_neutral)
+                   for a in arms]
+        if block:
+            self._wait_for_motions(handles)
+        else:
+            return handles
 
     @staticmethod
     def _gripper_ranges_meters():
@@ -455,16 +1071,44 @@ class Baxter(object):
         :param arm: The arm <'left', 'right'> to control.
         :return: Whether an object is held (True) or not (False).
         """
+        if self.gripper_monitors[arm].has_state():
+            return self.gripper_monitors[arm].is_holding()
         force_measured = self._grippers[arm].force()
         return force_measured > 0.5*self._grippers_pars['holding_force']
 
-    def release(self, arm):
-        """Open the specified gripper. Blocking command.
+    def release(self, arm, block=True):
+        """Open the specified gripper.
 
         :param arm: The arm <'left', 'right'> to control.
+        :param block: Whether to wait for the gripper to open (default) or to
+            return immediately, e.g., to retreat while the gripper opens.
+            See wait_for_force_drop.
         :return:
         """
-        return self._grippers[arm].open(block=True)
+        self.gripper_monitors[arm].expect_release()
+        return self._grippers[arm].open(block=block)
+
+    def wait_for_force_drop(self, arm, timeout=None):
+        """Wait for the specified gripper to stop holding an object, e.g.,
+        after commanding it to open.
+
+        :param arm: The arm <'left', 'right'> to control.
+        :param timeout: The maximum time to wait in seconds or None to wait
+            indefinitely.
+        :return: Whether the gripper does not hold an object any more.
+        """
+        return self.gripper_monitors[arm].wait_for_force_drop(timeout=timeout)
+
+    def wait_for_object_removal(self, arm, timeout=None):
+        """Wait for the object held by the specified gripper to be taken
+        out of the gripper, e.g., by a human during a handover.
+
+        :param arm: The arm <'left', 'right'> to control.
+        :param timeout: The maximum time to wait in seconds or None to wait
+            indefinitely.
+        :return: Whether the object was removed.
+        """
+        return self.gripper_monitors[arm].wait_for_removal(timeout=timeout)
 
     def measure_distance(self, arm):
         """Measure the distance from the specified limb to the closest object
@@ -478,40 +1122,50 @@ class Baxter(object):
             return distance/1000.0
         return None
 
-    def hom_gripper_to_robot(self, arm):
+    def hom_gripper_to_robot(self, arm, stamp=None):
         """Get the homogeneous transformation matrix {}^R\mat{T}_{G} relating
         gripper coordinates to robot coordinates.
 
         :param arm: The arm <'left', 'right'> to control.
-        :return: The homogeneous transformation matrix (a 4x4 numpy array).
+        :param stamp: An optional time stamp (rospy.Time or seconds) to
+            return the recorded transformation at instead of the current one.
+        :return: The homogeneous transformation matrix (a read-only 4x4 numpy
+            array).
         """
-        ee_pose = self._limbs[arm].endpoint_pose()
-        return pose_dict_to_hom(pose=ee_pose)
+        return self.transforms.lookup(target='base',
+                                      source='{}_gripper'.format(arm),
+                                      stamp=self._state_stamp(arm=arm,
+                                                              stamp=stamp))
 
-    def hom_camera_to_robot(self, arm):
+    def hom_camera_to_robot(self, arm, stamp=None):
         """Get the homogeneous transformation matrix {}^R\mat{T}_{C} relating
         camera coordinates to robot coordinates.
 
         :param arm: The arm <'left', 'right'> to control.
-        :return: The homogeneous transformation matrix (a 4x4 numpy array).
+        :param stamp: An optional time stamp (rospy.Time or seconds), e.g., of
+            a camera image, to return the recorded transformation at instead
+            of the current one.
+        :return: The homogeneous transformation matrix (a read-only 4x4 numpy
+            array).
         """
-        hom_grip_in_rob = self.hom_gripper_to_robot(arm=arm)
-        hom_cam_in_grip = np.eye(4)
-        hom_cam_in_grip[:-1, :-1] = np.array([[0, 1, 0], [-1, 0, 0], [0, 0, 1]])
-        hom_cam_in_grip[:-1, -1] = self.cam_offset
-        hom_cam_in_rob = np.dot(hom_grip_in_rob, hom_cam_in_grip)
-        return hom_cam_in_rob
+        return self.transforms.lookup(target='base',
+                                      source='{}_hand_camera'.format(arm),
+                                      stamp=self._state_stamp(arm=arm,
+                                                              stamp=stamp))
 
-    def camera_pose(self, arm):
+    def camera_pose(self, arm, stamp=None):
         """Return the current Cartesian pose of the camera of the given limb.
 
         :param arm: The arm <'left', 'right'> to control.
+        :param stamp: An optional time stamp (rospy.Time or seconds) to
+            return the recorded pose at instead of the current pose.
         :return: The pose as a list [x, y, z, roll, pitch, yaw].
         """
-        cam_pose = hom_to_list(matrix=self.hom_camera_to_robot(arm=arm))
+        cam_pose = hom_to_list(matrix=self.hom_camera_to_robot(arm=arm,
+                                                               stamp=stamp))
         return cam_pose
 
-    def estimate_object_position(self, arm, center):
+    def estimate_object_position(self, arm, center, stamp=None):
         """Compute an estimate for the 3D position of an object lying on a
         table with known height.
         Note: This method only works if the gripper is restricted to be
@@ -519,16 +1173,35 @@ class Baxter(object):
 
         :param arm: The arm <'left', 'right'> to control.
         :param center: The pixel coordinates to project to robot coordinates.
+        :param stamp: An optional time stamp of the image the pixel
+            coordinates refer to.
         :return: The estimated object position as a list of length 3 [x, y, z].
         """
-        distance = self.camera_pose(arm=arm)[2] - self.z_table
-        cam_coord = self.cameras[arm].projection_pixel_to_camera(pixel=center,
-                                                                 z=distance)
-        hom_coord = np.asarray(cam_coord + [1])
-        rob_coord = np.dot(self.hom_camera_to_robot(arm=arm), hom_coord)
-        rob_coord /= rob_coord[-1]
-        delta = abs(abs(rob_coord[2]) - abs(self.z_table))
+        return list(self.estimate_object_positions(arm=arm, centers=[center],
+                                                   stamp=stamp)[0])
+
+    def estimate_object_positions(self, arm, centers, stamp=None):
+        """Compute estimates for the 3D positions of a number of objects lying
+        on a table with known height. Vectorized version of
+        estimate_object_position.
+        Note: This method only works if the gripper is restricted to be
+        oriented perpendicular to the table top.
+
+        :param arm: The arm <'left', 'right'> to control.
+        :param centers: The pixel coordinates to project to robot coordinates
+            as a (N, 2) array.
+        :param stamp: An optional time stamp of the image the pixel
+            coordinates refer to, to use the camera pose at that time.
+        :return: The estimated object positions as a (N, 3) numpy array.
+        """
+        hom_cam_in_rob = self.hom_camera_to_robot(arm=arm, stamp=stamp)
+        distance = hom_cam_in_rob[2, -1] - self.z_table
+        cam_coord = self.cameras[arm].projection_pixels_to_camera(pixels=centers,
+                                                                  z=distance)
+        rob_coord = np.dot(cam_coord, hom_cam_in_rob[:-1, :-1].T) + hom_cam_in_rob[:-1, -1]
+        delta = np.abs(np.abs(rob_coord[:, 2]) - abs(self.z_table)).max()
         if delta > 1e-3:
             self._logger.warning("Estimated and measured z coordinate of the object "
                                  "(table) deviate by {} > 0.001 m!".format(delta))
-        return [rob_coord[0], rob_coord[1], self.z_table]
+        rob_coord[:, 2] = self.z_table
+        return rob_coord
@@ -0,0 +1,160 @@
+# Copyright (c) 2016, BRML
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import logging
+import time
+
+import numpy as np
+import rospy
+
+
+class TrackingTelemetry(object):
+    def __init__(self, joint_names):
+        """Record of the tracking error of a closed-loop controller.
+
+        :param joint_names: The names of the controlled joints.
+        """
+        self.joint_names = list(joint_names)
+        self.stamps = list()
+        self.errors = list()
+
+    def add(self, stamp, error):
+        """Record the tracking error of one control period.
+
+        :param stamp: The time stamp in seconds.
+        :param error: A list of the reference minus the measured joint
+            angles, in the order of the joint names.
+        :return:
+        """
+        self.stamps.append(stamp)
+        self.errors.append(error)
+
+    def statistics(self, period=None):
+        """Summarize the recorded tracking errors.
+
+        :param period: The nominal control period in seconds to count
+            overruns against.
+        :return: A dictionary of statistics.
+        """
+        if len(self.stamps) == 0:
+            return {'steps': 0}
+        errors = np.abs(np.array(self.errors))
+        periods = np.diff(self.stamps)
+        stats = {
+            'steps': len(self.stamps),
+            'duration': self.stamps[-1] - self.stamps[0],
+            'rms_error': float(np.sqrt((errors**2).mean())),
+            'max_error': float(errors.max()),
+            'final_error': float(errors[-1].max()),
+            'max_period': float(periods.max()) if len(periods) > 0 else 0.0
+        }
+        if period is not None:
+            stats['overruns'] = int((periods > 1.5*period).sum())
+        return stats
+
+    def __str__(self):
+        stats = self.statistics()
+        if stats['steps'] == 0:
+            return 'no samples'
+        return "{} steps in {:.2f} s, tracking error rms {:.4f} rad, max " \
+               "{:.4f} rad, final {:.4f} rad".format(
+                   stats['steps'], stats['duration'], stats['rms_error'],
+                   stats['max_error'], stats['final_error'])
+
+
+class VelocityController(object):
+    def __init__(self, limb, rate=100.0, kp=2.0, max_velocity=1.5,
+                 tolerance=0.008, settle_timeout=1.0):
+        """Fixed-rate joint velocity controller for one limb, tracking the
+        reference trajectory of a velocity MotionPlanner with feedforward
+        velocities and proportional feedback on the joint angles.
+
+        :param limb: A baxter_interface.Limb instance.
+        :param rate: The control rate in Hz.
+        :param kp: The proportional gain in 1/s.
+        :param max_velocity: The maximum commanded joint velocity in rad/s.
+        :param tolerance: The tolerance of the final joint angles in rad.
+        :param settle_timeout: The maximum time to reach the final joint
+            angles after the trajectory has ended in seconds.
+        """
+        self._logger = logging.getLogger('main.baxter.control')
+        self._limb = limb
+        self.rate = rate
+        self.kp = kp
+        self.max_velocity = max_velocity
+        self.tolerance = tolerance
+        self.settle_timeout = settle_timeout
+
+    def _command(self, names, reference, velocity, telemetry):
+        """Command one control period and record the tracking error.
+
+        :return: The largest absolute tracking error in rad.
+        """
+        measured = self._limb.joint_angles()
+        error = [reference[n] - measured[n] for n in names]
+        command = np.clip(np.array([velocity.get(n, 0.0) for n in names]) +
+                          self.kp*np.array(error),
+                          -self.max_velocity, self.max_velocity)
+        self._limb.set_joint_velocities(dict(zip(names, command)))
+        telemetry.add(stamp=time.time(), error=error)
+        return np.abs(error).max()
+
+    def execute(self, trajectory):
+        """Execute a velocity trajectory. Blocking command.
+
+        :param trajectory: A velocity MotionPlanner instance with a start
+            configuration (see motion_planning.TrajectoryPlanner).
+        :return: A TrackingTelemetry instance.
+        """
+        reference = dict(trajectory.start)
+        names = sorted(reference.keys())
+        telemetry = TrackingTelemetry(joint_names=names)
+        rate = rospy.Rate(self.rate)
+        dt = 1.0/self.rate
+        try:
+            for velocity in trajectory:
+                if rospy.is_shutdown():
+                    break
+                self._command(names, reference, velocity, telemetry)
+                for n in names:
+                    reference[n] += velocity[n]*dt
+                rate.sleep()
+            # converge onto the final configuration
+            deadline = time.time() + self.settle_timeout
+            while not rospy.is_shutdown() and time.time() < deadline:
+                if self._command(names, reference, {}, telemetry) < self.tolerance:
+                    break
+                rate.sleep()
+        finally:
+            self._limb.set_joint_velocities({n: 0.0 for n in names})
+            # return to position control, holding the current configuration
+            self._limb.exit_control_mode()
+        stats = telemetry.statistics(period=dt)
+        if stats['steps'] > 0 and stats['final_error'] > self.tolerance:
+            self._logger.warning("Final tracking error {:.4f} rad exceeds the "
+                                 "tolerance.".format(stats['final_error']))
+        if stats.get('overruns', 0) > 0:
+            self._logger.debug("{} control periods overran.".format(stats['overruns']))
+        return telemetry
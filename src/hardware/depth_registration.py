@@ -27,19 +27,315 @@
 # When implementing a C++ node using the kinect2_registration library from
 # the iai_kinect2 package we found that the depth image is cropped before
 # being scaled and the field of view of the resulting color and depth images
-# are quite different, such that they cannot easily be superimposed. We thus
-# resort to a very naive workaround by scaling and shifting the depth image
-# by constant factors to match the color image reasonable well.
+# are quite different, such that they cannot easily be superimposed.
+# The DepthRegistration class implements the registration from the intrinsic
+# parameters of both sensors and the rotation and translation between them,
+# as stored in kinect_parameters.npz by the 'calibrate_kinect.py' script.
+# If these are not available we resort to a very naive workaround by scaling
+# and shifting the depth image by constant factors to match the color image
+# reasonable well (see register_depth and get_depth).
 # This is feasible since all we need is a rough estimate for the depth, the
 # visual servoing will take care of the rest.
-# It would be much nicer to use the iai_kinect2 or WindowsSDK libraries,
-# though.
 
+import logging
 import numpy as np
 
 import cv2
 
 
+class DepthRegistration(object):
+    def __init__(self, cam_mat_depth, dist_coeff_depth, size_depth,
+                 cam_mat_color, dist_coeff_color, size_color,
+                 rotation, translation):
+        """Register Kinect depth images to color images of any resolution.
+        The back-projection of each depth pixel (undistorted and rotated into
+        the color sensor frame) is computed once, such that registering a
+        depth image reduces to a vectorized projection and a single scatter
+        into the color image plane.
+
+        :param cam_mat_depth: The 3x3 camera matrix of the depth sensor.
+        :param dist_coeff_depth: The distortion coefficients of the depth
+            sensor.
+        :param size_depth: The size (height, width) of the depth images.
+        :param cam_mat_color: The 3x3 camera matrix of the color sensor.
+        :param dist_coeff_color: The distortion coefficients of the color
+            sensor.
+        :param size_color: The size (height, width) of the color images the
+            color camera matrix refers to.
+        :param rotation: The 3x3 rotation from depth to color sensor frame.
+        :param translation: The translation (in meters) from depth to color
+            sensor frame.
+        """
+        self._logger = logging.getLogger('main.kinect.registration')
+        self._size_depth = tuple(int(x) for x in size_depth[:2])
+        self._cam_mat_color = np.asarray(cam_mat_color, dtype=np.float64)
+        self._size_color = tuple(int(x) for x in size_color[:2])
+        dist = np.zeros(5)
+        if dist_coeff_color is not None:
+            d = np.asarray(dist_coeff_color, dtype=np.float64).flatten()[:5]
+            dist[:len(d)] = d
+        self._dist_color = dist if np.any(dist) else None
+        # affine transformation from depth to color sensor frame in meters
+        self.hom_depth_to_color = np.eye(4)
+        self.hom_depth_to_color[:3, :3] = rotation
+        self.hom_depth_to_color[:3, 3] = np.asarray(translation).flatten()
+        # translation in millimeters, since depth images are in millimeters
+        self._translation = \
+            1000.0*np.asarray(translation, dtype=np.float32).flatten()
+
+        # normalized, undistorted viewing rays of all depth pixels rotated
+        # into the color sensor frame
+        h, w = self._size_depth
+        py, px = np.mgrid[:h, :w]
+        pixels = np.vstack([px.ravel(), py.ravel()]).T.astype(np.float64)
+        if dist_coeff_depth is None:
+            dist_coeff_depth = np.zeros(5)
+        rays = cv2.undistortPoints(pixels.reshape(-1, 1, 2),
+                                   np.asarray(cam_mat_depth, dtype=np.float64),
+                                   np.asarray(dist_coeff_depth,
+                                              dtype=np.float64)).reshape(-1, 2)
+        rays = np.hstack([rays, np.ones((len(rays), 1))])
+        # one contiguous array per coordinate for fast elementwise operations
+        self._rays = np.ascontiguousarray(
+            np.dot(np.asarray(rotation), rays.T), dtype=np.float32)
+
+        self._last = None
+
+    @classmethod
+    def from_cameras(cls, camera_depth, camera_color, rotation, translation,
+                     distortion=True):
+        """Set up the registration from the depth and color Camera instances.
+
+        :param camera_depth: The Camera instance of the depth sensor.
+        :param camera_color: The Camera instance of the color sensor.
+        :param rotation: The 3x3 rotation from depth to color sensor frame.
+        :param translation: The translation (in meters) from depth to color
+            sensor frame.
+        :param distortion: Whether the images are raw (distorted) images
+            (True) or rectified images (False).
+        :return: A DepthRegistration instance.
+        """
+        return cls(cam_mat_depth=camera_depth.camera_matrix,
+                   dist_coeff_depth=camera_depth.distortion_coeff if distortion else None,
+                   size_depth=camera_depth.image_size,
+                   cam_mat_color=camera_color.camera_matrix,
+                   dist_coeff_color=camera_color.distortion_coeff if distortion else None,
+                   size_color=camera_color.image_size,
+                   rotation=rotation, translation=translation)
+
+    def _project(self, img_depth, size_color):
+        """Project all valid depth pixels into the color image plane.
+
+        :param img_depth: A depth image in millimeters.
+        :param size_color: The size (height, width) of the color image.
+        :return: A tuple (flat indices into the color image, depth in the
+            color sensor frame in millimeters).
+        """
+        if img_depth.shape[:2] != self._size_depth:
+            raise ValueError("Expected a depth image of size {}, got "
+                             "{}!".format(self._size_depth, img_depth.shape[:2]))
+        d = img_depth.ravel().astype(np.float32)
+        rx, ry, rz = self._rays
+        t = self._translation
+        z = d*rz + t[2]
+        x = (d*rx + t[0])/z
+        y = (d*ry + t[1])/z
+        if self._dist_color is not None:
+            k1, k2, p1, p2, k3 = self._dist_color
+            r2 = x*x + y*y
+            radial = 1.0 + r2*(k1 + r2*(k2 + r2*k3))
+            xy = x*y
+            x, y = (x*radial + 2.0*p1*xy + p2*(r2 + 2.0*x*x),
+                    y*radial + p1*(r2 + 2.0*y*y) + 2.0*p2*xy)
+        # the color camera matrix scaled to the requested image size
+        h, w = size_color
+        sx = float(w)/self._size_color[1]
+        sy = float(h)/self._size_color[0]
+        cm = self._cam_mat_color
+        u = np.floor(x*(cm[0, 0]*sx) + cm[0, 2]*sx + 0.5).astype(np.int64)
+        v = np.floor(y*(cm[1, 1]*sy) + cm[1, 2]*sy + 0.5).astype(np.int64)
+        inside = (u >= 0) & (u < w) & (v >= 0) & (v < h) & (d > 0) & (z > 0)
+        return v[inside]*w + u[inside], z[inside]
+
+    def register(self, img_depth, size_color):
+        """Compute a depth image that matches the color image. If several
+        depth pixels map onto the same color pixel, the closest one is kept.
+        Color pixels without depth measurement are 0.
+        Note: The result for the most recent depth image is cached, such that
+        subsequent point queries on the same image are cheap. Depth images
+        must not be modified in place after having been registered.
+
+        :param img_depth: A depth image in millimeters.
+        :param size_color: The size (height, width) of the color image.
+        :return: A uint16 depth image in millimeters matching the color image.
+        """
+        size_color = tuple(int(x) for x in size_color[:2])
+        if self._last is not None and self._last[0] is img_depth and \
+                self._last[1] == size_color:
+            return self._last[2]
+        idx, z = self._project(img_depth=img_depth, size_color=size_color)
+        # sort by pixel and depth at once, the first entry per pixel is the
+        # closest one (z-buffering)
+        keys = (idx << 16) | np.clip(z + 0.5, 0, 65535).astype(np.int64)
+        keys.sort()
+        pix = keys >> 16
+        first = np.ones(len(keys), dtype=bool)
+        first[1:] = pix[1:] != pix[:-1]
+        output = np.zeros(size_color, dtype=np.uint16)
+        output.flat[pix[first]] = keys[first] & 0xFFFF
+        self._last = img_depth, size_color, output
+        return output
+
+    def get_depth(self, img_depth, size_color, pixel_color):
+        """Compute the depth at a given pixel in the color image from a
+        corresponding depth image.
+
+        :param img_depth: A depth image in millimeters.
+        :param size_color: The size (height, width) of the color image.
+        :param pixel_color: The requested pixel (x, y) in the color image.
+        :return: The depth at the requested pixel in meters (0 if unknown).
+        """
+        reg = self.register(img_depth=img_depth, size_color=size_color)
+        depth, _ = sample_depth(img_depth=reg, pixels=[pixel_color])
+        return 0.0 if np.isnan(depth[0]) else depth[0]
+
+
+def _robust_median(values):
+    """Compute the median of the valid (non-zero) values in each row.
+
+    :param values: A (N, k) array of depth values, where 0 marks invalid
+        measurements.
+    :return: A (N,) array holding the median of the valid values in each
+        row, NaN if there are none.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n, k = values.shape
+    if k == 0:
+        return np.full(n, np.nan)
+    valid = values > 0
+    n_valid = valid.sum(axis=1)
+    # invalid values are sorted to the end of each row
+    values = np.where(valid, values, np.inf)
+    values.sort(axis=1)
+    rows = np.arange(n)
+    lo = values[rows, np.maximum(n_valid - 1, 0)//2]
+    hi = values[rows, np.minimum(n_valid//2, k - 1)]
+    return np.where(n_valid > 0, 0.5*(lo + hi), np.nan)
+
+
+def _grouped_median(labels, values, n_groups):
+    """Compute the median of the valid (non-zero) depth values of a number
+    of groups of pixels, sorting all values only once.
+
+    :param labels: A (M,) array of group indices.
+    :param values: A (M,) array of depth values in millimeters, where 0
+        marks invalid measurements.
+    :param n_groups: The number of groups.
+    :return: A tuple of (n_groups,) arrays (median depth in meters of the
+        valid values in each group, NaN if there are none; fraction of valid
+        values).
+    """
+    values = np.asarray(values, dtype=np.float64)
+    valid = values > 0
+    n_total = np.bincount(labels, minlength=n_groups)
+    n_valid = np.bincount(labels[valid], minlength=n_groups)
+    fraction = n_valid/np.maximum(n_total, 1).astype(np.float64)
+    depth = np.full(n_groups, np.nan)
+    if not valid.any():
+        return depth, fraction
+    labels = labels[valid]
+    values = values[valid]
+    # sort by group first and by depth within each group
+    values = values[np.lexsort((values, labels))]
+    start = np.cumsum(n_valid) - n_valid
+    lo = np.minimum(start + np.maximum(n_valid - 1, 0)//2, len(values) - 1)
+    hi = np.minimum(start + n_valid//2, len(values) - 1)
+    found = n_valid > 0
+    depth[found] = 0.5*(values[lo[found]] + values[hi[found]])/1000.0
+    return depth, fraction
+
+
+def sample_depth(img_depth, pixels, radius=2):
+    """Robustly sample a (registered) depth image at a number of pixels.
+    For each pixel, the median of the valid (non-zero) depth values in a
+    square window around it is computed. The window is trimmed at the image
+    borders.
+
+    :param img_depth: A depth image in millimeters matching the image the
+        pixels refer to.
+    :param pixels: The pixels (x, y) as a (N, 2) array.
+    :param radius: The radius of the square window in pixels.
+    :return: A tuple of (N,) arrays (depth in meters, NaN if no valid value
+        was found; fraction of valid values in the window).
+    """
+    pixels = np.floor(np.asarray(pixels, dtype=np.float64).reshape(-1, 2) +
+                      0.5).astype(np.int64)
+    h, w = img_depth.shape[:2]
+    offsets = np.arange(-radius, radius + 1)
+    xs = pixels[:, 0][:, np.newaxis, np.newaxis] + offsets[np.newaxis, np.newaxis, :]
+    ys = pixels[:, 1][:, np.newaxis, np.newaxis] + offsets[np.newaxis, :, np.newaxis]
+    xs, ys = np.broadcast_arrays(xs, ys)
+    xs = xs.reshape(len(pixels), -1)
+    ys = ys.reshape(len(pixels), -1)
+    inside = (xs >= 0) & (xs < w) & (ys >= 0) & (ys < h)
+    values = np.zeros(xs.shape, dtype=np.float64)
+    values[inside] = img_depth[ys[inside], xs[inside]]
+    median = _robust_median(values)
+    # only count window pixels within the image for the validity fraction
+    n_inside = inside.sum(axis=1)
+    fraction = (values > 0).sum(axis=1)/np.maximum(n_inside, 1).astype(np.float64)
+    return median/1000.0, fraction
+
+
+def box_depth(img_depth, boxes, trim=0.5):
+    """Robustly estimate the depth of a number of bounding boxes in a
+    (registered) depth image. Only the central part of each box is used, to
+    not include background pixels at the object boundaries.
+
+    :param img_depth: A depth image in millimeters matching the image the
+        boxes refer to.
+    :param boxes: The boxes (x_min, y_min, x_max, y_max) as a (N, 4) array.
+    :param trim: The fraction of the box width and height to use, centered
+        at the center of the box.
+    :return: A tuple of (N,) arrays (median depth in meters of the valid
+        values in the trimmed boxes, NaN if there are none; fraction of
+        valid values).
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    h, w = img_depth.shape[:2]
+    ctr = 0.5*(boxes[:, :2] + boxes[:, 2:])
+    half = 0.5*trim*(boxes[:, 2:] - boxes[:, :2])
+    lower = np.clip(np.floor(ctr - half), 0, [w - 1, h - 1]).astype(np.int64)
+    upper = np.clip(np.ceil(ctr + half), 0, [w - 1, h - 1]).astype(np.int64)
+    # gather the pixels of all (trimmed) boxes at once
+    width = upper[:, 0] - lower[:, 0] + 1
+    size = width*(upper[:, 1] - lower[:, 1] + 1)
+    labels = np.repeat(np.arange(len(boxes)), size)
+    index = np.arange(len(labels)) - np.repeat(np.cumsum(size) - size, size)
+    xs = lower[labels, 0] + index % width[labels]
+    ys = lower[labels, 1] + index//width[labels]
+    return _grouped_median(labels=labels, values=img_depth[ys, xs],
+                           n_groups=len(boxes))
+
+
+def mask_depth(img_depth, masks):
+    """Robustly estimate the depth of a number of segmented objects in a
+    (registered) depth image.
+
+    :param img_depth: A depth image in millimeters matching the image the
+        masks refer to.
+    :param masks: A (N, h, w) boolean array or a list of N (h, w) boolean
+        arrays holding the object masks.
+    :return: A tuple of (N,) arrays (median depth in meters of the valid
+        values in the masks, NaN if there are none; fraction of valid
+        values).
+    """
+    masks = np.asarray(masks, dtype=bool)
+    labels, ys, xs = np.nonzero(masks)
+    return _grouped_median(labels=labels, values=img_depth[ys, xs],
+                           n_groups=len(masks))
+
+
 def register_depth(img_depth, size_color):
     """Compute a depth image that matches the color image.
     Note: This method implements a naive workaround to 'proper' depth image
@@ -64,7 +360,8 @@ def register_depth(img_depth, size_color):
         raise ValueError("Not defined for size {}!".format(size_color))
     dsize = tuple([int(x * scale_factor)
                    for x in img_depth.shape[:2]][::-1])
-    img_depth = cv2.resize(img_depth, dsize, interpolation=cv2.INTER_CUBIC)
+    # do not interpolate across depth discontinuities and invalid pixels
+    img_depth = cv2.resize(img_depth, dsize, interpolation=cv2.INTER_NEAREST)
     output = np.zeros(size_color, dtype=img_depth.dtype)
     h0, w0 = output.shape[:2]
     h2, w2 = img_depth.shape[:2]
@@ -110,14 +407,19 @@ def get_depth(img_depth, size_color, pixel_color):
     return img_depth[scaled_y, scaled_x]/1000.0
 
 
-def blend(img_color, img_depth):
+def blend(img_color, img_depth, registration=None):
     """Blend the color and registered depth image on top of each other.
 
     :param img_color: A color image.
     :param img_depth: A corresponding depth image.
+    :param registration: An optional DepthRegistration instance. If None,
+        the naive workaround is used.
     :return: The registered depth image overlaid on top of the color image.
     """
-    img_reg = register_depth(img_depth, img_color.shape[:2])
+    if registration is None:
+        img_reg = register_depth(img_depth, img_color.shape[:2])
+    else:
+        img_reg = registration.register(img_depth, img_color.shape[:2])
     img_reg = cv2.cvtColor(cv2.convertScaleAbs(img_reg), cv2.COLOR_GRAY2BGR)
     alpha = 0.3
     beta = 1.0 - alpha
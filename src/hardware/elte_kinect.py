@@ -0,0 +1,580 @@
+# Copyright (c) 2016, BRML
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+# DISCLAIMER: The client interface to the ELTE Kinect Windows tool is adapted
+# from and inspired by software written by Mike Olasz at ELTE.
+
+import logging
+import numpy as np
+import socket
+import struct
+import threading
+import time
+
+import cv2
+
+from core import TimingStats
+
+
+# number of joints per skeleton sent by the ELTE Kinect Windows tool
+joint_type_count = 13
+# layout of one joint sent by the ELTE Kinect Windows tool: camera space
+# coordinates, color space and depth space (pixel) coordinates
+joint_dtype = np.dtype([('camera', '<f4', (3,)),
+                        ('color', '<f4', (2,)),
+                        ('depth', '<f4', (2,))])
+
+# the streams provided by the ELTE Kinect Windows tool, in request order
+streams = ('color', 'depth', 'skeleton')
+
+
+class ElteKinectClient(object):
+    def __init__(self, host, prefix, port=9999, timeout=5.0,
+                 persistent=True, pipeline=False, max_age=0.1, max_drops=3):
+        """Client for the ELTE Kinect Windows tool.
+        The protocol is a simple request--response protocol: The client
+        sends a request line '<color><depth><skeleton>\\n', e.g., '101\\n',
+        and the server answers with each of the requested streams by
+        sending the size of the data (an int32), waiting for an 'OK\\n'
+        acknowledgement, sending the data and waiting for an 'OK2\\n'
+        acknowledgement. Skeleton data additionally is preceded by the
+        number of bodies (an uint32), acknowledged by 'OK\\n'.
+
+        The client keeps its TCP/IP connection open between requests,
+        transparently reconnects if the connection is lost and optionally
+        pipelines requests, i.e., requests the next frame while the current
+        one is being decoded. Pipelining only pays off if requests are issued
+        back to back, e.g., when streaming, since an outdated pipelined
+        response needs to be received and discarded.
+
+        :param host: The host name or IP of the machine running the server.
+        :param prefix: The prefix for the logger name to use.
+        :param port: The port the server listens on.
+        :param timeout: The socket timeout in seconds.
+        :param persistent: Whether to keep the connection open between
+            requests (True) or to connect anew for each request (False).
+        :param pipeline: Whether to send the next request right after
+            receiving the response to the current one by default, see
+            request.
+        :param max_age: The maximum age in seconds of a pipelined response.
+            Older responses are discarded and requested anew.
+        :param max_drops: The number of consecutive requests for which the
+            kept-alive connection is found closed before the client stops
+            keeping connections open.
+        """
+        self._logger = logging.getLogger('{}.client'.format(prefix))
+        self._server = host, port
+        self._timeout = timeout
+        self._persistent = persistent
+        self._pipeline = pipeline
+        self._max_drops = max_drops
+        # number of consecutive requests for which the kept-alive connection
+        # was found closed by the server
+        self._drops = 0
+        self._max_age = max_age
+
+        self._socket = None
+        # flags and time stamp of a pipelined request
+        self._pending = None
+
+        # receive buffers, reused for each stream type
+        self._header = bytearray(4)
+        self._buffers = dict()
+        self.stats = dict()
+        self.reset_statistics()
+
+    def connect(self):
+        """Connect to the server if not connected yet.
+
+        :return:
+        :raise RuntimeError: If the connection could not be established.
+        """
+        if self._socket is not None:
+            return
+        self._logger.debug('Connect to {} on port {}.'.format(
+            self._server[0].upper(), self._server[1]))
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # the protocol exchanges many small messages, disable Nagle's algorithm
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.settimeout(self._timeout)
+        try:
+            sock.connect(self._server)
+        except socket.error:
+            sock.close()
+            raise RuntimeError("Failed to connect to {}!".format(
+                self._server[0].upper()) + " Check your network connection.")
+        self._socket = sock
+        self._pending = None
+
+    def close(self):
+        """Close the connection to the server.
+
+        :return:
+        """
+        if self._socket is not None:
+            self._logger.debug('Close socket.')
+            try:
+                self._socket.close()
+            except socket.error:
+                pass
+        self._socket = None
+        self._pending = None
+
+    def request(self, color=False, depth=False, skeleton=False,
+                pipeline=None):
+        """Request the latest color, depth and skeleton data from the server.
+        If the connection was lost, reconnect and repeat the request once.
+        If kept-alive connections are found closed for several consecutive
+        requests, the server is assumed not to keep connections alive and
+        a new connection is opened for each subsequent request.
+
+        :param color: Whether to retrieve the latest color image.
+        :param depth: Whether to retrieve the latest depth image.
+        :param skeleton: Whether to retrieve the latest skeleton data.
+        :param pipeline: Whether to request the next frame right after
+            receiving this one. Only use this if the next request follows
+            immediately. If None, the default set up for the client is used.
+        :return: A triple (color image, depth image, skeletons).
+        :raise socket.error: If the request failed after reconnecting.
+        """
+        if pipeline is None:
+            pipeline = self._pipeline
+        flags = (bool(color), bool(depth), bool(skeleton))
+        reused = self._socket is not None
+        try:
+            raw = self._request(flags=flags)
+        except socket.error as e:
+            self.close()
+            if not reused:
+                raise
+            self._logger.debug("Connection lost ({}). Reconnect.".format(e))
+            raw = self._request(flags=flags)
+            self._drops += 1
+            if self._persistent and self._drops >= self._max_drops:
+                self._logger.info("Server does not keep connections alive. "
+                                  "Connect anew for each request.")
+                self._persistent = False
+        else:
+            if reused:
+                self._drops = 0
+        if self._persistent and pipeline:
+            try:
+                self._send_request(flags=flags)
+                self._pending = flags, time.time()
+            except socket.error:
+                self.close()
+        elif not self._persistent:
+            self.close()
+        return self._decode(flags=flags, raw=raw)
+
+    def _request(self, flags):
+        """Receive the response to a request, either by using a pipelined
+        request covering the requested streams or by sending a new request.
+
+        :param flags: The triple of (color, depth, skeleton) flags.
+        :return: The raw response data.
+        """
+        self.connect()
+        if self._pending is not None:
+            pending_flags, stamp = self._pending
+            self._pending = None
+            raw = self._receive(flags=pending_flags)
+            if all(p or not f for p, f in zip(pending_flags, flags)) and \
+                    time.time() - stamp <= self._max_age:
+                # surplus streams are ignored when decoding
+                return raw
+            # The pipelined response is outdated or lacks a requested stream.
+            # We needed to receive it anyway to keep the stream in sync.
+        self._send_request(flags=flags)
+        return self._receive(flags=flags)
+
+    def _send_request(self, flags):
+        """Send a request line to the server.
+
+        :param flags: The triple of (color, depth, skeleton) flags.
+        :return:
+        """
+        self._socket.sendall('{}{}{}\n'.format(*[1 if x else 0 for x in flags]))
+
+    def reset_statistics(self):
+        """Discard the receive and decode statistics.
+
+        :return:
+        """
+        self.stats = {stream: {'bytes': 0,
+                               'receive': TimingStats(),
+                               'decode': TimingStats()}
+                      for stream in streams}
+
+    def statistics(self):
+        """Summarize the receive and decode statistics of each stream.
+
+        :return: A dictionary of stream name keys to dictionaries holding the
+            number of frames received, the receive rate in bytes/s and the
+            mean receive and decode durations in seconds.
+        """
+        summary = dict()
+        for stream, stats in self.stats.iteritems():
+            t_receive = stats['receive'].total
+            summary[stream] = {
+                'frames': stats['receive'].count,
+                'bytes/s': stats['bytes']/t_receive if t_receive > 0.0 else None,
+                'receive': stats['receive'].mean,
+                'decode': stats['decode'].mean
+            }
+        return summary
+
+    def _buffer(self, stream, n_bytes):
+        """Return the receive buffer of a stream, enlarged if necessary.
+
+        :param stream: The stream name.
+        :param n_bytes: The minimum size of the buffer.
+        :return: A bytearray of at least the requested size.
+        """
+        buf = self._buffers.get(stream)
+        if buf is None or len(buf) < n_bytes:
+            # leave some headroom for frames that compress slightly worse
+            buf = bytearray(n_bytes + n_bytes//4)
+            self._buffers[stream] = buf
+        return buf
+
+    def _recv_into(self, buf, n_bytes):
+        """Receive exactly the given number of bytes from the data stream
+        into the given buffer.
+
+        :param buf: The bytearray to receive into.
+        :param n_bytes: The number of bytes to read from the data stream.
+        :return:
+        :raise socket.error: If the server closed the connection.
+        """
+        view = memoryview(buf)
+        received = 0
+        while received < n_bytes:
+            n = self._socket.recv_into(view[received:], n_bytes - received)
+            if n == 0:
+                raise socket.error("Connection closed by server!")
+            received += n
+
+    def _receive_header(self, fmt):
+        """Receive a 4-byte header value, e.g., the number of bytes needed to
+        read from the data stream.
+
+        :param fmt: The struct format of the value.
+        :return: The received value.
+        """
+        self._recv_into(self._header, 4)
+        # Sending ACK that we received the header
+        self._socket.sendall("OK\n")
+        return struct.unpack_from(fmt, buffer(self._header))[0]
+
+    def _receive_data(self, stream, n_bytes):
+        """Receive a given number of bytes from the data stream into the
+        stream's receive buffer.
+
+        :param stream: The stream name.
+        :param n_bytes: The number of bytes to read from the data stream.
+        :return: A uint8 numpy array viewing the received data. The view is
+            only valid until the next frame of the stream is received.
+        """
+        buf = self._buffer(stream=stream, n_bytes=n_bytes)
+        self._recv_into(buf, n_bytes)
+        self._logger.debug("Received {} bytes.".format(n_bytes))
+        # Sending ACK that we received the data
+        self._socket.sendall("OK2\n")
+        return np.frombuffer(buf, dtype=np.uint8, count=n_bytes)
+
+    def _receive_stream(self, stream):
+        """Receive the data of one stream.
+
+        :param stream: The stream name.
+        :return: The received data or None. For skeleton data, a tuple of
+            the number of bodies and the received data.
+        """
+        start = time.time()
+        n_bytes = self._receive_header('<i')  # we receive an int value
+        if n_bytes < 0:
+            return None
+        self._logger.debug("Need to receive {} bytes.".format(n_bytes))
+        n_bodies = None
+        if stream == 'skeleton':
+            # Reading the number of bodies we want to receive data for
+            n_bodies = self._receive_header('<I')  # read unsigned int value
+        data = self._receive_data(stream=stream, n_bytes=n_bytes)
+        self.stats[stream]['receive'].add(time.time() - start)
+        self.stats[stream]['bytes'] += n_bytes
+        if n_bodies is not None:
+            return n_bodies, data
+        return data
+
+    def _receive(self, flags):
+        """Receive the response to a request.
+
+        :param flags: The triple of (color, depth, skeleton) flags.
+        :return: A list of the raw data received for each requested stream.
+        """
+        return [self._receive_stream(stream=stream) if flag else None
+                for stream, flag in zip(streams, flags)]
+
+    def _decode(self, flags, raw):
+        """Decode the raw data received for a request.
+
+        :param flags: The triple of (color, depth, skeleton) flags.
+        :param raw: The raw response data.
+        :return: A triple (color image, depth image, skeletons).
+        """
+        color, depth, skeleton = raw
+        img_color = None
+        img_depth = None
+        data_skeleton = np.zeros((0, joint_type_count), dtype=joint_dtype)
+        if flags[0]:
+            if color is None:
+                self._logger.warning("Failed to receive color image data!")
+            else:
+                img_color = self._timed_decode('color', self._decode_color,
+                                               data=color)
+        if flags[1]:
+            if depth is None:
+                self._logger.warning("Failed to receive depth map data!")
+            else:
+                img_depth = self._timed_decode('depth', self._decode_depth,
+                                               data=depth)
+        if flags[2]:
+            if skeleton is None:
+                self._logger.warning("Failed to receive skeleton data!")
+            else:
+                data_skeleton = self._timed_decode('skeleton',
+                                                   self._decode_skeleton,
+                                                   n_bodies=skeleton[0],
+                                                   data=skeleton[1])
+        return img_color, img_depth, data_skeleton
+
+    def _timed_decode(self, stream, decoder, **kwargs):
+        """Run a decoder and record its duration in the stream's statistics.
+
+        :param stream: The stream name.
+        :param decoder: The decoding method.
+        :param kwargs: Keyword arguments passed on to the decoder.
+        :return: The decoded data.
+        """
+        start = time.time()
+        decoded = decoder(**kwargs)
+        self.stats[stream]['decode'].add(time.time() - start)
+        return decoded
+
+    def _decode_color(self, data):
+        """Decode a color image received from the ELTE Kinect Windows tool as
+        a uint8, three-channel numpy array of size height x width.
+
+        :param data: The received (JPEG encoded) data as uint8 numpy array.
+        :return: A (h, w, 3) numpy array holding the color image.
+        """
+        img = cv2.imdecode(data, cv2.IMREAD_COLOR)
+        if img is None:
+            self._logger.warning("Error when converting raw data to color image!")
+            return None
+        self._logger.debug("Received a {} {} color image.".format(img.shape,
+                                                                  img.dtype))
+        return img
+
+    def _decode_depth(self, data):
+        """Decode a depth image received from the ELTE Kinect Windows tool as
+        an uint16 depth map where each value represents the distance in
+        millimeters. The maximum depth distance is 8 meters, although
+        reliability starts to degrade at around 4.5 meters.
+        See https://msdn.microsoft.com/en-us/library/windowspreview.kinect.depthframe.aspx
+        for more information.
+
+        :param data: The received (PNG encoded) data as uint8 numpy array.
+        :return: A (h, w) numpy array holding the depth map.
+        """
+        img = cv2.imdecode(data, cv2.IMREAD_UNCHANGED)
+        if img is None:
+            self._logger.warning("Error when converting raw data to depth map!")
+            return None
+        self._logger.debug("Received a {} {} depth map.".format(img.shape,
+                                                                img.dtype))
+        return img
+
+    def _decode_skeleton(self, n_bodies, data):
+        """Decode skeleton data received from the ELTE Kinect Windows tool
+        as a structured array of shape (number of bodies, 13) with fields
+        'camera' (camera coordinates), 'color' (color space pixel
+        coordinates) and 'depth' (depth space pixel coordinates). E.g.,
+        skeletons['camera'] is a (n, 13, 3) array holding the camera
+        coordinates of all joints of all skeletons.
+
+        :param n_bodies: The number of bodies in the data.
+        :param data: The received data as uint8 numpy array.
+        :return: A (n, 13) structured numpy array holding n skeletons.
+        """
+        n_bytes = n_bodies*joint_type_count*joint_dtype.itemsize
+        if len(data) < n_bytes:
+            self._logger.warning("Error when converting raw data to skeleton list!")
+            return np.zeros((0, joint_type_count), dtype=joint_dtype)
+        # copy out of the receive buffer, which is reused for the next frame
+        bodies = data[:n_bytes].view(joint_dtype).reshape(
+            n_bodies, joint_type_count).copy()
+        self._logger.debug("Received skeleton data for {} bod{}.".format(
+            n_bodies, 'y' if n_bodies == 1 else 'ies'))
+        return bodies
+
+
+class ElteKinectServer(object):
+    def __init__(self, host='localhost', port=0, frame_rate=30.0,
+                 one_shot=False, color=None, depth=None, n_bodies=1):
+        """Local stand-in for the ELTE Kinect Windows tool speaking the same
+        size/ACK/data protocol. Useful for testing and benchmarking the
+        client without the Windows machine and the Kinect V2 sensor.
+
+        :param host: The host name to bind to.
+        :param port: The port to listen on. If 0, a free port is chosen.
+        :param frame_rate: The frame rate of the emulated sensor. A response
+            is sent at the next frame tick after a request arrives. If None,
+            responses are sent immediately.
+        :param one_shot: Whether to close the connection after each request.
+        :param color: An optional (540, 960, 3) color image to serve.
+        :param depth: An optional (424, 512) uint16 depth map to serve.
+        :param n_bodies: The number of skeletons to serve.
+        """
+        self._logger = logging.getLogger('main.kinect.server')
+        if color is None:
+            color = np.zeros((540, 960, 3), dtype=np.uint8)
+            color[:] = np.linspace(0, 255, 960)[np.newaxis, :, np.newaxis]
+            color += np.random.randint(0, 32, color.shape).astype(np.uint8)
+        if depth is None:
+            depth = np.random.randint(500, 4500, (424, 512)).astype(np.uint16)
+        self._color = cv2.imencode('.jpg', color)[1].tostring()
+        self._depth = cv2.imencode('.png', depth)[1].tostring()
+        self._n_bodies = n_bodies
+        self._skeleton = np.random.uniform(
+            -1.0, 1.0, (n_bodies, joint_type_count, 7)).astype('<f4').tostring()
+        self._frame_period = 1.0/frame_rate if frame_rate else 0.0
+        self._one_shot = one_shot
+
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind((host, port))
+        self._socket.listen(5)
+        self._socket.settimeout(0.2)
+        self.address = self._socket.getsockname()
+
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        """Start serving requests in a background thread.
+
+        :return:
+        """
+        self._running = True
+        self._thread = threading.Thread(target=self._serve)
+        self._thread.daemon = True
+        self._thread.start()
+        self._logger.debug("Serving on {}:{}.".format(*self.address))
+
+    def stop(self):
+        """Stop serving requests.
+
+        :return:
+        """
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._socket.close()
+
+    def _serve(self):
+        """Accept connections and handle each in its own thread."""
+        while self._running:
+            try:
+                conn, _ = self._socket.accept()
+            except socket.timeout:
+                continue
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            handler = threading.Thread(target=self._handle, args=(conn,))
+            handler.daemon = True
+            handler.start()
+
+    @staticmethod
+    def _readline(conn):
+        """Read a line from the connection.
+
+        :param conn: The client connection.
+        :return: The line without line break or None if the connection closed.
+        """
+        line = ''
+        while not line.endswith('\n'):
+            c = conn.recv(1)
+            if not c:
+                return None
+            line += c
+        return line.rstrip('\n')
+
+    def _wait_for_frame(self):
+        """Wait for the next frame tick of the emulated sensor."""
+        if self._frame_period > 0.0:
+            now = time.time()
+            time.sleep(self._frame_period - now % self._frame_period)
+
+    def _send(self, conn, data, n_bodies=None):
+        """Send one stream following the size/ACK/data/ACK protocol.
+
+        :param conn: The client connection.
+        :param data: The data to send.
+        :param n_bodies: The number of bodies for skeleton data.
+        :return: Whether the client acknowledged everything.
+        """
+        conn.sendall(struct.pack('<i', len(data)))
+        if self._readline(conn) != 'OK':
+            return False
+        if n_bodies is not None:
+            conn.sendall(struct.pack('<I', n_bodies))
+            if self._readline(conn) != 'OK':
+                return False
+        conn.sendall(data)
+        return self._readline(conn) == 'OK2'
+
+    def _handle(self, conn):
+        """Answer requests on a connection until it is closed."""
+        try:
+            while self._running:
+                request = self._readline(conn)
+                if request is None or len(request) < 3:
+                    break
+                self._wait_for_frame()
+                ok = True
+                if request[0] == '1':
+                    ok = ok and self._send(conn, self._color)
+                if request[1] == '1':
+                    ok = ok and self._send(conn, self._depth)
+                if request[2] == '1':
+                    ok = ok and self._send(conn, self._skeleton,
+                                           n_bodies=self._n_bodies)
+                if not ok or self._one_shot:
+                    break
+        except socket.error as e:
+            self._logger.debug("Connection error: {}".format(e))
+        finally:
+            conn.close()
@@ -0,0 +1,168 @@
+# Copyright (c) 2016, BRML
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import logging
+import threading
+
+import rospy
+from baxter_core_msgs.msg import EndEffectorState
+
+
+class GripperMonitor(object):
+    def __init__(self, arm, force_threshold, debounce=3):
+        """Event-driven monitor of the state of one of Baxter's electric
+        grippers. Every state message of the gripper is checked for the
+        gripper starting or stopping to hold an object, and the following
+        events are set:
+            - grasped: the gripper started holding an object,
+            - force_drop: the gripper stopped holding the object,
+            - removed: the gripper stopped holding the object without having
+              been commanded to release it, i.e., the object was taken out
+              of the gripper.
+        The force_drop and removed events are cleared whenever the gripper
+        starts holding an object. The gripper is only considered to have
+        stopped holding the object after a number of consecutive state
+        messages below the force threshold, such that a single noisy force
+        reading does not signal a removal.
+
+        :param arm: The arm <'left', 'right'> of the gripper.
+        :param force_threshold: The force (in percent of the maximum force)
+            above which an object is considered to be held.
+        :param debounce: The number of consecutive state messages below the
+            force threshold after which a held object is considered let go.
+            Note that this delays detecting the force drop and removal by
+            as many message periods. Use 1 to signal them with the first
+            message below the threshold.
+        """
+        self._logger = logging.getLogger('main.baxter.gripper')
+        self.arm = arm
+        self._threshold = force_threshold
+        self._debounce = debounce
+        # number of consecutive state messages below the force threshold
+        self._below = 0
+        self._lock = threading.Lock()
+        self.grasped = threading.Event()
+        self.force_drop = threading.Event()
+        self.removed = threading.Event()
+        self._holding = False
+        self._releasing = False
+        self.force = None
+        self.position = None
+        self.stamp = None
+        self._subscriber = rospy.Subscriber(
+            '/robot/end_effector/{}_gripper/state'.format(arm),
+            EndEffectorState, self._callback, queue_size=10, tcp_nodelay=True)
+
+    def _callback(self, msg):
+        """Update the state of the gripper and set the events."""
+        with self._lock:
+            if msg.force > self._threshold:
+                self._below = 0
+            else:
+                self._below += 1
+            holding = self._below == 0 or \
+                (self._holding and self._below < self._debounce)
+            self.force = msg.force
+            self.position = msg.position
+            self.stamp = rospy.Time.now()
+            if holding and not self._holding:
+                self._releasing = False
+                self.force_drop.clear()
+                self.removed.clear()
+                self.grasped.set()
+            elif self._holding and not holding:
+                self.grasped.clear()
+                self.force_drop.set()
+                if not self._releasing:
+                    self._logger.debug("Object was removed from {} "
+                                       "gripper.".format(self.arm))
+                    self.removed.set()
+            self._holding = holding
+
+    def has_state(self):
+        """Whether a state message has been received yet."""
+        with self._lock:
+            return self.stamp is not None
+
+    def is_holding(self):
+        """Whether the gripper holds an object according to the most recent
+        state message.
+        """
+        with self._lock:
+            return self._holding
+
+    def expect_release(self):
+        """Announce that the gripper is about to be opened, such that the
+        following force drop is not considered a removal of the object.
+        """
+        with self._lock:
+            self._releasing = True
+
+    @staticmethod
+    def _wait(event, timeout):
+        """Wait for an event, while staying responsive to ROS shutdown.
+
+        :param event: A threading.Event instance.
+        :param timeout: The maximum time to wait in seconds or None to wait
+            indefinitely.
+        :return: Whether the event is set.
+        """
+        # Event.wait without timeout cannot be interrupted in Python 2
+        while not event.is_set() and not rospy.is_shutdown():
+            if timeout is not None and timeout <= 0.0:
+                break
+            step = 0.1 if timeout is None else min(timeout, 0.1)
+            event.wait(step)
+            if timeout is not None:
+                timeout -= step
+        return event.is_set()
+
+    def wait_for_force_drop(self, timeout=None):
+        """Wait for the gripper to stop holding an object. Returns
+        immediately if no object is held.
+
+        :param timeout: The maximum time to wait in seconds or None to wait
+            indefinitely.
+        :return: Whether the gripper does not hold an object any more.
+        """
+        if not self.is_holding():
+            return True
+        return self._wait(event=self.force_drop, timeout=timeout)
+
+    def wait_for_removal(self, timeout=None):
+        """Wait for the held object to be taken out of the gripper. Returns
+        immediately if no object is held.
+
+        :param timeout: The maximum time to wait in seconds or None to wait
+            indefinitely.
+        :return: Whether the object was removed.
+        """
+        if not self.is_holding():
+            return True
+        return self._wait(event=self.removed, timeout=timeout)
+
+    def unregister(self):
+        """Shut down the subscriber."""
+        self._subscriber.unregister()
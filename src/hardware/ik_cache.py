@@ -0,0 +1,193 @@
+# Copyright (c) 2016, BRML
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import collections
+import logging
+import numpy as np
+import threading
+
+
+class IKCache(object):
+    def __init__(self, max_size=1000, resolution_m=0.001,
+                 resolution_rad=np.deg2rad(1.0), seed_radius=0.05):
+        """Cache of inverse kinematics solutions keyed on the arm and the
+        quantized pose [x, y, z, roll, pitch, yaw]. The least recently used
+        solution is evicted if the cache is full.
+
+        :param max_size: The maximum number of cached solutions.
+        :param resolution_m: The quantization of positions in meters.
+        :param resolution_rad: The quantization of angles in radians.
+        :param seed_radius: The maximum distance (in meters, see _distance)
+            of a cached solution to be used as seed for a nearby pose.
+        """
+        self._logger = logging.getLogger('main.baxter.ik_cache')
+        self._max_size = max_size
+        self._resolution = np.array([resolution_m]*3 + [resolution_rad]*3)
+        # number of quantization steps per full turn, for wrapping angles
+        self._turn = int(np.round(2.0*np.pi/resolution_rad))
+        self._seed_radius = seed_radius
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _key(self, arm, pose):
+        """Compute the cache key of a pose.
+
+        :param arm: The arm <'left', 'right'>.
+        :param pose: The pose, a list [x, y, z, roll, pitch, yaw].
+        :return: A hashable key or None if the pose cannot be cached.
+        """
+        if not isinstance(pose, (list, tuple, np.ndarray)) or len(pose) != 6:
+            return None
+        q = np.round(np.asarray(pose, dtype=np.float64)/self._resolution)
+        q = q.astype(np.int64)
+        q[3:] %= self._turn
+        return (arm,) + tuple(q)
+
+    def get(self, arm, pose):
+        """Look up the cached solution of a pose.
+
+        :param arm: The arm <'left', 'right'>.
+        :param pose: The pose, a list [x, y, z, roll, pitch, yaw].
+        :return: A dictionary of joint name keys to joint angles or None.
+        """
+        with self._lock:
+            key = self._key(arm=arm, pose=pose)
+            if key is None:
+                return None
+            config = self._entries.pop(key, None)
+            if config is None:
+                self.misses += 1
+                return None
+            # re-insert to mark as most recently used
+            self._entries[key] = config
+            self.hits += 1
+            return dict(config)
+
+    def put(self, arm, pose, config):
+        """Cache the solution of a pose.
+
+        :param arm: The arm <'left', 'right'>.
+        :param pose: The pose, a list [x, y, z, roll, pitch, yaw].
+        :param config: A dictionary of joint name keys to joint angles.
+        :return:
+        """
+        with self._lock:
+            key = self._key(arm=arm, pose=pose)
+            if key is None:
+                return
+            self._entries.pop(key, None)
+            self._entries[key] = dict(config)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def _distance(self, keys, key):
+        """Distance between quantized poses, where one radian of orientation
+        difference counts as 0.1 meters.
+        """
+        diff = (keys - np.asarray(key))*self._resolution
+        ang = diff[:, 3:]
+        ang = (ang + np.pi) % (2.0*np.pi) - np.pi
+        return np.sqrt((diff[:, :3]**2).sum(axis=1)) + \
+            0.1*np.sqrt((ang**2).sum(axis=1))
+
+    def nearest(self, arm, pose):
+        """Find the cached solution of the pose closest to the given pose,
+        e.g., to seed the inverse kinematics solver with.
+
+        :param arm: The arm <'left', 'right'>.
+        :param pose: The pose, a list [x, y, z, roll, pitch, yaw].
+        :return: A dictionary of joint name keys to joint angles or None if
+            no cached pose lies within the seed radius.
+        """
+        with self._lock:
+            key = self._key(arm=arm, pose=pose)
+            if key is None:
+                return None
+            keys = [k for k in self._entries if k[0] == arm]
+            if len(keys) == 0:
+                return None
+            dist = self._distance(np.array([k[1:] for k in keys]), key[1:])
+            idx = np.argmin(dist)
+            if dist[idx] > self._seed_radius:
+                return None
+            return dict(self._entries[keys[idx]])
+
+    def statistics(self):
+        """Summarize the cache statistics.
+
+        :return: A dictionary holding the number of cached solutions, hits,
+            misses and the hit rate.
+        """
+        n = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': float(self.hits)/n if n > 0 else None
+        }
+
+    def save(self, filename):
+        """Save the cached solutions to a file.
+
+        :param filename: The name of the .npz file to write.
+        :return:
+        """
+        with self._lock:
+            keys = list(self._entries.keys())
+            names = [sorted(self._entries[k].keys()) for k in keys]
+            np.savez(filename,
+                     arms=np.array([k[0] for k in keys]),
+                     keys=np.array([k[1:] for k in keys], dtype=np.int64),
+                     resolution=self._resolution,
+                     names=np.array(names),
+                     angles=np.array([[self._entries[k][n] for n in ns]
+                                      for k, ns in zip(keys, names)]))
+            self._logger.debug("Saved {} IK solutions to {}.".format(len(keys),
+                                                                     filename))
+
+    def load(self, filename):
+        """Load cached solutions from a file written by save.
+
+        :param filename: The name of the .npz file to read.
+        :return:
+        :raise IOError: If the file does not exist.
+        """
+        with np.load(filename) as data:
+            if not np.allclose(data['resolution'], self._resolution):
+                self._logger.info("Discard IK cache with different resolution.")
+                return
+            for arm, key, names, angles in zip(data['arms'], data['keys'],
+                                               data['names'], data['angles']):
+                self._entries[(str(arm),) + tuple(int(k) for k in key)] = \
+                    {str(n): float(a) for n, a in zip(names, angles)}
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+        self._logger.debug("Loaded {} IK solutions from {}.".format(
+            len(self._entries), filename))
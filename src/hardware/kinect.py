@@ -23,14 +23,12 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 
-# DISCLAIMER: The client interface to the ELTE Kinect Windows tool is adapted
-# from and inspired by software written by Mike Olasz at ELTE.
-
+import collections
 import logging
 import numpy as np
 import os
 import socket
-import struct
+import threading
 import time
 
 import cv2
@@ -39,7 +37,17 @@ import rospy
 from sensor_msgs.msg import CameraInfo, Image
 
 from base import Camera, img_to_imgmsg
-from depth_registration import get_depth
+from depth_registration import DepthRegistration, box_depth, register_depth
+from elte_kinect import ElteKinectClient, joint_dtype, joint_type_count
+from point_cloud import (
+    PointCloud,
+    cluster_points,
+    describe_clusters,
+    fit_plane,
+    transform_points,
+    voxel_downsample
+)
+from tracking import JointTracker
 from settings.debug import topic_img4
 
 
@@ -54,8 +62,21 @@ class Kinect(object):
         self._pub_vis = rospy.Publisher(topic_img4, Image,
                                         queue_size=10, latch=True)
         self._host = host
-        self._socket = None
+        self._client = None
+        # serializes requests of the streaming thread and direct requests
+        self._client_lock = threading.Lock()
         self._native_ros = False
+
+        # streaming mode: requested streams and buffer of time-stamped
+        # (stamp, color, depth, skeletons) samples
+        self._stream = None
+        self._stream_thread = None
+        self._samples = collections.deque(maxlen=4)
+        self._samples_cond = threading.Condition(threading.Lock())
+        # maximum time to wait for a sample in streaming mode in seconds
+        self.stream_timeout = 1.0
+        # number of requests to issue if transmitting a depth image fails
+        self.request_attempts = 3
         try:
             # try to read calibration from ROS camera info topic
             _ = rospy.wait_for_message(topic='/kinect2/sd/camera_info',
@@ -83,314 +104,590 @@ class Kinect(object):
                     'size': cal['size_depth'],
                     'dist_coeff': cal['dist_coeff_depth']
                 }
+        maps_file = None
+        if not self._native_ros:
+            # persist the undistortion maps next to the camera parameters
+            maps_file = os.path.join(os.path.dirname(path),
+                                     'kinect_rectify_{}.npz')
         self.depth = Camera(topic='/kinect2/sd/image_depth_rect',
-                            prefix=name, cam_pars=pars_depth)
+                            prefix=name, cam_pars=pars_depth,
+                            maps_file=maps_file.format('depth') if maps_file else None)
         self.color = Camera(topic='/kinect2/hd/image_color_rect',
-                            prefix=name, cam_pars=pars_color)
+                            prefix=name, cam_pars=pars_color,
+                            maps_file=maps_file.format('color') if maps_file else None)
+
+        self.registration = self._load_registration(path=path)
+        self._point_cloud = PointCloud(camera=self.depth,
+                                       distortion=not self._native_ros)
 
         # index into the skeleton arrays
-        self.joint_type_count = 13
         self.joint_type_hand_left = 7
         self.joint_type_hand_right = 11
 
-        # affine transformation from camera to Baxter coordinates
+        # affine transformation from camera to Baxter coordinates and whether
+        # it stems from an external calibration of the setup
         self.trafo = None
+        self.trafo_calibrated = False
 
-    def _receive_size(self):
-        """Receive the number of bytes needed to read from the data stream.
+        # temporal filter of the left and right hand positions
+        self.hand_tracker = JointTracker(n_joints=2)
+        self._tracker_lock = threading.Lock()
 
-        :return: The _image_size of the data to read (as an int).
+    def _load_registration(self, path):
+        """Set up the depth-to-color registration from the rotation and
+        translation between the sensors stored in kinect_parameters.npz.
+
+        :param path: The path to the Kinect parameters file.
+        :return: A DepthRegistration instance or None if the parameters are
+            not available.
         """
-        data = self._socket.recv(4)
         try:
-            size = struct.unpack('<i', data)[0]  # we receive an int value
-        except ValueError:
-            size = -1
-        finally:
-            # Sending ACK that we received the _image_size
-            self._socket.sendall("OK\n")
-        return size
-
-    def _receive_data(self, n_bytes):
-        """Receive a given number of bytes from the data stream provided by
-        the ELTE Kinect Windows tool.
-
-        :param n_bytes: The number of bytes to read from the data stream.
-        :return: The received data.
-        :raise ValueError: If the requested number of bytes was not received.
+            with np.load(path) as cal:
+                rotation = cal['rotation']
+                translation = cal['translation']
+        except (IOError, KeyError):
+            self._logger.info("No RGB--IR transformation found. Fall back to "
+                              "approximate depth registration and point "
+                              "clouds.")
+            return None
+        # images received via the native ROS interface are rectified
+        return DepthRegistration.from_cameras(camera_depth=self.depth,
+                                              camera_color=self.color,
+                                              rotation=rotation,
+                                              translation=translation,
+                                              distortion=not self._native_ros)
+
+    def point_cloud(self, img_depth, voxel_size=None, robot=True, stride=1):
+        """Convert a depth image into a point cloud.
+
+        :param img_depth: A depth image.
+        :param voxel_size: If given, downsample the point cloud to a voxel
+            grid with the given edge length in meters.
+        :param robot: Whether to transform the point cloud into robot
+            coordinates (True) or return it in depth camera coordinates
+            (False).
+        :param stride: Only use every stride-th depth pixel in each direction.
+        :return: A contiguous float32 (N, 3) numpy array of points in meters.
+        :raise ValueError: If robot coordinates are requested but the
+            camera-to-robot transformation is not set.
+        """
+        points = self._point_cloud.from_depth(img_depth=img_depth,
+                                              stride=stride)
+        if robot:
+            points = transform_points(points=points,
+                                      trafo=self._hom_depth_to_robot())
+        if voxel_size is not None:
+            points = voxel_downsample(points=points, voxel_size=voxel_size)
+        return points
+
+    def _hom_depth_to_robot(self):
+        """Compute the affine transformation from depth camera coordinates
+        to robot coordinates by composing the camera-to-robot transformation,
+        which refers to the color camera, with the transformation from depth
+        to color sensor frame.
+        Note: Without the RGB--IR transformation, the depth camera is assumed
+        to coincide with the color camera.
+
+        :return: The transformation as a 4x4 numpy array.
+        :raise ValueError: If the camera-to-robot transformation is not set.
         """
-        # Reading the socket stream to get every packet
-        data = self._socket.recv(n_bytes)
-        while len(data) < n_bytes:
-            data += self._socket.recv(n_bytes - len(data))
-        self._logger.debug("Received {}/{} bytes.".format(len(data), n_bytes))
-        if len(data) != n_bytes:
-            msg = "Received {} but should have received {} bytes!".format(
-                len(data), n_bytes)
+        if self.trafo is None:
+            msg = "Camera-to-robot transformation is not set!"
             self._logger.error(msg)
             raise ValueError(msg)
-        # Sending ACK that we received the data
-        self._socket.sendall("OK2\n")
-        return data
+        if self.registration is None:
+            return self.trafo
+        # camera coordinates have a flipped y axis, see Camera projections
+        flip = np.diag([1.0, -1.0, 1.0, 1.0])
+        hom = np.dot(flip, np.dot(self.registration.hom_depth_to_color, flip))
+        return np.dot(self.trafo, hom)
+
+    def register_depth(self, img_depth, size_color):
+        """Compute a depth image that matches the color image.
+
+        :param img_depth: A depth image.
+        :param size_color: The size (height, width) of the color image.
+        :return: A depth image matching the color image.
+        """
+        if self.registration is None:
+            return register_depth(img_depth, size_color)
+        return self.registration.register(img_depth=img_depth,
+                                          size_color=size_color)
 
-    def _receive_color(self):
-        """Receive a color image from the ELTE Kinect Windows tool and decode
-        it as a uint8, three-channel numpy array of _image_size height x width.
+    def clean_up(self):
+        """Stop streaming and close the connection to the ELTE Kinect Windows
+        tool, if any.
 
-        :return: A (h, w, 3) numpy array holding the color image.
+        :return:
         """
-        start = time.time()
-        # Reading the _image_size of the data stream we want to read
-        n_bytes = self._receive_size()
-        if n_bytes == -1:
-            self._logger.warning("Failed to receive color image data!")
-            return None
-        self._logger.debug("Need to receive {} bytes.".format(n_bytes))
+        self.stop_streaming()
+        if self._client is not None:
+            self._client.close()
+
+    def start_streaming(self, color=True, depth=True, skeleton=True,
+                        buffer_size=4):
+        """Continuously collect data from the Kinect V2 sensor in the
+        background. Subsequent calls to collect_data for (a subset of) the
+        streamed data return the newest sample without blocking.
+        Note: For the native ROS interface, the color and depth cameras
+        buffer incoming frames themselves. For the ELTE Kinect Windows tool,
+        a background thread requests data at the sensor rate.
+
+        :param color: Whether to stream color images.
+        :param depth: Whether to stream depth images.
+        :param skeleton: Whether to stream skeleton data.
+        :param buffer_size: The number of samples to buffer.
+        :return:
+        """
+        self.stop_streaming()
+        self._stream = (bool(color), bool(depth), bool(skeleton))
+        self._logger.info("Start streaming Kinect {}.".format(', '.join(
+            [n for n, f in zip(['color', 'depth', 'skeleton'], self._stream)
+             if f])))
+        if self._native_ros:
+            # subscribe now so the first frames are buffered once needed
+            if color:
+                self.color.latest()
+            if depth:
+                self.depth.latest()
+        else:
+            self._check_host()
+            with self._samples_cond:
+                self._samples = collections.deque(maxlen=buffer_size)
+            self._stream_thread = threading.Thread(target=self._stream_worker)
+            self._stream_thread.daemon = True
+            self._stream_thread.start()
 
-        # Reading the data from the socket stream
-        try:
-            msg = self._receive_data(n_bytes=n_bytes)
-        except ValueError:
-            return None
+    def stop_streaming(self):
+        """Stop collecting data in the background.
 
-        # Convert received data into a numpy array
-        try:
-            barray = np.fromstring(msg, np.uint8)
-        except ValueError:
-            self._logger.warning("Error when converting raw data to color image!")
-            return None
-        img = cv2.imdecode(barray, cv2.IMREAD_COLOR)
-        self._logger.debug("Received a {} {} color image (min={}, max={}) "
-                           "in {:.3f} s.".format(img.shape, img.dtype,
-                                                 img.min(), img.max(),
-                                                 time.time() - start))
-        return img
-
-    def _receive_depth(self):
-        """Receive a depth image from the ELTE Kinect Windows tool and decode
-        it as an uint16 depth map where each value represents the distance in
-        millimeters. The maximum depth distance is 8 meters, although
-        reliability starts to degrade at around 4.5 meters.
-        See https://msdn.microsoft.com/en-us/library/windowspreview.kinect.depthframe.aspx
-        for more information.
-
-        :return: A (h, w) numpy array holding the depth map.
-        :raise ValueError: If no depth map was received.
+        :return:
         """
-        start = time.time()
-        # Reading the _image_size of the data stream we want to read
-        n_bytes = self._receive_size()
-        if n_bytes == -1:
-            self._logger.warning("Failed to receive depth map data!")
-            return None
-        self._logger.debug("Need to receive {} bytes.".format(n_bytes))
+        if self._stream is None:
+            return
+        self._logger.info("Stop streaming Kinect data.")
+        self._stream = None
+        if self._stream_thread is not None:
+            self._stream_thread.join()
+            self._stream_thread = None
+        # do not leave the last pipelined request to later direct requests
+        with self._client_lock:
+            if self._client is not None:
+                self._client.close()
+        with self._samples_cond:
+            self._samples.clear()
+            self._samples_cond.notify_all()
+
+    def _stream_worker(self):
+        """Request data from the ELTE Kinect Windows tool until streaming is
+        stopped and append the time-stamped samples to the sample buffer.
+        """
+        flags = self._stream
+        while self._stream == flags and not rospy.is_shutdown():
+            try:
+                # the next frame is requested right away while this one is
+                # decoded
+                img_color, img_depth, data_skeleton = self._request(
+                    *flags, pipeline=True)
+            except (socket.error, RuntimeError) as e:
+                # keep streaming if the server is temporarily unreachable
+                self._logger.warning(str(e))
+                time.sleep(0.5)
+                continue
+            # transmitting images sometimes fails
+            if ((flags[0] and img_color is None) or
+                    (flags[1] and img_depth is None)):
+                continue
+            stamp = rospy.Time.now()
+            with self._samples_cond:
+                self._samples.append((stamp, img_color, img_depth,
+                                      data_skeleton))
+                self._samples_cond.notify_all()
+            if flags[2]:
+                self._track_hands(stamp=stamp, skeletons=data_skeleton)
+
+    def _check_host(self):
+        """Check that a host name for the ELTE Kinect Windows tool is given.
+
+        :return:
+        :raise ValueError: If no host name is given.
+        """
+        if not self._host:
+            msg = "No host name for ELTE Kinect Windows tool provided!"
+            self._logger.error(msg)
+            raise ValueError(msg)
 
-        # Reading the data from the socket stream
-        try:
-            msg = self._receive_data(n_bytes=n_bytes)
-        except ValueError:
-            return None
+    def _request(self, color, depth, skeleton, pipeline=False):
+        """Request data from the ELTE Kinect Windows tool.
 
-        # Convert received data into a numpy array
-        try:
-            barray = np.fromstring(msg, np.uint16)
-        except ValueError:
-            self._logger.warning("Error when converting raw data to depth map!")
-            return None
-        img = cv2.imdecode(barray, cv2.IMREAD_UNCHANGED)
-        self._logger.debug("Received a {} {} depth map (min={}, max={}) "
-                           "in {:.3f} s.".format(img.shape, img.dtype,
-                                                 img.min(), img.max(),
-                                                 time.time() - start))
-        return img
-
-    def _receive_skeleton_data(self, n_bytes):
-        """Receive skeleton data from the ELTE Kinect Windows tool.
-
-        :param n_bytes: The number of bytes to read from the data stream.
-        :return: A tuple containing the number of bodies (skeletons) in the
-            data and the received data.
+        :param color: Whether to retrieve the latest color image.
+        :param depth: Whether to retrieve the latest depth image.
+        :param skeleton: Whether to retrieve the latest skeleton data.
+        :param pipeline: Whether to request the next frame right away, see
+            ElteKinectClient.request. Only used when streaming.
+        :return: A triple (color image, depth image, skeletons).
+        :raise socket.error: If the request failed.
         """
-        # Reading the number of bodies we want to receive data for
-        data = self._socket.recv(4)
-        try:
-            n_bodies = struct.unpack("<I", data)[0]  # read unsigned int value
-        except ValueError:
-            n_bodies = 0
-        finally:
-            # Sending ACK that we received the _image_size
-            self._socket.sendall("OK\n")
-
-        # Reading the data from the socket stream
-        try:
-            msg = self._receive_data(n_bytes=n_bytes)
-        except ValueError:
-            msg = None
-        return n_bodies, msg
-
-    def _receive_skeleton(self):
-        """Receive skeleton data from the ELTE Kinect Windows tool and decode
-        if as a list of length number of bodies (skeletons), where each
-        skeleton is defined by three lists holding 13 joint coordinates each,
-        where the first list holds the camera coordinates, the second list
-        holds color space (pixel) coordinates and the third list holds depth
-        space (pixel) coordinates.
-
-        :return: A list holding n skeletons defined by three lists of joint
-            coordinates in camera, color and depth space.
+        with self._client_lock:
+            if self._client is None:
+                self._client = ElteKinectClient(host=self._host,
+                                                prefix=self._logger.name)
+            return self._client.request(color=color, depth=depth,
+                                        skeleton=skeleton, pipeline=pipeline)
+
+    def _is_streaming(self, color, depth, skeleton):
+        """Whether the requested data is part of the streamed data."""
+        return self._stream is not None and all(
+            s or not r for s, r in zip(self._stream, (color, depth, skeleton)))
+
+    def _wait_for_sample(self, max_age):
+        """Return the newest buffered sample, waiting for one if the buffer
+        is empty or the newest sample is too old.
+
+        :param max_age: The maximum age of the sample in seconds or None.
+        :return: A tuple (stamp, color image, depth image, skeletons).
+        :raise RuntimeError: If no sample was received in time.
         """
-        start = time.time()
-        # Reading the _image_size of the data stream we want to read
-        n_bytes = self._receive_size()
-        if n_bytes == -1:
-            msg = "Failed to receive skeleton data!"
-            self._logger.warning(msg)
-            return list()
-        self._logger.debug("Need to receive {} bytes.".format(n_bytes))
-
-        # Reading the data from the socket stream
-        try:
-            n_bodies, msg = self._receive_skeleton_data(n_bytes=n_bytes)
-        except ValueError:
-            return list()
+        deadline = time.time() + self.stream_timeout
+        with self._samples_cond:
+            while not rospy.is_shutdown():
+                if len(self._samples) > 0:
+                    sample = self._samples[-1]
+                    if (max_age is None or
+                            (rospy.Time.now() - sample[0]).to_sec() <= max_age):
+                        return sample
+                remaining = deadline - time.time()
+                if remaining <= 0.0:
+                    break
+                self._samples_cond.wait(remaining)
+        msg = "Received no Kinect data{} within {} s!".format(
+            '' if max_age is None else ' newer than {} s'.format(max_age),
+            self.stream_timeout)
+        self._logger.error(msg)
+        raise RuntimeError(msg)
+
+    def _wait_for_frame(self, camera, max_age):
+        """Return the newest frame buffered by a camera, waiting for one if
+        the buffer is empty or the newest frame is too old.
+
+        :param camera: The Camera instance to read from.
+        :param max_age: The maximum age of the frame in seconds or None.
+        :return: The image.
+        :raise RuntimeError: If no frame was received in time.
+        """
+        frame = camera.latest()
+        oldest = None
+        if max_age is not None:
+            oldest = rospy.Time.now() - rospy.Duration(max_age)
+        if frame is None or (oldest is not None and frame[0] < oldest):
+            frame = camera.wait_newer_than(stamp=oldest,
+                                           timeout=self.stream_timeout)
+        if frame is None:
+            msg = "Received no Kinect image{} within {} s!".format(
+                '' if max_age is None else ' newer than {} s'.format(max_age),
+                self.stream_timeout)
+            self._logger.error(msg)
+            raise RuntimeError(msg)
+        return frame[1]
 
-        # Convert received data into a list
-        try:
-            barray = np.fromstring(msg, np.float32)
-        except ValueError:
-            self._logger.warning("Error when converting raw data to skeleton list!")
-            return list()
-        bodies = list()
-        for body in range(n_bodies):
-            cam_space_points = list()
-            color_space_points = list()
-            depth_space_points = list()
-            for i in range(body*self.joint_type_count*7,
-                           (body + 1)*self.joint_type_count*7, 7):
-                cam_space_points.append((barray[i], barray[i + 1], barray[i + 2]))
-                color_space_points.append((barray[i + 3], barray[i + 4]))
-                depth_space_points.append((barray[i + 5], barray[i + 6]))
-            bodies.append((cam_space_points, color_space_points, depth_space_points))
-        self._logger.debug("Received skeleton data for {} bod{} in {:.3f} s.".format(
-            len(bodies), 'y' if len(bodies) == 1 else 'ies',
-            time.time() - start))
-        return bodies
-
-    def collect_data(self, color=False, depth=False, skeleton=False):
+    def collect_data(self, color=False, depth=False, skeleton=False,
+                     max_age=None):
         """Collect the latest color, depth and skeleton data from the Kinect V2
         sensor.
         Note: If the Kinect is connected to a Ubuntu machine, use the native
         ROS interface using the libfreenect2 and iai_kinect2 libraries. If the
         Kinect is connected to a Windows machine and runs the ELTE Kinect
         Windows tool server, communicate via a TCP/IP socket connection.
+        Note: In streaming mode (see start_streaming), the newest buffered
+        sample is returned. Otherwise a new request is issued.
 
         :param color: Whether to retrieve the latest color image.
         :param depth: Whether to retrieve the latest depth image.
         :param skeleton: Whether to retrieve the latest skeleton data.
-        :return: A triple (color image, depth image, skeletons).
+        :param max_age: The maximum age in seconds of streamed data. If the
+            newest sample is older, wait for a new one. If None, any sample
+            is accepted. Ignored if not streaming.
+        :return: A triple (color image, depth image, skeletons), where the
+            skeletons are a (n, 13) structured array with fields 'camera',
+            'color' and 'depth' holding the joint coordinates.
+        :raise RuntimeError: If no streamed sample was received in time or
+            no depth image was received in the given number of attempts.
         """
         img_color = None
         img_depth = None
-        data_skeleton = list()
-        if self._native_ros:
-            # Kinect is connected to the Ubuntu machine, communicate via ROS
-            if color:
-                img_color = self.color.collect_image()
-            if depth:
-                img_depth = self.depth.collect_image()
-            if skeleton:
-                # libfreenect2 does not provide skeleton data
-                pass
-        else:
-            # Kinect is connected to a Windows machine, communicate via
-            # TCP/IP socket connection
-            if not self._host:
-                msg = "No host name for ELTE Kinect Windows tool provided!"
-                self._logger.error(msg)
-                raise ValueError(msg)
-            # Create a TCP/IP socket
-            self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            # Connect the socket to the host and port where the server listens
-            server = self._host, 9999
-            self._logger.debug('Connect to {} on port {}.'.format(server[0].upper(),
-                                                                  server[1]))
-            try:
-                self._socket.connect(server)
-            except socket.gaierror:
-                raise RuntimeError("Failed to connect to {}!".format(server[0].upper()) +
-                                   " Check your network connection.")
-            try:
-                msg = '{}{}{}\n'.format(*[1 if x else 0
-                                          for x in [color, depth, skeleton]])
-                self._socket.sendall(msg)
+        data_skeleton = np.zeros((0, joint_type_count), dtype=joint_dtype)
+        if self._is_streaming(color=color, depth=depth, skeleton=skeleton):
+            if self._native_ros:
                 if color:
-                    img_color = self._receive_color()
+                    img_color = self._wait_for_frame(camera=self.color,
+                                                     max_age=max_age)
                 if depth:
-                    img_depth = self._receive_depth()
+                    img_depth = self._wait_for_frame(camera=self.depth,
+                                                     max_age=max_age)
+            else:
+                _, img_color, img_depth, skeletons = \
+                    self._wait_for_sample(max_age=max_age)
                 if skeleton:
-                    data_skeleton = self._receive_skeleton()
-            except socket.error as e:
-                self._logger.error(str(e))
-            finally:
-                self._logger.debug('Close socket.')
-                self._socket.close()
-            self._socket = None
-        # transmitting depth images sometimes fails
-        if depth and img_depth is None:
-            return self.collect_data(color=color, depth=depth, skeleton=skeleton)
-        return img_color, img_depth, data_skeleton
-
-    def estimate_hands_positions(self):
+                    data_skeleton = skeletons
+            # samples are shared between readers, callers draw onto images
+            img_color = img_color.copy() if color else None
+            img_depth = img_depth.copy() if depth else None
+            return img_color, img_depth, data_skeleton
+        for _ in range(self.request_attempts):
+            if self._native_ros:
+                # Kinect is connected to the Ubuntu machine, communicate via ROS
+                if color:
+                    img_color = self.color.collect_image()
+                if depth:
+                    img_depth = self.depth.collect_image()
+                if skeleton:
+                    # libfreenect2 does not provide skeleton data
+                    pass
+            else:
+                # Kinect is connected to a Windows machine, communicate via
+                # TCP/IP socket connection
+                self._check_host()
+                try:
+                    img_color, img_depth, data_skeleton = self._request(
+                        color=color, depth=depth, skeleton=skeleton)
+                except socket.error as e:
+                    self._logger.error(str(e))
+            # transmitting depth images sometimes fails
+            if not depth or img_depth is not None:
+                return img_color, img_depth, data_skeleton
+        msg = "Received no Kinect depth image in {} attempts!".format(
+            self.request_attempts)
+        self._logger.error(msg)
+        raise RuntimeError(msg)
+
+    def estimate_hands_positions(self, max_age=None):
         """Extract the estimate for the approximate hand position from the
         skeleton data obtained from the Kinect.
 
+        :param max_age: The maximum age in seconds of streamed data, see
+            collect_data.
         :return: One of
             - A dictionary holding the hand coordinate triplets (camera,
               color and depth space coordinates) for the left and right hands.
-            - None if no skeleton estimate is computed by the Kinect.
+            - None if no skeleton estimate is computed by the Kinect or the
+              hand joints are not tracked.
         """
-        color, _, skeletons = self.collect_data(color=True, skeleton=True)
+        color, _, skeletons = self.collect_data(color=True, skeleton=True,
+                                                max_age=max_age)
+        if not self._is_streaming(color=False, depth=False, skeleton=True):
+            # streamed skeletons are tracked by the streaming thread
+            self._track_hands(stamp=rospy.Time.now(), skeletons=skeletons)
         if len(skeletons) != 1:
             raise ValueError("Need to track exactly one person!")
         skeleton = skeletons[0]
-        if skeleton is None:
+        idxs = [self.joint_type_hand_left, self.joint_type_hand_right]
+        if not np.isfinite(skeleton['camera'][idxs]).all():
             estimate = None
         else:
-            estimate = dict()
-            for arm, idx in zip(['left', 'right'],
-                                [self.joint_type_hand_left,
-                                 self.joint_type_hand_right]):
-                coord, px_color, px_depth = [a[idx] for a in skeleton]
+            positions = self.joints_to_robot(joints=skeleton)
+            px_colors = skeleton['color']
+            if not self._native_ros:
                 # The ELTE KinectOverNetwork tool scales the color image by a
                 # factor of 1/2 (to 960x540). We thus adapt the estimated pixel
                 # coordinates accordingly.
-                px_color = tuple(x/2.0 if not self._native_ros else x
-                                 for x in px_color)
-                pos = tuple(np.dot(self.trafo, list(coord) + [1])[:-1])
-                estimate[arm] = (pos, px_color, px_depth)
+                px_colors = px_colors/2.0
+            estimate = dict()
+            for arm, idx in zip(['left', 'right'], idxs):
+                estimate[arm] = (tuple(positions[idx]), tuple(px_colors[idx]),
+                                 tuple(skeleton['depth'][idx]))
                 # visualize estimate
-                ctr = tuple(int(x) for x in px_color)
+                ctr = tuple(int(x) for x in px_colors[idx])
                 cv2.circle(color, center=ctr, radius=5, color=[255, 0, 0],
                            thickness=3)
             self._pub_vis.publish(img_to_imgmsg(img=color))
         return estimate
 
-    def estimate_hand_position(self, hand):
+    def joints_to_robot(self, joints):
+        """Transform skeleton joints from camera to robot coordinates.
+
+        :param joints: A structured array of joints as returned by
+            collect_data, e.g., a (13,) skeleton or (n, 13) skeletons.
+        :return: A (..., 3) numpy array holding the robot coordinates of the
+            joints.
+        """
+        cam = joints['camera'].astype(np.float64)
+        return np.dot(cam, self.trafo[:3, :3].T) + self.trafo[:3, 3]
+
+    def estimate_hand_position(self, hand, max_age=None):
         """Extract the estimate of the approximate position of the requested
         hand from the skeleton data obtained from the Kinect.
 
         :param hand: The human hand to estimate the position estimate for.
             One of <'left', 'right'>.
+        :param max_age: The maximum age in seconds of streamed data, see
+            collect_data.
         :return: The hand position, a list [x, y, z] of len 3, or None.
         """
         try:
-            est = self.estimate_hands_positions()[hand]
-        except ValueError:
+            est = self.estimate_hands_positions(max_age=max_age)
+        except (ValueError, RuntimeError):
             return None
         if est is None:
+            # the hand joints are not tracked
             return None
         else:
-            return list(est[0])
+            return list(est[hand][0])
+
+    def estimate_table_height(self, limits, img_depth=None, voxel_size=0.01,
+                              threshold=0.01, max_tilt=np.deg2rad(10.0)):
+        """Estimate the height of the table top in robot coordinates by
+        fitting a plane to the Kinect point cloud.
+
+        :param limits: A dictionary with keys 'x_min', 'x_max', 'y_min' and
+            'y_max' defining the region of the table (in robot coordinates)
+            to consider.
+        :param img_depth: An optional depth image. If None, a new depth image
+            is collected.
+        :param voxel_size: The edge length of the voxel grid in meters the
+            point cloud is downsampled to.
+        :param threshold: The maximum distance in meters of points to the
+            plane to be considered part of the table top.
+        :param max_tilt: The maximum angle in radians between the table
+            normal and the robot's z axis.
+        :return: A tuple (height, confidence), where the confidence is the
+            fraction of points within the table region lying on the plane.
+        :raise ValueError: If no table plane was found.
+        """
+        points = self._table_points(limits=limits, img_depth=img_depth,
+                                    voxel_size=voxel_size)
+        normal, offset, inliers = fit_plane(points=points, threshold=threshold,
+                                            normal=[0.0, 0.0, 1.0],
+                                            max_angle=max_tilt)
+        # height of the plane at the center of the table region
+        cx = 0.5*(limits['x_min'] + limits['x_max'])
+        cy = 0.5*(limits['y_min'] + limits['y_max'])
+        height = (offset - normal[0]*cx - normal[1]*cy)/normal[2]
+        confidence = inliers.mean()
+        residuals = np.dot(points[inliers], normal) - offset
+        self._logger.debug("Fitted table plane: height {:.3f} m, tilt {:.1f} "
+                           "deg, rms {:.4f} m, {:.0f}% inliers.".format(
+                               height, np.rad2deg(np.arccos(normal[2])),
+                               np.sqrt((residuals**2).mean()),
+                               100.0*confidence))
+        return float(height), float(confidence)
+
+    def _table_points(self, limits, img_depth, voxel_size):
+        """Compute the point cloud in robot coordinates within the table
+        region.
+
+        :param limits: A dictionary with keys 'x_min', 'x_max', 'y_min' and
+            'y_max' defining the region of the table to consider.
+        :param img_depth: A depth image. If None, a new one is collected.
+        :param voxel_size: The edge length of the voxel grid in meters the
+            point cloud is downsampled to.
+        :return: A (N, 3) numpy array of points.
+        :raise ValueError: If too few points lie within the table region.
+        """
+        if img_depth is None:
+            _, img_depth, _ = self.collect_data(depth=True)
+        points = self.point_cloud(img_depth=img_depth, voxel_size=voxel_size)
+        mask = ((points[:, 0] >= limits['x_min']) &
+                (points[:, 0] <= limits['x_max']) &
+                (points[:, 1] >= limits['y_min']) &
+                (points[:, 1] <= limits['y_max']))
+        points = points[mask]
+        if len(points) < 100:
+            msg = "Too few points ({}) within the table region!".format(
+                len(points))
+            self._logger.warning(msg)
+            raise ValueError(msg)
+        return points
+
+    def locate_objects(self, limits, img_depth=None, voxel_size=0.005,
+                       threshold=0.01, max_height=0.3, cell_size=0.01,
+                       min_points=20):
+        """Locate the objects on the table from a single Kinect depth frame.
+        The table plane is removed from the point cloud and the remaining
+        points are clustered into objects.
+
+        :param limits: A dictionary with keys 'x_min', 'x_max', 'y_min' and
+            'y_max' defining the region of the table (in robot coordinates)
+            to consider.
+        :param img_depth: An optional depth image. If None, a new depth image
+            is collected.
+        :param voxel_size: The edge length of the voxel grid in meters the
+            point cloud is downsampled to.
+        :param threshold: The minimum height in meters above the table plane
+            of points belonging to objects.
+        :param max_height: The maximum height in meters above the table plane
+            of points belonging to objects.
+        :param cell_size: The edge length in meters of the grid cells used
+            for clustering. Objects closer than this are merged.
+        :param min_points: The minimum number of points per object.
+        :return: A list of dictionaries, one per object ordered by decreasing
+            size, holding the centroid, the oriented extent in the x-y plane
+            and the z range in robot coordinates (see describe_clusters) as
+            well as the height above the table (key: 'height').
+        :raise ValueError: If no table plane was found.
+        """
+        points = self._table_points(limits=limits, img_depth=img_depth,
+                                    voxel_size=voxel_size)
+        normal, offset, _ = fit_plane(points=points, threshold=threshold,
+                                      normal=[0.0, 0.0, 1.0],
+                                      max_angle=np.deg2rad(10.0))
+        heights = np.dot(points, normal) - offset
+        mask = (heights > threshold) & (heights < max_height)
+        points = points[mask]
+        heights = heights[mask]
+        labels = cluster_points(points=points, cell_size=cell_size,
+                                min_points=min_points)
+        objects = describe_clusters(points=points, labels=labels)
+        for label, obj in enumerate(objects):
+            obj['height'] = float(heights[labels == label].max())
+        self._logger.debug("Located {} object{} on the table.".format(
+            len(objects), '' if len(objects) == 1 else 's'))
+        return objects
+
+    def _track_hands(self, stamp, skeletons):
+        """Update the hand tracker with the hand positions of a skeleton.
+
+        :param stamp: The rospy.Time time stamp of the skeleton data.
+        :param skeletons: The skeletons as returned by collect_data.
+        :return:
+        """
+        if self.trafo is None or len(skeletons) != 1:
+            return
+        idxs = [self.joint_type_hand_left, self.joint_type_hand_right]
+        positions = self.joints_to_robot(joints=skeletons[0][idxs])
+        with self._tracker_lock:
+            self.hand_tracker.update(stamp=stamp.to_sec(), positions=positions)
+
+    def predict_hand_position(self, hand, horizon=0.0, max_age=None):
+        """Estimate the filtered position of the requested hand, optionally
+        extrapolated into the future assuming constant velocity.
+        Note: In streaming mode, the hand tracker is updated with every
+        streamed skeleton. Otherwise, new skeleton data is requested first.
+
+        :param hand: The human hand to estimate the position for. One of
+            <'left', 'right'>.
+        :param horizon: The time in seconds from now to predict the hand
+            position for.
+        :param max_age: The maximum age in seconds of streamed data, see
+            collect_data.
+        :return: A triple (position, velocity, converged) of two lists
+            [x, y, z] of len 3 holding the (predicted) hand position and its
+            velocity in m/s and whether the velocity estimate has converged,
+            or None if the hand is not tracked.
+        """
+        if not self._is_streaming(color=False, depth=False, skeleton=True):
+            try:
+                self.estimate_hands_positions(max_age=max_age)
+            except (ValueError, RuntimeError):
+                pass
+        idx = ['left', 'right'].index(hand)
+        now = rospy.Time.now().to_sec()
+        with self._tracker_lock:
+            if not self.hand_tracker.is_tracked(stamp=now)[idx]:
+                return None
+            pos = self.hand_tracker.predict(stamp=now + horizon)[idx]
+            vel = self.hand_tracker.velocity[idx]
+            converged = bool(self.hand_tracker.is_converged(stamp=now)[idx])
+        return list(pos), list(vel), converged
 
     def estimate_object_position(self, img_color, bbox, img_depth):
         """Estimate the approximate position of an object in 3d from a Kinect
@@ -402,20 +699,53 @@ class Kinect(object):
             the color image.
         :param img_depth: A depth image corresponding to the color image.
         :return: A list [x, y, z] representing the approximate object position
-            in camera coordinates or None if the object was not detected.
+            in robot coordinates or None if the object was not detected.
         """
         if bbox is None:
             return None
+        pos = self.estimate_object_positions(img_color=img_color,
+                                             bboxes=[bbox],
+                                             img_depth=img_depth)[0]
+        if np.isnan(pos).any():
+            return None
+        return list(pos)
 
-        if len(bbox) == 3:
-            # smallest enclosing rectangle
-            px, py = bbox[0]
-        elif len(bbox) == 4:
-            # bounding box
-            px, py = bbox[2] - bbox[0], bbox[3] - bbox[1]
-        else:
-            raise ValueError("Expected rroi or bounding box, got {}!".format(bbox))
-        z_3d = get_depth(img_depth, img_color.shape[:2], (px, py))
-        pos_cam = self.color.projection_pixel_to_camera(pixel=(px, py), z=z_3d)
-        pos_rob = np.dot(self.trafo, pos_cam + [1])[:-1]
-        return list(pos_rob)
+    def estimate_object_positions(self, img_color, bboxes, img_depth,
+                                  min_valid=0.1):
+        """Estimate the approximate positions of a number of objects in 3d
+        from a Kinect color and corresponding depth image, as well as the
+        bounding boxes of the objects detected in the color image. The depth
+        of each object is the median of the valid depth values in the
+        central part of its bounding box.
+
+        :param img_color: A color image.
+        :param bboxes: A list of bounding boxes (x_min, y_min, x_max, y_max)
+            or rotated rectangles ((cx, cy), (w, h), angle) of the objects in
+            the color image.
+        :param img_depth: A depth image corresponding to the color image.
+        :param min_valid: The minimum fraction of valid depth values in the
+            central part of a bounding box to accept the depth estimate.
+        :return: A (N, 3) numpy array holding the approximate object
+            positions in robot coordinates. Rows of objects without reliable
+            depth estimate are NaN.
+        """
+        boxes = np.empty((len(bboxes), 4))
+        for i, bbox in enumerate(bboxes):
+            if len(bbox) == 3:
+                # smallest enclosing rectangle, use the axis-aligned square
+                # inscribed in it
+                (cx, cy), (w, h), _ = bbox
+                half = min(w, h)/(2.0*np.sqrt(2.0))
+                boxes[i] = cx - half, cy - half, cx + half, cy + half
+            elif len(bbox) == 4:
+                # bounding box
+                boxes[i] = bbox
+            else:
+                raise ValueError("Expected rroi or bounding box, got {}!".format(bbox))
+        img_reg = self.register_depth(img_depth=img_depth,
+                                      size_color=img_color.shape[:2])
+        z_3d, fraction = box_depth(img_depth=img_reg, boxes=boxes)
+        z_3d[fraction < min_valid] = np.nan
+        pixels = 0.5*(boxes[:, :2] + boxes[:, 2:])
+        pos_cam = self.color.projection_pixels_to_camera(pixels=pixels, z=z_3d)
+        return np.dot(pos_cam, self.trafo[:3, :3].T) + self.trafo[:3, 3]
@@ -0,0 +1,417 @@
+# Copyright (c) 2016, BRML
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import logging
+import numpy as np
+import xml.etree.ElementTree as ElementTree
+
+
+# Kinematic description of the Baxter arms as found in the URDF of the
+# baxter_description package. Each entry is a tuple (name, type, xyz, rpy,
+# lower, upper) with the origin of the joint in its parent's frame. All
+# revolute joints rotate about their local z axis. The last two fixed joints
+# describe the electric gripper mounted on the hand, such that the tip of
+# the chain is the '<arm>_gripper' frame the inverse kinematics service of
+# the robot solves for.
+_hpi = np.pi/2.0
+_baxter_arm = [
+    ('torso_arm_mount', 'fixed', [0.024645, 0.219645, 0.118588],
+     [0.0, 0.0, np.pi/4.0], None, None),
+    ('s0', 'revolute', [0.055695, 0.0, 0.011038], [0.0, 0.0, 0.0],
+     -1.70167993878, 1.70167993878),
+    ('s1', 'revolute', [0.069, 0.0, 0.27035], [-_hpi, 0.0, 0.0],
+     -2.147, 1.047),
+    ('e0', 'revolute', [0.102, 0.0, 0.0], [_hpi, 0.0, _hpi],
+     -3.05417993878, 3.05417993878),
+    ('e1', 'revolute', [0.069, 0.0, 0.26242], [-_hpi, -_hpi, 0.0],
+     -0.05, 2.618),
+    ('w0', 'revolute', [0.10359, 0.0, 0.0], [_hpi, 0.0, _hpi],
+     -3.059, 3.059),
+    ('w1', 'revolute', [0.01, 0.0, 0.2707], [-_hpi, -_hpi, 0.0],
+     -1.57079632679, 2.094),
+    ('w2', 'revolute', [0.115975, 0.0, 0.0], [_hpi, 0.0, _hpi],
+     -3.059, 3.059),
+    ('hand', 'fixed', [0.0, 0.0, 0.11355], [0.0, 0.0, 0.0], None, None),
+    ('gripper_base', 'fixed', [0.0, 0.0, 0.025], [0.0, 0.0, 0.0], None, None),
+    ('endpoint', 'fixed', [0.0, 0.0, 0.1327], [0.0, 0.0, 0.0], None, None)
+]
+
+
+def rpy_to_matrix(roll, pitch, yaw):
+    """Compute the rotation matrices corresponding to fixed axis
+    roll-pitch-yaw angles (the 'sxyz' convention used by URDF and by
+    tf.transformations).
+
+    :param roll: A scalar or numpy array of roll angles.
+    :param pitch: A scalar or numpy array of pitch angles.
+    :param yaw: A scalar or numpy array of yaw angles.
+    :return: A (..., 3, 3) numpy array of rotation matrices.
+    """
+    cr, sr = np.cos(roll), np.sin(roll)
+    cp, sp = np.cos(pitch), np.sin(pitch)
+    cy, sy = np.cos(yaw), np.sin(yaw)
+    rot = np.empty(np.shape(roll) + (3, 3))
+    rot[..., 0, 0] = cy*cp
+    rot[..., 0, 1] = cy*sp*sr - sy*cr
+    rot[..., 0, 2] = cy*sp*cr + sy*sr
+    rot[..., 1, 0] = sy*cp
+    rot[..., 1, 1] = sy*sp*sr + cy*cr
+    rot[..., 1, 2] = sy*sp*cr - cy*sr
+    rot[..., 2, 0] = -sp
+    rot[..., 2, 1] = cp*sr
+    rot[..., 2, 2] = cp*cr
+    return rot
+
+
+def quaternion_to_matrix(quaternions):
+    """Compute the rotation matrices corresponding to unit quaternions.
+
+    :param quaternions: A (..., 4) numpy array of quaternions [qx, qy, qz, qw].
+    :return: A (..., 3, 3) numpy array of rotation matrices.
+    """
+    q = np.asarray(quaternions, dtype=np.float64)
+    q = q/np.sqrt((q**2).sum(axis=-1))[..., np.newaxis]
+    x, y, z, w = q[..., 0], q[..., 1], q[..., 2], q[..., 3]
+    rot = np.empty(q.shape[:-1] + (3, 3))
+    rot[..., 0, 0] = 1.0 - 2.0*(y*y + z*z)
+    rot[..., 0, 1] = 2.0*(x*y - z*w)
+    rot[..., 0, 2] = 2.0*(x*z + y*w)
+    rot[..., 1, 0] = 2.0*(x*y + z*w)
+    rot[..., 1, 1] = 1.0 - 2.0*(x*x + z*z)
+    rot[..., 1, 2] = 2.0*(y*z - x*w)
+    rot[..., 2, 0] = 2.0*(x*z - y*w)
+    rot[..., 2, 1] = 2.0*(y*z + x*w)
+    rot[..., 2, 2] = 1.0 - 2.0*(x*x + y*y)
+    return rot
+
+
+def poses_to_hom(poses):
+    """Convert poses into homogeneous transformation matrices.
+
+    :param poses: A list of poses, each one a list of length 6
+        [x, y, z, roll, pitch, yaw] or of length 7 [x, y, z, qx, qy, qz, qw].
+    :return: A (N, 4, 4) numpy array of homogeneous transformation matrices.
+    """
+    homs = np.zeros((len(poses), 4, 4))
+    homs[:, 3, 3] = 1.0
+    for idx, pose in enumerate(poses):
+        pose = np.asarray(pose, dtype=np.float64)
+        if pose.shape == (6,):
+            homs[idx, :3, :3] = rpy_to_matrix(*pose[3:])
+        elif pose.shape == (7,):
+            homs[idx, :3, :3] = quaternion_to_matrix(pose[3:])
+        else:
+            raise ValueError("Expected pose to be [x, y, z, r, p, y] or "
+                             "[x, y, z, qx, qy, qz, qw]!")
+        homs[idx, :3, 3] = pose[:3]
+    return homs
+
+
+def _origin(xyz, rpy):
+    """Homogeneous transformation matrix of a joint origin."""
+    hom = np.eye(4)
+    hom[:3, :3] = rpy_to_matrix(*rpy)
+    hom[:3, 3] = xyz
+    return hom
+
+
+def parse_urdf(filename, base, tip):
+    """Extract the chain of joints connecting two links from an URDF file.
+    Note that xacro files need to be expanded first, e.g., by
+        rosrun xacro xacro.py baxter.urdf.xacro > baxter.urdf
+
+    :param filename: The file name of the URDF file.
+    :param base: The name of the base link of the chain.
+    :param tip: The name of the tip link of the chain.
+    :return: A list of dictionaries, one per joint from base to tip, with
+        keys 'name', 'type', 'xyz', 'rpy', 'axis', 'lower' and 'upper'.
+    :raise ValueError: If the links are not connected.
+    """
+    root = ElementTree.parse(filename).getroot()
+    by_child = dict()
+    for element in root.findall('joint'):
+        origin = element.find('origin')
+        axis = element.find('axis')
+        limit = element.find('limit')
+        joint = {
+            'name': element.get('name'),
+            'type': element.get('type'),
+            'xyz': [0.0, 0.0, 0.0],
+            'rpy': [0.0, 0.0, 0.0],
+            'axis': [1.0, 0.0, 0.0],
+            'lower': None,
+            'upper': None
+        }
+        if origin is not None:
+            for key in ['xyz', 'rpy']:
+                if origin.get(key) is not None:
+                    joint[key] = [float(v) for v in origin.get(key).split()]
+        if axis is not None:
+            joint['axis'] = [float(v) for v in axis.get('xyz').split()]
+        if limit is not None and joint['type'] == 'revolute':
+            joint['lower'] = float(limit.get('lower'))
+            joint['upper'] = float(limit.get('upper'))
+        by_child[element.find('child').get('link')] = \
+            (element.find('parent').get('link'), joint)
+
+    joints = list()
+    link = tip
+    while link != base:
+        if link not in by_child:
+            raise ValueError("Link '{}' is not connected to link '{}' in "
+                             "'{}'!".format(tip, base, filename))
+        link, joint = by_child[link]
+        joints.append(joint)
+    return joints[::-1]
+
+
+class KinematicChain(object):
+    def __init__(self, joints):
+        """Serial kinematic chain of revolute joints with vectorized forward
+        kinematics, geometric Jacobian and damped least squares inverse
+        kinematics for many joint configurations at once.
+
+        :param joints: A list of joint dictionaries from base to tip as
+            returned by parse_urdf. Consecutive fixed joints are merged.
+        :raise ValueError: If a joint type is not supported.
+        """
+        self._logger = logging.getLogger('main.kinematics')
+        self.joint_names = list()
+        self._origins = list()
+        self._axes = list()
+        lower = list()
+        upper = list()
+        hom = np.eye(4)
+        for joint in joints:
+            hom = np.dot(hom, _origin(joint['xyz'], joint['rpy']))
+            if joint['type'] == 'fixed':
+                continue
+            if joint['type'] not in ['revolute', 'continuous']:
+                raise ValueError("Joint type '{}' of joint '{}' is not "
+                                 "supported!".format(joint['type'],
+                                                     joint['name']))
+            axis = np.asarray(joint.get('axis', [0.0, 0.0, 1.0]), dtype=np.float64)
+            self.joint_names.append(joint['name'])
+            self._origins.append(hom)
+            self._axes.append(axis/np.linalg.norm(axis))
+            lower.append(-np.inf if joint['lower'] is None else joint['lower'])
+            upper.append(np.inf if joint['upper'] is None else joint['upper'])
+            hom = np.eye(4)
+        # transformation from the last joint to the tip of the chain
+        self._tool = hom
+        self.lower = np.array(lower)
+        self.upper = np.array(upper)
+        # upper bound on the distance of the tip from the first joint
+        self.reach = sum(np.linalg.norm(h[:3, 3]) for h in self._origins[1:]) + \
+            np.linalg.norm(self._tool[:3, 3])
+
+    @classmethod
+    def baxter(cls, arm):
+        """Create the kinematic chain from the 'base' frame to the
+        '<arm>_gripper' frame of one of Baxter's arms.
+
+        :param arm: The arm <'left', 'right'>.
+        :return: A KinematicChain instance.
+        """
+        if arm not in ['left', 'right']:
+            raise ValueError("Expected arm to be 'left' or 'right'!")
+        sign = 1.0 if arm == 'left' else -1.0
+        joints = list()
+        for name, jtype, xyz, rpy, lower, upper in _baxter_arm:
+            if name == 'torso_arm_mount':
+                # the right arm mount is mirrored about the x-z plane
+                xyz = [xyz[0], sign*xyz[1], xyz[2]]
+                rpy = [rpy[0], rpy[1], sign*rpy[2]]
+            joints.append({'name': '{}_{}'.format(arm, name), 'type': jtype,
+                           'xyz': xyz, 'rpy': rpy, 'axis': [0.0, 0.0, 1.0],
+                           'lower': lower, 'upper': upper})
+        return cls(joints=joints)
+
+    @classmethod
+    def from_urdf(cls, filename, base, tip):
+        """Create a kinematic chain from an (expanded) URDF file.
+
+        :param filename: The file name of the URDF file.
+        :param base: The name of the base link of the chain.
+        :param tip: The name of the tip link of the chain.
+        :return: A KinematicChain instance.
+        """
+        return cls(joints=parse_urdf(filename=filename, base=base, tip=tip))
+
+    def __len__(self):
+        return len(self.joint_names)
+
+    def _check(self, configs):
+        configs = np.asarray(configs, dtype=np.float64)
+        if configs.ndim != 2 or configs.shape[1] != len(self):
+            raise ValueError("Expected a (N, {}) array of joint "
+                             "angles!".format(len(self)))
+        return configs
+
+    def _frames(self, configs):
+        """Compute the poses of all joint frames (after rotating the joint)
+        and of the tip.
+
+        :param configs: A (N, n_joints) numpy array of joint angles.
+        :return: A tuple (frames, tip) of a list of (N, 4, 4) numpy arrays
+            and a (N, 4, 4) numpy array.
+        """
+        n = configs.shape[0]
+        hom = np.tile(np.eye(4), (n, 1, 1))
+        rot = np.zeros((n, 4, 4))
+        rot[:, 3, 3] = 1.0
+        frames = list()
+        for idx, (origin, axis) in enumerate(zip(self._origins, self._axes)):
+            hom = np.dot(hom, origin)
+            # Rodrigues' formula for rotations about the joint axis
+            s = np.sin(configs[:, idx])[:, np.newaxis, np.newaxis]
+            c = np.cos(configs[:, idx])[:, np.newaxis, np.newaxis]
+            k = np.array([[0.0, -axis[2], axis[1]],
+                          [axis[2], 0.0, -axis[0]],
+                          [-axis[1], axis[0], 0.0]])
+            rot[:, :3, :3] = np.eye(3) + s*k + (1.0 - c)*np.dot(k, k)
+            hom = np.einsum('nij,njk->nik', hom, rot)
+            frames.append(hom)
+        return frames, np.dot(hom, self._tool)
+
+    def fk(self, configs):
+        """Compute the pose of the tip of the chain for a number of joint
+        configurations.
+
+        :param configs: A (N, n_joints) numpy array of joint angles.
+        :return: A (N, 4, 4) numpy array of homogeneous transformation
+            matrices.
+        """
+        return self._frames(self._check(configs))[1]
+
+    def jacobian(self, configs):
+        """Compute the geometric Jacobian of the tip of the chain for a
+        number of joint configurations.
+
+        :param configs: A (N, n_joints) numpy array of joint angles.
+        :return: A tuple (tip, jacobian) of a (N, 4, 4) numpy array of tip
+            poses and a (N, 6, n_joints) numpy array of Jacobians, where
+            the first three rows are the linear and the last three rows the
+            angular velocity.
+        """
+        frames, tip = self._frames(self._check(configs))
+        jac = np.empty((tip.shape[0], 6, len(self)))
+        for idx, (frame, axis) in enumerate(zip(frames, self._axes)):
+            w = np.dot(frame[:, :3, :3], axis)
+            jac[:, :3, idx] = np.cross(w, tip[:, :3, 3] - frame[:, :3, 3])
+            jac[:, 3:, idx] = w
+        return tip, jac
+
+    @staticmethod
+    def _error(current, targets):
+        """Pose error (position and rotation vector) from current to target
+        poses, with the rotation error approximated for small angles.
+        """
+        err = np.empty((current.shape[0], 6))
+        err[:, :3] = targets[:, :3, 3] - current[:, :3, 3]
+        err[:, 3:] = 0.5*np.cross(current[:, :3, :3], targets[:, :3, :3],
+                                  axisa=1, axisb=1, axisc=1).sum(axis=2)
+        return err
+
+    def out_of_reach(self, positions):
+        """Check which positions can certainly not be reached by the tip of
+        the chain, irrespective of the orientation.
+
+        :param positions: A (N, 3) numpy array of positions.
+        :return: A (N,) boolean numpy array.
+        """
+        first = self._origins[0][:3, 3]
+        dist = np.sqrt(((np.asarray(positions) - first)**2).sum(axis=1))
+        return dist > self.reach
+
+    def ik(self, targets, seeds=None, max_iter=100, damping=0.05,
+           max_step=0.2, tol_m=0.001, tol_rad=0.01, n_restarts=3, seed=None):
+        """Solve the inverse kinematics for a number of target poses using
+        damped least squares, subject to the joint limits. Targets that do
+        not converge are restarted from random configurations.
+
+        :param targets: A (N, 4, 4) numpy array of homogeneous
+            transformation matrices.
+        :param seeds: An optional (N, n_joints) numpy array of joint angles
+            to start from. If None, the centers of the joint ranges are used.
+        :param max_iter: The maximum number of iterations per attempt.
+        :param damping: The damping factor of the least squares solution.
+        :param max_step: The maximum change of a joint angle per iteration
+            in radians.
+        :param tol_m: The position tolerance in meters.
+        :param tol_rad: The orientation tolerance in radians.
+        :param n_restarts: The number of random restarts for targets that
+            did not converge.
+        :param seed: An optional seed for the random number generator.
+        :return: A tuple (valid, configs) of a (N,) boolean numpy array
+            indicating which targets converged and a (N, n_joints) numpy
+            array of joint angles.
+        """
+        targets = np.asarray(targets, dtype=np.float64)
+        n = targets.shape[0]
+        lower = np.where(np.isfinite(self.lower), self.lower, -np.pi)
+        upper = np.where(np.isfinite(self.upper), self.upper, np.pi)
+        if seeds is None:
+            configs = np.tile(0.5*(lower + upper), (n, 1))
+        else:
+            configs = np.clip(self._check(seeds), lower, upper)
+        rng = np.random.RandomState(seed)
+        eye = damping**2*np.eye(6)
+        valid = np.zeros(n, dtype=bool)
+        active = np.arange(n)
+        for attempt in range(n_restarts + 1):
+            if attempt > 0:
+                configs[active] = lower + (upper - lower)*rng.random_sample(
+                    (len(active), len(self)))
+            for _ in range(max_iter):
+                if len(active) == 0:
+                    break
+                tip, jac = self.jacobian(configs[active])
+                err = self._error(tip, targets[active])
+                done = np.logical_and(
+                    (err[:, :3]**2).sum(axis=1) < tol_m**2,
+                    (err[:, 3:]**2).sum(axis=1) < tol_rad**2)
+                valid[active[done]] = True
+                keep = np.logical_not(done)
+                active, jac, err = active[keep], jac[keep], err[keep]
+                if len(active) == 0:
+                    break
+                # dq = J^T (J J^T + lambda^2 I)^-1 e
+                jjt = np.einsum('nij,nkj->nik', jac, jac) + eye
+                step = np.einsum('nji,nj->ni', jac,
+                                 np.linalg.solve(jjt, err[:, :, np.newaxis])[:, :, 0])
+                scale = np.abs(step).max(axis=1)/max_step
+                step /= np.maximum(scale, 1.0)[:, np.newaxis]
+                configs[active] = np.clip(configs[active] + step, lower, upper)
+            if len(active) == 0:
+                break
+        if len(active) > 0:
+            # check the configurations of the last iteration
+            err = self._error(self.fk(configs[active]), targets[active])
+            done = np.logical_and(
+                (err[:, :3]**2).sum(axis=1) < tol_m**2,
+                (err[:, 3:]**2).sum(axis=1) < tol_rad**2)
+            valid[active[done]] = True
+        return valid, configs
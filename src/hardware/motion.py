@@ -0,0 +1,163 @@
+# Copyright (c) 2016, BRML
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import logging
+import threading
+import time
+
+
+# notified whenever a motion finishes, see wait_any
+_finished = threading.Condition(threading.Lock())
+
+
+class MotionHandle(object):
+    def __init__(self, arm, target, args=(), kwargs=None):
+        """Handle of a motion of one limb executed in a background thread.
+
+        :param arm: The arm <'left', 'right'> the motion is executed with.
+        :param target: The callable executing the motion.
+        :param args: Positional arguments passed on to the callable.
+        :param kwargs: Keyword arguments passed on to the callable.
+        """
+        self._logger = logging.getLogger('main.baxter.motion')
+        self.arm = arm
+        self._target = target
+        self._args = args
+        self._kwargs = dict() if kwargs is None else kwargs
+        self._done = threading.Event()
+        self._result = None
+        self._error = None
+        self.start_time = None
+        self.end_time = None
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def start(self):
+        """Start executing the motion.
+
+        :return: The handle itself.
+        """
+        self.start_time = time.time()
+        self._thread.start()
+        return self
+
+    def _run(self):
+        try:
+            self._result = self._target(*self._args, **self._kwargs)
+        except Exception as e:
+            self._logger.error("Motion of {} limb failed: {}".format(self.arm, e))
+            self._error = e
+        finally:
+            self.end_time = time.time()
+            # release the arguments, which may hold the previous motion
+            self._target = self._args = self._kwargs = None
+            with _finished:
+                self._done.set()
+                _finished.notify_all()
+
+    def done(self):
+        """Whether the motion has finished."""
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """Wait for the motion to finish.
+
+        :param timeout: The maximum time to wait in seconds or None to wait
+            indefinitely.
+        :return: Whether the motion has finished.
+        """
+        # Event.wait without timeout cannot be interrupted in Python 2
+        while not self._done.is_set():
+            if timeout is not None and timeout <= 0.0:
+                break
+            step = 0.1 if timeout is None else min(timeout, 0.1)
+            self._done.wait(step)
+            if timeout is not None:
+                timeout -= step
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """Wait for the motion to finish and return the result of the
+        callable executing it, re-raising any exception it raised.
+
+        :param timeout: The maximum time to wait in seconds or None to wait
+            indefinitely.
+        :return: The return value of the callable.
+        :raise RuntimeError: If the motion did not finish in time.
+        """
+        if not self.wait(timeout=timeout):
+            raise RuntimeError("Motion of {} limb did not finish within "
+                               "{} s!".format(self.arm, timeout))
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+    @property
+    def duration(self):
+        """The execution time of the motion in seconds or None if it has not
+        finished yet.
+        """
+        if self.end_time is None:
+            return None
+        return self.end_time - self.start_time
+
+
+def wait_all(handles, timeout=None):
+    """Wait for all motions to finish.
+
+    :param handles: A list of MotionHandle instances.
+    :param timeout: The maximum time to wait in seconds or None to wait
+        indefinitely.
+    :return: Whether all motions have finished.
+    """
+    deadline = None if timeout is None else time.time() + timeout
+    for handle in handles:
+        remaining = None if deadline is None else max(deadline - time.time(), 0.0)
+        if not handle.wait(timeout=remaining):
+            return False
+    return True
+
+
+def wait_any(handles, timeout=None):
+    """Wait for any of the motions to finish.
+
+    :param handles: A list of MotionHandle instances.
+    :param timeout: The maximum time to wait in seconds or None to wait
+        indefinitely.
+    :return: The first finished MotionHandle or None on timeout.
+    """
+    deadline = None if timeout is None else time.time() + timeout
+    with _finished:
+        while True:
+            finished = [h for h in handles if h.done()]
+            if len(finished) > 0:
+                return min(finished, key=lambda h: h.end_time)
+            if deadline is None:
+                _finished.wait(0.1)
+            else:
+                remaining = deadline - time.time()
+                if remaining <= 0.0:
+                    return None
+                _finished.wait(min(remaining, 0.1))
@@ -0,0 +1,259 @@
+# Copyright (c) 2016, BRML
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import numpy as np
+
+import cv2
+
+
+class PointCloud(object):
+    def __init__(self, camera, distortion=False):
+        """Generate point clouds from depth images of a depth camera.
+        The normalized viewing ray of each depth pixel is computed once, such
+        that converting a depth image into a point cloud reduces to a few
+        array multiplications.
+        Note: Point clouds are given in the coordinates of the depth camera
+        using the convention of the Camera projections, i.e., with the y axis
+        flipped. The Kinect camera-to-robot transformation refers to the
+        color camera, so the transformation from depth to color sensor frame
+        needs to be applied first (see Kinect.point_cloud).
+
+        :param camera: The Camera instance of the depth sensor.
+        :param distortion: Whether the depth images are raw (distorted)
+            images and need to be undistorted.
+        """
+        h, w = camera.image_size[:2]
+        py, px = np.mgrid[:h, :w]
+        pixels = np.vstack([px.ravel(), py.ravel()]).T.astype(np.float64)
+        dist = np.zeros(5)
+        if distortion and camera.distortion_coeff is not None:
+            dist = np.asarray(camera.distortion_coeff, dtype=np.float64)
+        rays = cv2.undistortPoints(pixels.reshape(-1, 1, 2),
+                                   np.asarray(camera.camera_matrix,
+                                              dtype=np.float64),
+                                   dist).reshape(-1, 2)
+        self._size = (h, w)
+        self._ray_x = rays[:, 0].astype(np.float32)
+        # flip y axis
+        self._ray_y = -rays[:, 1].astype(np.float32)
+
+    def from_depth(self, img_depth, stride=1):
+        """Convert a depth image into a point cloud.
+
+        :param img_depth: A depth image in millimeters.
+        :param stride: Only use every stride-th pixel in each direction.
+        :return: A contiguous float32 (N, 3) numpy array holding the camera
+            coordinates (in meters) of all pixels with valid depth.
+        """
+        if img_depth.shape[:2] != self._size:
+            raise ValueError("Expected a depth image of size {}, got "
+                             "{}!".format(self._size, img_depth.shape[:2]))
+        if stride > 1:
+            idx = np.arange(self._size[0]*self._size[1]).reshape(self._size)
+            idx = idx[::stride, ::stride].ravel()
+            d = img_depth[::stride, ::stride].ravel()
+            valid = idx[d > 0]
+        else:
+            d = img_depth.ravel()
+            valid = np.flatnonzero(d > 0)
+        z = img_depth.ravel()[valid].astype(np.float32)
+        z *= 0.001
+        points = np.empty((len(valid), 3), dtype=np.float32)
+        np.multiply(self._ray_x[valid], z, out=points[:, 0])
+        np.multiply(self._ray_y[valid], z, out=points[:, 1])
+        points[:, 2] = z
+        return points
+
+
+def voxel_downsample(points, voxel_size):
+    """Downsample a point cloud by replacing all points within each cell of
+    a voxel grid by their centroid.
+
+    :param points: A (N, 3) numpy array of points.
+    :param voxel_size: The edge length of the voxels.
+    :return: A contiguous float32 (M, 3) numpy array holding the centroids
+        of the occupied voxels.
+    """
+    points = np.asarray(points)
+    if len(points) == 0:
+        return np.empty((0, 3), dtype=np.float32)
+    cells = np.floor(points/voxel_size).astype(np.int64)
+    cells -= cells.min(axis=0)
+    dims = cells.max(axis=0) + 1
+    keys = (cells[:, 0]*dims[1] + cells[:, 1])*dims[2] + cells[:, 2]
+    _, inverse = np.unique(keys, return_inverse=True)
+    counts = np.bincount(inverse).astype(np.float64)
+    centroids = np.empty((len(counts), 3), dtype=np.float32)
+    for i in range(3):
+        centroids[:, i] = np.bincount(inverse, weights=points[:, i])/counts
+    return centroids
+
+
+def transform_points(points, trafo):
+    """Apply an affine transformation to a point cloud.
+
+    :param points: A (N, 3) numpy array of points.
+    :param trafo: A 4x4 homogeneous transformation matrix.
+    :return: A contiguous float32 (N, 3) numpy array of transformed points.
+    """
+    trafo = np.asarray(trafo, dtype=np.float32)
+    out = np.dot(points, trafo[:3, :3].T)
+    out += trafo[:3, 3]
+    return out.astype(np.float32, copy=False)
+
+
+def fit_plane(points, threshold=0.01, n_hypotheses=200, n_samples=2000,
+              normal=None, max_angle=None, seed=None):
+    """Robustly fit a plane to a point cloud using RANSAC. All hypotheses
+    are generated and scored at once on a random subset of the points, the
+    best one is refined by a least-squares fit to all of its inliers.
+
+    :param points: A (N, 3) numpy array of points.
+    :param threshold: The maximum distance of inliers to the plane.
+    :param n_hypotheses: The number of plane hypotheses to test.
+    :param n_samples: The number of points to score the hypotheses on.
+    :param normal: An optional expected normal direction of the plane.
+    :param max_angle: The maximum angle in radians between the expected and
+        hypothesized normals. Required if normal is given.
+    :param seed: An optional seed for the random number generator.
+    :return: A tuple (normal, offset, inliers) of the unit plane normal n
+        and offset d such that n.p = d for points p on the plane, and a
+        boolean mask of the inliers among the points. If the expected normal
+        is given, the normal points into the same half-space.
+    :raise ValueError: If no plane could be found.
+    """
+    points = np.asarray(points, dtype=np.float64)
+    if len(points) < 3:
+        raise ValueError("Need at least 3 points to fit a plane!")
+    rng = np.random.RandomState(seed)
+    # minimal samples of three points each
+    triplets = points[rng.randint(0, len(points), (n_hypotheses, 3))]
+    normals = np.cross(triplets[:, 1] - triplets[:, 0],
+                       triplets[:, 2] - triplets[:, 0])
+    norms = np.sqrt((normals**2).sum(axis=1))
+    good = norms > 1e-9
+    if normal is not None:
+        normal = np.asarray(normal, dtype=np.float64)
+        normal /= np.linalg.norm(normal)
+        cos = np.abs(np.dot(normals, normal))/np.maximum(norms, 1e-9)
+        good &= cos >= np.cos(max_angle)
+    if not good.any():
+        raise ValueError("Found no plane hypothesis!")
+    normals = normals[good]/norms[good, np.newaxis]
+    offsets = (normals*triplets[good, 0]).sum(axis=1)
+    # score all hypotheses at once on a subset of the points
+    subset = points[rng.randint(0, len(points), min(n_samples, len(points)))]
+    distances = np.abs(np.dot(normals, subset.T) - offsets[:, np.newaxis])
+    best = np.argmax((distances <= threshold).sum(axis=1))
+    inliers = np.abs(np.dot(points, normals[best]) - offsets[best]) <= threshold
+
+    # least-squares refinement: normal is the direction of least variance
+    centroid = points[inliers].mean(axis=0)
+    _, _, vt = np.linalg.svd(points[inliers] - centroid, full_matrices=False)
+    n = vt[-1]
+    if normal is not None and np.dot(n, normal) < 0.0:
+        n = -n
+    d = np.dot(n, centroid)
+    inliers = np.abs(np.dot(points, n) - d) <= threshold
+    return n, d, inliers
+
+
+def cluster_points(points, cell_size=0.01, min_points=10):
+    """Cluster a point cloud into connected components in the x-y plane,
+    e.g., objects standing on a table. Points are hashed into a 2d grid and
+    occupied cells are connected to their 8 neighbors. Labels are propagated
+    between neighboring cells (using binary search on the sorted cell keys)
+    until they converge.
+
+    :param points: A (N, >=2) numpy array of points.
+    :param cell_size: The edge length of the grid cells.
+    :param min_points: The minimum number of points per cluster. Points in
+        smaller clusters are labeled -1.
+    :return: A (N,) numpy array of cluster labels 0, 1, ..., ordered by
+        decreasing cluster size.
+    """
+    points = np.asarray(points)
+    if len(points) == 0:
+        return np.empty(0, dtype=np.int64)
+    cells = np.floor(points[:, :2]/cell_size).astype(np.int64)
+    # leave a margin of one cell such that neighbor keys stay unique
+    cells -= cells.min(axis=0) - 1
+    width = cells[:, 1].max() + 2
+    keys, inverse = np.unique(cells[:, 0]*width + cells[:, 1],
+                              return_inverse=True)
+    neighbors = list()
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            if dx == 0 and dy == 0:
+                continue
+            nkeys = keys + dx*width + dy
+            idx = np.minimum(np.searchsorted(keys, nkeys), len(keys) - 1)
+            found = keys[idx] == nkeys
+            neighbors.append((np.flatnonzero(found), idx[found]))
+    labels = np.arange(len(keys))
+    while True:
+        previous = labels.copy()
+        for cell, neighbor in neighbors:
+            labels[cell] = np.minimum(labels[cell], labels[neighbor])
+        # pointer jumping speeds up the propagation along long chains
+        labels = labels[labels]
+        if np.array_equal(labels, previous):
+            break
+    point_labels = labels[inverse]
+    _, point_labels = np.unique(point_labels, return_inverse=True)
+    counts = np.bincount(point_labels)
+    # relabel by decreasing size, dropping small clusters
+    order = np.argsort(-counts, kind='mergesort')
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    rank[counts < min_points] = -1
+    return rank[point_labels]
+
+
+def describe_clusters(points, labels):
+    """Compute the centroid and oriented extent of each cluster.
+
+    :param points: A (N, 3) numpy array of points.
+    :param labels: A (N,) numpy array of cluster labels as returned by
+        cluster_points.
+    :return: A list of dictionaries, one per cluster, holding
+        - the centroid [x, y, z] (key: 'centroid'),
+        - the smallest enclosing rotated rectangle ((cx, cy), (w, h), angle)
+            in the x-y plane (key: 'rroi'),
+        - the minimum and maximum z coordinate (key: 'z_range') and
+        - the number of points (key: 'n_points').
+    """
+    clusters = list()
+    for label in range(labels.max() + 1 if len(labels) > 0 else 0):
+        pts = points[labels == label]
+        rroi = cv2.minAreaRect(
+            np.ascontiguousarray(pts[:, :2], dtype=np.float32).reshape(-1, 1, 2))
+        clusters.append({
+            'centroid': [float(x) for x in pts.mean(axis=0)],
+            'rroi': rroi,
+            'z_range': (float(pts[:, 2].min()), float(pts[:, 2].max())),
+            'n_points': len(pts)
+        })
+    return clusters
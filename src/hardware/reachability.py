@@ -0,0 +1,226 @@
+# Copyright (c) 2016, BRML
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import logging
+import numpy as np
+
+from kinematics import rpy_to_matrix
+
+
+class ReachabilityMap(object):
+    def __init__(self, limits, resolution, orientation, reachable,
+                 manipulability):
+        """Voxelized map of the positions within the robot's task space the
+        limbs can reach with a fixed orientation of the gripper, and of the
+        manipulability of the limbs there.
+
+        :param limits: The task space limits, a dictionary with keys
+            'x_min', 'x_max', 'y_min', 'y_max', 'z_min' and 'z_max'.
+        :param resolution: The edge length of a voxel in meters.
+        :param orientation: The orientation of the gripper the map was
+            computed for, a list [roll, pitch, yaw].
+        :param reachable: A dictionary of arm keys to boolean numpy arrays
+            of shape (nx, ny, nz).
+        :param manipulability: A dictionary of arm keys to float numpy
+            arrays of shape (nx, ny, nz), zero where not reachable.
+        """
+        self._logger = logging.getLogger('main.reachability')
+        self.limits = dict(limits)
+        self.resolution = float(resolution)
+        self.orientation = [float(a) for a in orientation]
+        self.reachable = reachable
+        self.manipulability = manipulability
+        self._origin = np.array([limits['x_min'], limits['y_min'],
+                                 limits['z_min']])
+        self._rotation = rpy_to_matrix(*self.orientation)
+        self.shape = self.grid_shape(limits=limits, resolution=resolution)
+
+    @staticmethod
+    def grid_shape(limits, resolution):
+        """Number of voxels along x, y and z to cover the task space."""
+        return tuple(int(np.ceil((limits[a + '_max'] - limits[a + '_min'])/resolution))
+                     for a in 'xyz')
+
+    @classmethod
+    def compute(cls, chains, limits, resolution=0.02,
+                orientation=(np.pi, 0.0, np.pi), seeds=None):
+        """Compute the map by solving the inverse kinematics at the center
+        of each voxel.
+
+        :param chains: A dictionary of arm keys to KinematicChain instances.
+        :param limits: The task space limits, see __init__.
+        :param resolution: The edge length of a voxel in meters.
+        :param orientation: The orientation of the gripper [roll, pitch, yaw].
+        :param seeds: An optional dictionary of arm keys to joint angles to
+            start the solver from.
+        :return: A ReachabilityMap instance.
+        """
+        shape = cls.grid_shape(limits=limits, resolution=resolution)
+        origin = np.array([limits['x_min'], limits['y_min'], limits['z_min']])
+        idx = np.indices(shape).reshape(3, -1).T
+        targets = np.tile(np.eye(4), (len(idx), 1, 1))
+        targets[:, :3, :3] = rpy_to_matrix(*orientation)
+        targets[:, :3, 3] = origin + (idx + 0.5)*resolution
+        reachable = dict()
+        manipulability = dict()
+        for arm, chain in chains.items():
+            s = None
+            if seeds is not None and arm in seeds:
+                s = np.tile(seeds[arm], (len(targets), 1))
+            valid, configs = chain.ik(targets=targets, seeds=s, seed=0)
+            m = np.zeros(len(targets))
+            if valid.any():
+                _, jac = chain.jacobian(configs[valid])
+                det = np.linalg.det(np.einsum('nij,nkj->nik', jac, jac))
+                m[valid] = np.sqrt(np.maximum(det, 0.0))
+            reachable[arm] = valid.reshape(shape)
+            manipulability[arm] = m.reshape(shape)
+        return cls(limits=limits, resolution=resolution,
+                   orientation=orientation, reachable=reachable,
+                   manipulability=manipulability)
+
+    def save(self, filename):
+        """Save the map to a npz file, storing the reachable voxels as
+        bitset and the manipulability quantized to 8 bits.
+
+        :param filename: The file name to save the map to.
+        :return:
+        """
+        arms = sorted(self.reachable)
+        data = {
+            'limits': np.array([self.limits[a + b] for a in 'xyz'
+                                for b in ['_min', '_max']]),
+            'resolution': self.resolution,
+            'orientation': np.array(self.orientation),
+            'arms': np.array(arms)
+        }
+        for arm in arms:
+            m = self.manipulability[arm]
+            scale = m.max() if m.max() > 0.0 else 1.0
+            data['reachable_' + arm] = np.packbits(self.reachable[arm].ravel())
+            data['manipulability_' + arm] = np.round(255.0*m/scale).astype(np.uint8)
+            data['scale_' + arm] = scale
+        np.savez_compressed(filename, **data)
+        self._logger.info("Saved reachability map to {}.".format(filename))
+
+    @classmethod
+    def load(cls, filename):
+        """Load a map from a npz file written by save.
+
+        :param filename: The file name to load the map from.
+        :return: A ReachabilityMap instance.
+        :raise IOError: If the file does not exist.
+        """
+        with np.load(filename) as data:
+            lim = data['limits']
+            limits = {a + b: lim[2*i + j] for i, a in enumerate('xyz')
+                      for j, b in enumerate(['_min', '_max'])}
+            resolution = float(data['resolution'])
+            shape = cls.grid_shape(limits=limits, resolution=resolution)
+            n = int(np.prod(shape))
+            reachable = dict()
+            manipulability = dict()
+            for arm in data['arms']:
+                arm = str(arm)
+                bits = np.unpackbits(data['reachable_' + arm])[:n]
+                reachable[arm] = bits.astype(bool).reshape(shape)
+                manipulability[arm] = data['manipulability_' + arm]*(
+                    float(data['scale_' + arm])/255.0)
+            orientation = data['orientation']
+        return cls(limits=limits, resolution=resolution,
+                   orientation=orientation, reachable=reachable,
+                   manipulability=manipulability)
+
+    def _index(self, positions):
+        """Compute the voxel indices of positions.
+
+        :param positions: A (N, 3) numpy array of positions.
+        :return: A tuple (idx, inside) of a (N, 3) integer numpy array and a
+            boolean numpy array indicating which positions lie within the
+            task space.
+        """
+        idx = np.floor((np.asarray(positions, dtype=np.float64).reshape(-1, 3) -
+                        self._origin)/self.resolution).astype(int)
+        inside = np.logical_and(idx >= 0, idx < self.shape).all(axis=1)
+        idx[np.logical_not(inside)] = 0
+        return idx, inside
+
+    def covers(self, rotations, tolerance=0.05):
+        """Check whether gripper orientations match the orientation the map
+        was computed for.
+
+        :param rotations: A (N, 3, 3) numpy array of rotation matrices.
+        :param tolerance: The tolerance in radians.
+        :return: A (N,) boolean numpy array.
+        """
+        # rotation angle of R^T R_map from its trace
+        trace = np.einsum('nij,ij->n', np.asarray(rotations), self._rotation)
+        return np.arccos(np.clip(0.5*(trace - 1.0), -1.0, 1.0)) <= tolerance
+
+    def is_reachable(self, positions, arm=None):
+        """Look up whether positions are reachable by a limb.
+
+        :param positions: A position [x, y, z] or a (N, 3) numpy array of
+            positions.
+        :param arm: The arm <'left', 'right'>. If None, check whether
+            either arm can reach the positions.
+        :return: A (N,) boolean numpy array, False for positions outside of
+            the task space.
+        """
+        idx, inside = self._index(positions)
+        arms = self.reachable.keys() if arm is None else [arm]
+        reachable = np.zeros(len(idx), dtype=bool)
+        for a in arms:
+            reachable |= self.reachable[a][idx[:, 0], idx[:, 1], idx[:, 2]]
+        return np.logical_and(reachable, inside)
+
+    def sample(self, arm=None, z_max=None, rng=np.random):
+        """Sample a reachable position, preferring voxels with high
+        manipulability.
+
+        :param arm: The arm <'left', 'right'>. If None, sample from the
+            positions reachable by either arm.
+        :param z_max: An optional upper bound on the z coordinate.
+        :param rng: The random number generator to use.
+        :return: The position as a list [x, y, z].
+        :raise ValueError: If no position is reachable.
+        """
+        arms = self.reachable.keys() if arm is None else [arm]
+        weights = np.zeros(self.shape)
+        for a in arms:
+            weights = np.maximum(weights, np.where(self.reachable[a],
+                                                   self.manipulability[a] + 1e-6,
+                                                   0.0))
+        if z_max is not None:
+            nz = int(np.floor((z_max - self._origin[2])/self.resolution))
+            weights[:, :, max(nz, 0):] = 0.0
+        weights = weights.ravel()
+        total = weights.sum()
+        if total <= 0.0:
+            raise ValueError("No reachable position in the task space!")
+        idx = np.searchsorted(np.cumsum(weights), total*rng.random_sample())
+        idx = np.array(np.unravel_index(min(idx, len(weights) - 1), self.shape))
+        pos = self._origin + (idx + rng.random_sample(3))*self.resolution
+        return list(pos)
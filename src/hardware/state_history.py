@@ -0,0 +1,183 @@
+# Copyright (c) 2016, BRML
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import bisect
+import threading
+
+import numpy as np
+
+
+def to_sec(stamp):
+    """Convert a rospy.Time time stamp or a float into seconds."""
+    if hasattr(stamp, 'to_sec'):
+        return stamp.to_sec()
+    return float(stamp)
+
+
+def slerp(q0, q1, t):
+    """Spherical linear interpolation between two unit quaternions.
+
+    :param q0: The quaternion [qx, qy, qz, qw] at t = 0.
+    :param q1: The quaternion [qx, qy, qz, qw] at t = 1.
+    :param t: The interpolation parameter in [0, 1].
+    :return: The interpolated quaternion as a numpy array.
+    """
+    q0 = np.asarray(q0, dtype=np.float64)
+    q1 = np.asarray(q1, dtype=np.float64)
+    dot = np.dot(q0, q1)
+    if dot < 0.0:
+        # take the shorter arc
+        q1 = -q1
+        dot = -dot
+    if dot > 0.9995:
+        q = q0 + t*(q1 - q0)
+    else:
+        theta = np.arccos(dot)
+        q = (np.sin((1.0 - t)*theta)*q0 + np.sin(t*theta)*q1)/np.sin(theta)
+    return q/np.linalg.norm(q)
+
+
+class StateHistory(object):
+    def __init__(self, size=200, max_extrapolation=0.05):
+        """Thread-safe history of time-stamped state vectors, e.g., joint
+        angles, that are interpolated linearly between samples.
+
+        :param size: The number of most recent samples to keep.
+        :param max_extrapolation: The maximum time in seconds a requested
+            time stamp may lie after the most recent sample, in which case
+            the most recent sample is returned.
+        """
+        self._size = size
+        self._max_extrapolation = max_extrapolation
+        self._stamps = list()
+        self._values = list()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return min(len(self._stamps), self._size)
+
+    def add(self, stamp, value):
+        """Add a sample. Samples older than the most recent one are
+        dropped.
+
+        :param stamp: The time stamp of the sample (rospy.Time or seconds).
+        :param value: The state vector.
+        :return:
+        """
+        stamp = to_sec(stamp)
+        value = np.asarray(value, dtype=np.float64)
+        with self._lock:
+            if len(self._stamps) > 0 and stamp <= self._stamps[-1]:
+                return
+            self._stamps.append(stamp)
+            self._values.append(value)
+            if len(self._stamps) > 2*self._size:
+                # trim in batches to keep appending amortized O(1)
+                del self._stamps[:-self._size]
+                del self._values[:-self._size]
+
+    def latest(self):
+        """Return the most recent sample without interpolation.
+
+        :return: A tuple (stamp in seconds, state vector) or None if the
+            history is empty.
+        """
+        with self._lock:
+            if len(self._stamps) == 0:
+                return None
+            return self._stamps[-1], self._values[-1]
+
+    def _interpolate(self, v0, v1, t):
+        return v0 + t*(v1 - v0)
+
+    def covers(self, stamp):
+        """Whether the state at the given time stamp can be interpolated
+        from the history, see value_at.
+
+        :param stamp: The time stamp (rospy.Time or seconds).
+        :return: Boolean flag.
+        """
+        stamp = to_sec(stamp)
+        with self._lock:
+            start = max(len(self._stamps) - self._size, 0)
+            if len(self._stamps) == 0 or stamp < self._stamps[start]:
+                return False
+            return stamp - self._stamps[-1] <= self._max_extrapolation
+
+    def value_at(self, stamp):
+        """Interpolate the state at the given time stamp.
+
+        :param stamp: The time stamp (rospy.Time or seconds).
+        :return: The state vector or None if the time stamp is not covered
+            by the history.
+        """
+        stamp = to_sec(stamp)
+        with self._lock:
+            start = max(len(self._stamps) - self._size, 0)
+            if len(self._stamps) == 0 or stamp < self._stamps[start]:
+                return None
+            idx = bisect.bisect_right(self._stamps, stamp, lo=start)
+            if idx == len(self._stamps):
+                if stamp - self._stamps[-1] > self._max_extrapolation:
+                    return None
+                return self._values[-1]
+            if idx == start:
+                return self._values[start]
+            t0, t1 = self._stamps[idx - 1], self._stamps[idx]
+            v0, v1 = self._values[idx - 1], self._values[idx]
+        return self._interpolate(v0, v1, (stamp - t0)/(t1 - t0))
+
+    def clear(self):
+        """Remove all samples."""
+        with self._lock:
+            del self._stamps[:]
+            del self._values[:]
+
+
+class PoseHistory(StateHistory):
+    def __init__(self, size=200, max_extrapolation=0.05):
+        """Thread-safe history of time-stamped poses, each one a vector
+        [x, y, z, qx, qy, qz, qw]. Positions are interpolated linearly and
+        orientations by spherical linear interpolation.
+
+        :param size: The number of most recent samples to keep.
+        :param max_extrapolation: See StateHistory.
+        """
+        super(PoseHistory, self).__init__(size=size,
+                                          max_extrapolation=max_extrapolation)
+
+    def _interpolate(self, v0, v1, t):
+        return np.concatenate((v0[:3] + t*(v1[:3] - v0[:3]),
+                               slerp(v0[3:], v1[3:], t)))
+
+    def pose_at(self, stamp):
+        """Interpolate the pose at the given time stamp.
+
+        :param stamp: The time stamp (rospy.Time or seconds).
+        :return: The pose as a numpy array [x, y, z, qx, qy, qz, qw] or None
+            if the time stamp is not covered by the history.
+        """
+        return self.value_at(stamp=stamp)
@@ -0,0 +1,217 @@
+# Copyright (c) 2016, BRML
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import numpy as np
+
+
+class JointTracker(object):
+    def __init__(self, n_joints=1, measurement_noise=0.02, process_noise=0.1,
+                 max_gap=0.5, gate=4.0, max_rejections=3, min_updates=3):
+        """Constant-velocity Kalman filter tracking the 3d positions of a
+        number of joints, e.g., the hands of a person observed by the Kinect.
+        Each joint and coordinate axis is filtered independently, which
+        reduces the filter to closed-form 2x2 updates done for all joints at
+        once.
+
+        :param n_joints: The number of joints to track.
+        :param measurement_noise: The standard deviation of the position
+            measurements in meters.
+        :param process_noise: The spectral density of the (white noise)
+            acceleration in m^2/s^3.
+        :param max_gap: The time in seconds after which the track of a joint
+            without measurements is discarded.
+        :param gate: Measurements whose root mean square normalized
+            innovation exceeds this number of standard deviations are
+            rejected as outliers.
+        :param max_rejections: The number of consecutive rejected
+            measurements after which the track of a joint is restarted.
+        :param min_updates: The number of measurements a track needs to
+            incorporate before its velocity estimate is considered
+            converged. New tracks start with zero velocity.
+        """
+        self._n = n_joints
+        self._r = measurement_noise**2
+        self._q = process_noise
+        self._max_gap = max_gap
+        self._gate = gate
+        self._max_rejections = max_rejections
+        self._min_updates = min_updates
+
+        self._stamp = None
+        self._last_seen = None
+        self._pos = None
+        self._vel = None
+        self._p00 = None
+        self._p01 = None
+        self._p11 = None
+        self._rejections = None
+        self._updates = None
+        self.reset()
+
+    def reset(self):
+        """Discard all tracks.
+
+        :return:
+        """
+        shape = (self._n, 3)
+        self._stamp = None
+        self._last_seen = np.full(self._n, -np.inf)
+        self._pos = np.full(shape, np.nan)
+        self._vel = np.zeros(shape)
+        self._p00 = np.zeros(shape)
+        self._p01 = np.zeros(shape)
+        self._p11 = np.zeros(shape)
+        self._rejections = np.zeros(self._n, dtype=np.int64)
+        self._updates = np.zeros(self._n, dtype=np.int64)
+
+    @property
+    def stamp(self):
+        """The time stamp in seconds of the latest update or None."""
+        return self._stamp
+
+    def _predict(self, dt):
+        """Propagate the state and covariance by dt seconds."""
+        q = self._q
+        self._pos += self._vel*dt
+        self._p00 += 2.0*dt*self._p01 + dt*dt*self._p11 + q*dt**3/3.0
+        self._p01 += dt*self._p11 + q*dt*dt/2.0
+        self._p11 += q*dt
+
+    def update(self, stamp, positions):
+        """Update the tracks with new position measurements.
+
+        :param stamp: The time stamp of the measurements in seconds.
+        :param positions: A (n_joints, 3) array of measured positions.
+            Joints with non-finite coordinates are treated as not observed.
+        :return: Whether the measurements were used, i.e., were newer than
+            the previous update.
+        """
+        if self._stamp is not None and stamp <= self._stamp:
+            return False
+        z = np.asarray(positions, dtype=np.float64).reshape(self._n, 3)
+        if self._stamp is not None:
+            self._predict(dt=stamp - self._stamp)
+        self._stamp = stamp
+
+        observed = np.isfinite(z).all(axis=1)
+        lost = (stamp - self._last_seen > self._max_gap) | \
+            (self._rejections >= self._max_rejections)
+        start = observed & lost
+        # outlier gating on the normalized innovation of tracked joints
+        s = self._p00 + self._r
+        y = z - self._pos
+        with np.errstate(invalid='ignore'):
+            d2 = (y*y/s).sum(axis=1)
+            accepted = observed & ~lost & (d2 <= 3.0*self._gate**2)
+        rejected = observed & ~lost & ~accepted
+        self._rejections[rejected] += 1
+        self._rejections[accepted | start] = 0
+        self._last_seen[accepted | start] = stamp
+        self._updates[accepted] += 1
+        self._updates[start] = 1
+
+        if accepted.any():
+            s = s[accepted]
+            k0 = self._p00[accepted]/s
+            k1 = self._p01[accepted]/s
+            y = y[accepted]
+            self._pos[accepted] += k0*y
+            self._vel[accepted] += k1*y
+            p00 = self._p00[accepted]
+            p01 = self._p01[accepted]
+            self._p11[accepted] -= k1*p01
+            self._p01[accepted] = (1.0 - k0)*p01
+            self._p00[accepted] = (1.0 - k0)*p00
+        if start.any():
+            # (re-)initialize with zero velocity and large velocity variance
+            self._pos[start] = z[start]
+            self._vel[start] = 0.0
+            self._p00[start] = self._r
+            self._p01[start] = 0.0
+            self._p11[start] = 1.0
+        return True
+
+    def is_tracked(self, stamp=None):
+        """Which joints are currently tracked.
+
+        :param stamp: The time in seconds to check for. If None, the time of
+            the latest update is used.
+        :return: A boolean array of length n_joints.
+        """
+        if stamp is None:
+            stamp = self._stamp
+        if stamp is None:
+            return np.zeros(self._n, dtype=bool)
+        return stamp - self._last_seen <= self._max_gap
+
+    def is_converged(self, stamp=None):
+        """Which joints are tracked and have incorporated enough
+        measurements for their velocity estimate to be meaningful.
+
+        :param stamp: The time in seconds to check for. If None, the time of
+            the latest update is used.
+        :return: A boolean array of length n_joints.
+        """
+        return self.is_tracked(stamp=stamp) & \
+            (self._updates >= self._min_updates)
+
+    @property
+    def position(self):
+        """The (n_joints, 3) array of filtered positions at the time of the
+        latest update. Untracked joints are NaN.
+        """
+        pos = self._pos.copy()
+        pos[~self.is_tracked()] = np.nan
+        return pos
+
+    @property
+    def velocity(self):
+        """The (n_joints, 3) array of filtered velocities in m/s at the time
+        of the latest update. Untracked joints are NaN.
+        """
+        vel = self._vel.copy()
+        vel[~self.is_tracked()] = np.nan
+        return vel
+
+    @property
+    def position_std(self):
+        """The (n_joints, 3) array of position standard deviations in
+        meters at the time of the latest update.
+        """
+        return np.sqrt(self._p00)
+
+    def predict(self, stamp):
+        """Predict the joint positions at a given time assuming constant
+        velocity.
+
+        :param stamp: The time in seconds to predict the positions for.
+        :return: A (n_joints, 3) array of predicted positions. Untracked
+            joints are NaN.
+        """
+        if self._stamp is None:
+            return np.full((self._n, 3), np.nan)
+        pos = self._pos + self._vel*(stamp - self._stamp)
+        pos[~self.is_tracked()] = np.nan
+        return pos
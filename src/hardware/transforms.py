@@ -0,0 +1,242 @@
+# Copyright (c) 2016, BRML
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import collections
+import threading
+
+import numpy as np
+
+from state_history import to_sec
+
+
+def invert_hom(hom, out=None):
+    """Invert homogeneous transformation matrices of rigid body motions.
+
+    :param hom: A (..., 4, 4) numpy array.
+    :param out: An optional numpy array of the same shape to write into.
+    :return: The inverse transformation matrices.
+    """
+    if out is None:
+        out = np.empty_like(hom)
+    rot_t = np.swapaxes(hom[..., :3, :3], -1, -2)
+    out[..., :3, :3] = rot_t
+    out[..., :3, 3] = -np.einsum('...ij,...j->...i', rot_t, hom[..., :3, 3])
+    out[..., 3, :3] = 0.0
+    out[..., 3, 3] = 1.0
+    return out
+
+
+class TransformGraph(object):
+    def __init__(self, cache_size=16):
+        """In-process tree of coordinate frames connected by static or
+        dynamic (time-dependent) homogeneous transformations.
+
+        Compositions of static transformations are memoized. Dynamic
+        transformations and compositions involving them are cached per time
+        stamp, such that repeated queries for the same state are answered
+        without recomputation. Returned transformations are shared and
+        therefore read-only.
+
+        :param cache_size: The number of time stamps to cache per dynamic
+            transformation and per query.
+        """
+        self._parents = dict()
+        self._static = dict()
+        self._dynamic = dict()
+        self._cache_size = cache_size
+        self._edge_cache = dict()
+        self._query_cache = dict()
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _frozen(hom):
+        hom = np.array(hom, dtype=np.float64)
+        if hom.shape != (4, 4):
+            raise ValueError("Expected a 4x4 homogeneous transformation "
+                             "matrix, got {}!".format(hom.shape))
+        hom.flags.writeable = False
+        return hom
+
+    def _add_edge(self, parent, child):
+        if child in self._parents and self._parents[child] != parent:
+            raise ValueError("Frame '{}' already has parent frame "
+                             "'{}'!".format(child, self._parents[child]))
+        self._parents[child] = parent
+        self._static.pop(child, None)
+        self._dynamic.pop(child, None)
+        self._edge_cache.pop(child, None)
+        # compositions may involve the changed edge
+        self._query_cache.clear()
+
+    def set_static(self, parent, child, hom):
+        """Set the static transformation of the child frame relative to its
+        parent frame, i.e., mapping child coordinates into parent
+        coordinates.
+
+        :param parent: The name of the parent frame.
+        :param child: The name of the child frame.
+        :param hom: The homogeneous transformation matrix (a 4x4 array).
+        :return:
+        """
+        with self._lock:
+            self._add_edge(parent=parent, child=child)
+            self._static[child] = self._frozen(hom)
+
+    def set_dynamic(self, parent, child, lookup):
+        """Set a time-dependent transformation of the child frame relative
+        to its parent frame.
+
+        :param parent: The name of the parent frame.
+        :param child: The name of the child frame.
+        :param lookup: A callable taking a time stamp in seconds (or None
+            for the current state) and returning the homogeneous
+            transformation matrix (a 4x4 array) at that time.
+        :return:
+        """
+        with self._lock:
+            self._add_edge(parent=parent, child=child)
+            self._dynamic[child] = lookup
+
+    def has_frame(self, frame):
+        """Whether a frame is part of the graph."""
+        with self._lock:
+            return frame in self._parents or frame in self._parents.values()
+
+    def _ancestors(self, frame):
+        """The frame and its ancestors up to the root of the tree."""
+        path = [frame]
+        while path[-1] in self._parents:
+            path.append(self._parents[path[-1]])
+        return path
+
+    def _is_static(self, path):
+        return all(frame in self._static for frame in path)
+
+    def _edge(self, child, stamp):
+        """The transformation of a frame relative to its parent frame."""
+        if child in self._static:
+            return self._static[child]
+        if stamp is None:
+            return self._frozen(self._dynamic[child](None))
+        cache = self._edge_cache.setdefault(child, collections.OrderedDict())
+        hom = cache.pop(stamp, None)
+        if hom is None:
+            hom = self._frozen(self._dynamic[child](stamp))
+            while len(cache) >= self._cache_size:
+                cache.popitem(last=False)
+        cache[stamp] = hom
+        return hom
+
+    def _chain(self, path, stamp):
+        """Compose the transformations along a path of frames from a frame
+        up to (excluding) an ancestor frame.
+        """
+        hom = np.eye(4)
+        for frame in reversed(path):
+            hom = np.dot(hom, self._edge(child=frame, stamp=stamp))
+        return hom
+
+    def _compose(self, target, source, stamp):
+        src = self._ancestors(source)
+        tgt = self._ancestors(target)
+        common = [f for f in src if f in set(tgt)]
+        if len(common) == 0:
+            raise ValueError("Frames '{}' and '{}' are not "
+                             "connected!".format(target, source))
+        src = src[:src.index(common[0])]
+        tgt = tgt[:tgt.index(common[0])]
+        hom = self._chain(path=src, stamp=stamp)
+        if len(tgt) > 0:
+            hom = np.dot(invert_hom(self._chain(path=tgt, stamp=stamp)), hom)
+        return hom, self._is_static(src + tgt)
+
+    def lookup(self, target, source, stamp=None, out=None):
+        """Look up the transformation mapping coordinates in the source frame
+        into coordinates in the target frame.
+
+        :param target: The name of the target frame.
+        :param source: The name of the source frame.
+        :param stamp: The time stamp (rospy.Time or seconds) to evaluate
+            dynamic transformations at, or None for the current state, in
+            which case the result is not cached.
+        :param out: An optional preallocated 4x4 numpy array to write the
+            result into.
+        :return: The homogeneous transformation matrix (a read-only 4x4
+            numpy array, or out if given).
+        :raise ValueError: If the frames are not connected.
+        """
+        if stamp is not None:
+            stamp = to_sec(stamp)
+        with self._lock:
+            key = (target, source)
+            cache = self._query_cache.get(key)
+            hom = None
+            if cache is not None:
+                # static compositions are stored under the key None
+                hom = cache.get(None, cache.get(stamp) if stamp is not None else None)
+            if hom is None:
+                hom, static = self._compose(target=target, source=source,
+                                            stamp=stamp)
+                hom = self._frozen(hom)
+                if static or stamp is not None:
+                    cache = self._query_cache.setdefault(key, collections.OrderedDict())
+                    while len(cache) >= self._cache_size:
+                        cache.popitem(last=False)
+                    cache[None if static else stamp] = hom
+        if out is not None:
+            out[...] = hom
+            return out
+        return hom
+
+    def lookup_batch(self, target, source, stamps, out=None):
+        """Look up the transformations mapping coordinates in the source
+        frame into coordinates in the target frame for a number of time
+        stamps.
+
+        :param target: The name of the target frame.
+        :param source: The name of the source frame.
+        :param stamps: A list of time stamps (rospy.Time or seconds).
+        :param out: An optional preallocated (N, 4, 4) numpy array to write
+            the results into.
+        :return: A (N, 4, 4) numpy array.
+        """
+        if out is None:
+            out = np.empty((len(stamps), 4, 4))
+        for idx, stamp in enumerate(stamps):
+            self.lookup(target=target, source=source, stamp=stamp,
+                        out=out[idx])
+        return out
+
+    def transform_points(self, target, source, points, stamp=None):
+        """Transform points from the source frame into the target frame.
+
+        :param target: The name of the target frame.
+        :param source: The name of the source frame.
+        :param points: A (N, 3) numpy array of points in source coordinates.
+        :param stamp: The time stamp, see lookup.
+        :return: A (N, 3) numpy array of points in target coordinates.
+        """
+        hom = self.lookup(target=target, source=source, stamp=stamp)
+        return np.dot(np.asarray(points), hom[:3, :3].T) + hom[:3, 3]
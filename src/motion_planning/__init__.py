@@ -10,3 +10,4 @@ generator.
 """
 
 from simple import SimplePlanner
+from trajectory import TrajectoryPlanner
@@ -0,0 +1,114 @@
+# Copyright (c) 2016, BRML
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import numpy as np
+
+from base import MotionPlanner
+
+
+class TrajectoryPlanner(MotionPlanner):
+    def __init__(self, rate=100.0, max_velocity=1.0, max_acceleration=2.0):
+        """Motion planner for velocity control, interpolating between joint
+        configurations with cubic splines that pass through intermediate
+        waypoints without stopping.
+
+        Each iteration yields a dictionary of joint name keys to joint
+        velocities for one control period of 1/rate seconds. The velocities
+        are the exact differences between consecutive samples of the spline,
+        such that integrating them from the start configuration yields the
+        reference configuration of the trajectory.
+
+        :param rate: The control rate in Hz.
+        :param max_velocity: The maximum joint velocity in rad/s.
+        :param max_acceleration: The maximum joint acceleration in rad/s^2.
+        """
+        super(TrajectoryPlanner, self).__init__()
+        self.controller_type = 'velocity'
+        self.rate = float(rate)
+        self.max_velocity = max_velocity
+        self.max_acceleration = max_acceleration
+        self.start = None
+        self.end = None
+        self.duration = 0.0
+
+    def _durations(self, points):
+        """Duration of each segment such that a cubic segment starting and
+        ending at rest respects the velocity and acceleration limits.
+        """
+        dist = np.abs(np.diff(points, axis=0)).max(axis=1)
+        return np.maximum(np.maximum(1.5*dist/self.max_velocity,
+                                     np.sqrt(6.0*dist/self.max_acceleration)),
+                          1.0/self.rate)
+
+    @staticmethod
+    def _velocities(points, durations):
+        """Velocities at the waypoints. The limb comes to rest at the start
+        and end configuration and at waypoints where a joint reverses its
+        direction of motion.
+        """
+        slopes = np.diff(points, axis=0)/durations[:, np.newaxis]
+        vel = np.zeros_like(points)
+        if len(points) > 2:
+            inner = 0.5*(slopes[:-1] + slopes[1:])
+            inner[slopes[:-1]*slopes[1:] <= 0.0] = 0.0
+            vel[1:-1] = inner
+        return vel
+
+    def plan(self, start, end, waypoints=None, **kwargs):
+        """Plan a trajectory from the start to the end configuration through
+        a number of intermediate configurations.
+
+        :param start: Dictionary of joint name keys to start joint angles.
+        :param end: Dictionary of joint name keys to end joint angles.
+        :param waypoints: An optional list of dictionaries of joint name
+            keys to intermediate joint angles.
+        :return:
+        """
+        names = sorted(end.keys())
+        configs = [start] + ([] if waypoints is None else list(waypoints)) + [end]
+        points = np.array([[c[n] for n in names] for c in configs])
+        durations = self._durations(points)
+        vel = self._velocities(points, durations)
+        knots = np.concatenate(([0.0], np.cumsum(durations)))
+
+        # sample the piecewise cubic Hermite spline at the control rate
+        n = int(np.ceil(knots[-1]*self.rate))
+        t = np.minimum(np.arange(n + 1)/self.rate, knots[-1])
+        seg = np.clip(np.searchsorted(knots, t, side='right') - 1,
+                      0, len(durations) - 1)
+        h = durations[seg][:, np.newaxis]
+        s = ((t - knots[seg])/durations[seg])[:, np.newaxis]
+        h00 = 2*s**3 - 3*s**2 + 1
+        h10 = s**3 - 2*s**2 + s
+        h01 = -2*s**3 + 3*s**2
+        h11 = s**3 - s**2
+        samples = h00*points[seg] + h10*h*vel[seg] + \
+            h01*points[seg + 1] + h11*h*vel[seg + 1]
+        steps = np.diff(samples, axis=0)*self.rate
+
+        self.start = dict(zip(names, points[0]))
+        self.end = dict(zip(names, points[-1]))
+        self.duration = knots[-1]
+        self._trajectory = [dict(zip(names, step)) for step in steps]
@@ -120,7 +120,7 @@ class Servoing(object):
         rospy.sleep(self._tsleep)
         return rroi, det['id']
 
-    def estimate_distance(self, object_id, rroi, arm):
+    def estimate_distance(self, object_id, rroi, arm, stamp=None):
         """Estimate the distance to the object.
 
         :param object_id: The object identifier of the object to estimate the
@@ -128,11 +128,13 @@ class Servoing(object):
         :param rroi: The rotated rectangle enclosing the segmented object,
             given by ((cx, cy), (w, h), alpha).
         :param arm: The arm <'left', 'right'> to control.
+        :param stamp: An optional time stamp of the image the object was
+            detected in.
         :return: The approximate distance from the gripper to the object.
         """
         raise NotImplementedError()
 
-    def _pixel_to_camera_factor(self, object_id, rroi, arm):
+    def _pixel_to_camera_factor(self, object_id, rroi, arm, stamp=None):
         """Scale factor mapping from pixels to meters at the current distance.
 
         :param object_id: The object identifier of the object to estimate the
@@ -140,14 +142,17 @@ class Servoing(object):
         :param rroi: The rotated rectangle enclosing the segmented object,
             given by ((cx, cy), (w, h), alpha).
         :param arm: The arm <'left', 'right'> to control.
+        :param stamp: An optional time stamp of the image the object was
+            detected in.
         :return: The scale factor.
         """
         return (
             self._robot.cameras[arm].meters_per_pixel *
-            self.estimate_distance(arm=arm, rroi=rroi, object_id=object_id)
+            self.estimate_distance(arm=arm, rroi=rroi, object_id=object_id,
+                                   stamp=stamp)
         )
 
-    def _error(self, image_size, object_id, rroi, arm):
+    def _error(self, image_size, object_id, rroi, arm, stamp=None):
         """Convert the offset between the object's center and the image
         center in pixels into the corresponding offset in meters.
 
@@ -157,22 +162,27 @@ class Servoing(object):
         :param rroi: The rotated rectangle enclosing the segmented object,
             given by ((cx, cy), (w, h), alpha).
         :param arm: The arm <'left', 'right'> to control.
+        :param stamp: An optional time stamp of the image the object was
+            detected in.
         :return: The position error in meters.
         """
         h, w = image_size
         pixel_delta = [a - b for a, b in zip((w//2, h//2), rroi[0])]
         pixel_error = np.sqrt(np.dot(pixel_delta, pixel_delta))
         p2c_factor = self._pixel_to_camera_factor(object_id=object_id,
-                                                  rroi=rroi, arm=arm)
+                                                  rroi=rroi, arm=arm,
+                                                  stamp=stamp)
         camera_error = pixel_error*p2c_factor
         if camera_error < 0.0:
             self._logger.error("Distances are < 0 m! Is your table height "
                                "estimate correct?")
         return pixel_error*p2c_factor
 
-    def update_pose(self, arm, object_id, rroi, img_size):
+    def update_pose(self, arm, object_id, rroi, img_size, stamp=None):
         """Update the end effector pose according to the estimated pose of
-        the detected object.
+        the detected object. If the time stamp of the image is given, the
+        update is computed relative to the pose of the end effector at the
+        time the image was taken.
 
         :param arm: The arm <'left', 'right'> to control.
         :param object_id: The object identifier of the object to estimate the
@@ -181,6 +191,8 @@ class Servoing(object):
             given by ((cx, cy), (w, h), alpha).
         :param img_size: The size of the image in which the object was
             detected.
+        :param stamp: An optional time stamp of the image the object was
+            detected in.
         :return:
         """
         kp = 0.9  # proportional control parameter
@@ -190,20 +202,21 @@ class Servoing(object):
         d_pixel = [a - b for a, b in zip((w//2, h//2), rroi[0])]
         # delta in camera space
         p2c_factor = self._pixel_to_camera_factor(object_id=object_id,
-                                                  rroi=rroi, arm=arm)
+                                                  rroi=rroi, arm=arm,
+                                                  stamp=stamp)
         d_cam = [x*p2c_factor for x in d_pixel]
         # delta in robot space
         # assuming that orientation of end effector is perpendicular to table
-        rot = self._robot.hom_camera_to_robot(arm=arm)[:2, :2]
+        rot = self._robot.hom_camera_to_robot(arm=arm, stamp=stamp)[:2, :2]
         d_rob = np.dot(rot, d_cam)
         # update
         dx, dy = [-x*kp for x in d_rob]
         dz = -self.estimate_distance(arm=arm, rroi=rroi,
-                                     object_id=object_id)/3.0
+                                     object_id=object_id, stamp=stamp)/3.0
         self._logger.debug("Computed position update is ({: .3f}, "
                            "{: .3f}, {: .3f}) m.".format(dx, dy, dz))
 
-        pose = self._robot.endpoint_pose(arm=arm)
+        pose = self._robot.endpoint_pose(arm=arm, stamp=stamp)
         pose = [a + b for a, b in zip(pose, [dx, dy, dz,
                                              0, 0, -np.deg2rad(rroi[2])])]
         if pose[2] < self._robot.z_table:
@@ -230,7 +243,7 @@ class Servoing(object):
         """
         it = 0
         while not rospy.is_shutdown():
-            img = self._robot.cameras[arm].collect_image()
+            stamp, img = self._robot.cameras[arm].collect_frame()
             try:
                 rroi, oid = self._find_rotated_enclosing_rect(image=img,
                                                               object_id=object_id)
@@ -241,7 +254,7 @@ class Servoing(object):
                 object_id = oid
             camera_error = self._error(image_size=img.shape[:2],
                                        object_id=object_id, rroi=rroi,
-                                       arm=arm)
+                                       arm=arm, stamp=stamp)
             accept = camera_error <= self._tolerance()
             self._logger.info("In iteration {}, error is {:.4f} m {} {:.4f} "
                               "m.".format(it, camera_error,
@@ -250,7 +263,8 @@ class Servoing(object):
             if accept:
                 break
             try:
-                self.update_pose(arm=arm, object_id=object_id, rroi=rroi, img_size=img.shape[:2])
+                self.update_pose(arm=arm, object_id=object_id, rroi=rroi,
+                                 img_size=img.shape[:2], stamp=stamp)
             except ValueError as e:
                 self._logger.error(e)
                 return False
@@ -27,7 +27,7 @@ from base import Servoing
 
 
 class ServoingDistance(Servoing):
-    def estimate_distance(self, object_id, rroi, arm):
+    def estimate_distance(self, object_id, rroi, arm, stamp=None):
         """Estimate the distance to the object from
         - the measured pose of the end effector and
         - the measured height of the table top in robot coordinates
@@ -39,9 +39,11 @@ class ServoingDistance(Servoing):
         :param rroi: The rotated rectangle enclosing the segmented object,
             given by ((cx, cy), (w, h), alpha).
         :param arm: The arm <'left', 'right'> to control.
+        :param stamp: An optional time stamp of the image the object was
+            detected in.
         :return: The approximate distance from the gripper to the object.
         """
-        return self._robot.endpoint_pose(arm=arm)[2] - self._robot.z_table
+        return self._robot.endpoint_pose(arm=arm, stamp=stamp)[2] - self._robot.z_table
 
     def correct_height(self, arm):
         """Make sure the gripper height is appropriate before attempting to
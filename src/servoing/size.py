@@ -31,7 +31,7 @@ class ServoingSize(Servoing):
         """The tolerance required to achieve for accepting a grasp pose."""
         return 5*self._tol
 
-    def estimate_distance(self, object_id, rroi, arm):
+    def estimate_distance(self, object_id, rroi, arm, stamp=None):
         """Estimate the distance to the object from
         - the known size of the object in meters,
         - the meters per pixel at one meter reference distance and
@@ -44,6 +44,8 @@ class ServoingSize(Servoing):
         :param rroi: The rotated rectangle enclosing the segmented object,
             given by ((cx, cy), (w, h), alpha).
         :param arm: The arm <'left', 'right'> to control.
+        :param stamp: An optional time stamp of the image the object was
+            detected in.
         :return: The approximate distance from the gripper to the object.
         """
         size_meters = self._object_size_meters[object_id]
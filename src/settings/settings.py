@@ -30,6 +30,18 @@ import os
 
 # The name or IP of the host PC on which the ELTE Kinect Windows server runs.
 elte_kinect_win_host = '10.162.85.173'
+# Whether to continuously collect Kinect color and skeleton data in the
+# background, and the maximum age (in seconds) of streamed data to accept.
+kinect_streaming = True
+kinect_max_age = 0.2
+# The time (in seconds) ahead for which the position of the human hand is
+# predicted, and the maximum speed (in m/s) of the hand for the prediction
+# to be used as a target.
+hand_prediction_horizon = 0.3
+hand_max_speed = 0.2
+# The time (in seconds) to wait for the human to take an object out of the
+# gripper before opening the gripper.
+handover_timeout = 10.0
 
 
 # The directory on the Ubuntu machine where the 'py-faster-rcnn' and 'mnc'
@@ -73,6 +85,12 @@ object_size_meters = {
     'remote': 0.036,
     '_book_': 999.99
 }
+# Whether to locate objects on the table from Kinect depth data, and the
+# maximum relative difference between the measured and known object sizes.
+# The Kinect is only used if an external calibration of the setup is
+# available.
+object_localization_from_kinect = False
+object_size_tolerance = 0.3
 # The set of objects we know about and Baxter should be able to grasp.
 # Needed for the object detection and object segmentation algorithms as well
 # as setting up the simulation environment (stripped of the background class)
@@ -107,6 +125,29 @@ servo_tolerance_meters = 0.003
 baxter_cam_exposure = 10
 
 
+# The backend to solve the inverse kinematics with. Can be one of
+# <'service', 'local'>. The 'local' backend solves with a kinematic model of
+# the robot first and sends only the poses it failed on to the robot's
+# inverse kinematics service. Both backends reject poses out of reach of the
+# arm without calling the service.
+ik_backend = 'service'
+
+# The policy to select an arm with if both arms can reach a pose. Can be one
+# of <'distance', 'free'>, i.e., the arm closest to the pose in joint space or
+# an arm not holding an object (ties are broken by joint space distance).
+ik_arm_selection = 'distance'
+
+# The controller to execute motions with. Can be one of <'position',
+# 'velocity'>. Velocity control streams joint velocities at control_rate (in
+# Hz) and does not stop at intermediate waypoints. The joint velocities and
+# accelerations of planned trajectories are limited to control_max_velocity
+# (in rad/s) and control_max_acceleration (in rad/s^2).
+control_mode = 'position'
+control_rate = 100.0
+control_max_velocity = 1.0
+control_max_acceleration = 2.0
+
+
 # The threshold for the color change in a table view image patch in percent.
 # Needed to detect empty spots on the table.
 color_change_threshold = 2.0
@@ -125,6 +166,17 @@ world_space_limits_m = copy.copy(task_space_limits_m)
 world_space_limits_m['z_min'] += 0.92
 world_space_limits_m['z_max'] += 0.92
 
+# Whether to estimate the table height from Kinect depth data, the minimum
+# fraction of points in the task space lying on the fitted table plane to
+# accept the estimate, and whether to verify the estimate by measuring the
+# table height with the robot's limb. If the difference exceeds the
+# tolerance (in meters), the measured table height is used. The Kinect is
+# only used if an external calibration of the setup is available.
+table_height_from_kinect = False
+table_height_min_confidence = 0.5
+table_height_verification = False
+table_height_tolerance = 0.01
+
 # The robot's task space limits in hand camera pixel coordinates
 # (in an image taken with the limb in calibration_pose).
 table_limits = ((250, 175), (1030, 650))